@@ -1,12 +1,7 @@
 import streamlit as st
-import pandas as pd
-from src import home
-from src import sim_bg 
-from src import sim_vg
-from src import dataset
-from src import go_analog_bg
-from src import go_analog_vg
-from src import how_it_works
+from src import startup
+
+# Page modules are imported the first time they're selected (see startup)
 
 def main():
 
@@ -16,18 +11,24 @@ def main():
 
     selection = st.sidebar.radio("Go to", list(pages.keys()))
 
-    page = pages.get(selection)
-    page.app()
+    page = startup.load_page(pages.get(selection))
+    try:
+        with startup.timing('first render ' + pages.get(selection)):
+            page.app()
+    finally:
+        # With GO_ANALOG_WARMUP=1, load the other pages' data in the background once something is on screen
+        startup.warm_up()
 
 pages = {
-    "Home": home,
-    "Go Analog: VG ⮕ BG": go_analog_bg,
-    "Go Analog: VG ⮕ VG": go_analog_vg,
-    "Convert VG ⮕ BG": sim_bg,
-    "Convert VG ⮕ VG": sim_vg,
-    "Dataset": dataset,
-    "How's it work?": how_it_works
+    "Home": 'home',
+    "Go Analog: VG ⮕ BG": 'go_analog_bg',
+    "Go Analog: VG ⮕ VG": 'go_analog_vg',
+    "Game night: group ⮕ BG": 'game_night',
+    "Convert VG ⮕ BG": 'sim_bg',
+    "Convert VG ⮕ VG": 'sim_vg',
+    "Dataset": 'dataset',
+    "How's it work?": 'how_it_works'
     }
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from src import go_analog_core as core
+from src.scoring import normalize_ratings
+
+# Headless batch mode: scores many Steam profiles or manual game lists offline
+#
+#   python -m src.batch_recommend users.jsonl recommendations.csv --platform bgg --workers 4
+#
+# Input formats
+#   .txt   : one Steam id per line
+#   .jsonl : {"user": ..., "steam_id": "..."} or {"user": ..., "games": ["Portal 2", ...]}
+#            (games can also be [name, playtime in minutes] pairs)
+#   .csv   : columns user, steam_id or columns user, game (and optionally playtime)
+# Output is CSV, or Parquet if the output filename ends in .parquet (needs pyarrow)
+# Data, matrix format and data version are the web app's (GO_ANALOG_DATA_DIR,
+# ISM_FORMAT, GO_ANALOG_DATA_ROOT... see go_analog_core), scoring is
+# go_analog_core.recommend_users. Games that aren't in the dataset are skipped
+# and reported per user
+
+# Weight for manually selected games, same as the web app
+manual_playtime = 2
+
+
+def read_profiles(filepath):
+    '''
+    Returns a list of dicts with a user and either a steam_id or games
+    '''
+    if filepath.endswith('.jsonl'):
+        with open(filepath, encoding='utf-8') as f:
+            profiles = [json.loads(line) for line in f if line.strip()]
+
+    elif filepath.endswith('.csv'):
+        df = pd.read_csv(filepath, dtype={'steam_id': str, 'user': str})
+        if 'steam_id' in df.columns:
+            profiles = [{'user': user, 'steam_id': steam_id}
+                        for (user, steam_id) in zip(df.get('user', df.steam_id), df.steam_id)]
+        else:
+            if 'playtime' in df.columns:
+                df = df.assign(game=[[game, playtime] for (game, playtime) in zip(df.game, df.playtime)])
+            profiles = [{'user': user, 'games': games.tolist()}
+                        for (user, games) in df.groupby('user', sort=False).game]
+
+    else:
+        with open(filepath, encoding='utf-8') as f:
+            profiles = [{'steam_id': line.strip()} for line in f if line.strip()]
+
+    for (i, profile) in enumerate(profiles):
+        profile.setdefault('user', profile.get('steam_id', i))
+    return profiles
+
+
+def profile_games(profile, platform='bgg', fetched=None):
+    '''
+    Returns (list of (game name, normalized playtime) tuples, names of unknown games)
+    for a profile (same transformations as the web app)
+    fetched : steam id -> list of (game name, playtime) tuples (see go_analog_core.get_group_games)
+    '''
+    if 'games' not in profile:
+        # Games that aren't in the dataset were dropped when the profile was fetched
+        return normalize_ratings(fetched[str(profile['steam_id']).strip()]), []
+
+    games = profile['games']
+    manual = all(isinstance(game, str) for game in games)
+    if manual:
+        games = [(game, manual_playtime) for game in games]
+    games, unknown = core.split_known_games([(name, playtime) for (name, playtime) in games], platform)
+    if manual:
+        return games, unknown
+    return normalize_ratings(games), unknown
+
+
+def score_profiles(users, platform='bgg', top=20, min_neighbors=2, neighbor_cutoff=0.1,
+                   based_on_n=3, popular_games=True, version=None):
+    '''
+    Scores a list of (user, [(game name, playtime), …]) with go_analog_core.recommend_users
+    Returns a DataFrame with the top recommendations (positive scores) for every user
+    '''
+    if len(users) == 0:
+        return pd.DataFrame(columns=['User', 'Game', 'Score', 'Recommended because…', 'My Ranking'])
+
+    with core.using_data_version(version):
+        recommendations = core.recommend_users([games for (user, games) in users], platform=platform,
+                                               min_neighbors=min_neighbors, neighbor_cutoff=neighbor_cutoff,
+                                               based_on_n=based_on_n, popular_games=popular_games, top=top)
+    for ((user, _), df) in zip(users, recommendations):
+        df.insert(0, 'User', user)
+    return pd.concat(recommendations, ignore_index=True)
+
+
+def _score_chunk(users, settings):
+    return score_profiles(users, **settings)
+
+
+def run_batch(profiles, platform='bgg', steam_api_key=None, workers=1, chunk_size=256,
+              fetch_workers=core.group_fetch_workers, **settings):
+    '''
+    Resolves and scores profiles
+    Returns (recommendations DataFrame, {user: error}, {user: names of unknown games})
+    Steam profiles are fetched fetch_workers at a time with the web app's client,
+    users are scored chunk_size at a time, spread over a process pool if workers > 1
+    '''
+    with core.using_data_version() as version:
+        steam_ids = [profile['steam_id'] for profile in profiles if 'games' not in profile]
+        fetched, fetch_errors = {}, {}
+        if steam_api_key and steam_ids:
+            fetched, fetch_errors = core.get_group_games(steam_ids, steam_api_key, max_workers=fetch_workers)
+
+        users = []
+        errors = {}
+        unknown = {}
+        for profile in profiles:
+            user = profile['user']
+            steam_id = str(profile.get('steam_id', '')).strip()
+            if 'games' not in profile and not steam_api_key:
+                errors[user] = 'no Steam API key (set API_KEY)'
+            elif 'games' not in profile and steam_id in fetch_errors:
+                errors[user] = fetch_errors[steam_id]
+            else:
+                games, unknown_games = profile_games(profile, platform, fetched)
+                if len(unknown_games) > 0:
+                    unknown[user] = unknown_games
+                if len(games) == 0:
+                    errors[user] = 'no games in the dataset with enough playtime'
+                else:
+                    users.append((user, games))
+
+        chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+        # Workers score the same data version as the rest of the batch
+        settings = dict(settings, platform=platform, version=version)
+
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_score_chunk, chunks, [settings] * len(chunks)))
+        else:
+            results = [score_profiles(chunk, **settings) for chunk in chunks]
+
+    if len(results) == 0:
+        return score_profiles([], **settings), errors, unknown
+    return pd.concat(results, ignore_index=True), errors, unknown
+
+
+def write_output(df, filepath):
+    if filepath.endswith('.parquet'):
+        df.to_parquet(filepath, index=False)
+    else:
+        df.to_csv(filepath, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score many Steam profiles or game lists offline')
+    parser.add_argument('input', help='.txt (Steam ids), .jsonl or .csv file of profiles')
+    parser.add_argument('output', help='.csv or .parquet file for the recommendations')
+    parser.add_argument('--platform', choices=['bgg', 'steam'], default='bgg')
+    parser.add_argument('--top', type=int, default=20, help='recommendations per user')
+    parser.add_argument('--min-neighbors', type=int, default=2)
+    parser.add_argument('--neighbor-cutoff', type=float, default=0.1)
+    parser.add_argument('--based-on-n', type=int, default=3)
+    parser.add_argument('--no-popular', action='store_true', help="don't recommend games just because they're popular")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=256, help='users per matrix product')
+    parser.add_argument('--fetch-workers', type=int, default=core.group_fetch_workers,
+                        help='Steam profiles fetched at the same time')
+    args = parser.parse_args(argv)
+
+    recommendations, errors, unknown = run_batch(read_profiles(args.input),
+                                                 platform=args.platform,
+                                                 steam_api_key=os.environ.get('API_KEY'),
+                                                 workers=args.workers,
+                                                 chunk_size=args.chunk_size,
+                                                 fetch_workers=args.fetch_workers,
+                                                 top=args.top,
+                                                 min_neighbors=args.min_neighbors,
+                                                 neighbor_cutoff=args.neighbor_cutoff,
+                                                 based_on_n=args.based_on_n,
+                                                 popular_games=not args.no_popular)
+    write_output(recommendations, args.output)
+
+    for (user, games) in unknown.items():
+        print(str(user) + ': skipped games not in the dataset: ' + ', '.join(map(str, games)), file=sys.stderr)
+    for (user, error) in errors.items():
+        print(str(user) + ': ' + error, file=sys.stderr)
+    print('Scored ' + str(recommendations.User.nunique()) + ' users, ' + str(len(errors)) + ' failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import platform as platform_info
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+from src.similarity_store import create_similarity_matrix
+from src.neighbor_index import build_neighbor_index
+
+# Benchmarks for the recommendation and similarity hot paths, on synthetic data
+# No streamlit or network needed
+#
+#   python -m src.benchmark run results.json --catalog-sizes 1000 10000 --library-sizes 3 100 1000
+#   python -m src.benchmark compare before.json after.json
+#
+# For every catalog size (board games), writes a dataset in the web app layout
+# (info tables, ism_bgg, ism_bgg_neighbors) with video_games video games, and
+# runs the stages against it in a fresh process (so the core loads that dataset).
+# For every library size (games a user plays), times
+#   load         : matrix, catalogs, alignment and table renderer (caches cleared)
+#   normalize    : normalize_ratings on the Steam playtimes
+#   filter       : the user's columns of the matrix
+#   neighbors    : neighbor counts
+#   dot_product  : predicted scores
+#   explanation  : 'Recommended because…' games and text for every game with neighbors
+#   full_table   : build_recommendations (every game, sorted)
+#   top_n        : select_recommendations (the games the page shows)
+#   annotation   : annotate_table on the full table
+#   render       : render_games on the top games
+#   recommend    : recommend_games end to end, recommendation cache cleared
+#   cached       : recommend_games for the same profile again
+#   find_similar : find_similar_games for a random video game
+# and reports p50/p95/mean latency (ms) and the peak memory allocated by the stage (MB, tracemalloc)
+
+default_catalog_sizes = (1000, 10000)
+default_library_sizes = (3, 100, 1000)
+# Matrix columns: at least this many, more if a library size is bigger
+default_video_games = 2000
+settings = {'min_neighbors': 3, 'neighbor_cutoff': 0.15, 'based_on_n': 3}
+top = 20
+show_columns = ['Title', 'My Ranking', 'BGG Ranking', 'BGG Rating', 'Release', 'Tags', 'Recommended because…']
+
+
+# Synthetic data
+
+def _titles(names, url):
+    return ['<a href="' + url + str(i) + '/">' + name + '</a><br><img src="' + url + str(i) +
+            '/header.jpg" alt="' + name + '"width="200px">' for (i, name) in enumerate(names)]
+
+
+def _info(names, rng, platform):
+    n = len(names)
+    average = rng.normal(6, 1, n)
+    info = {'Id': np.arange(n) + 1,
+            'Name': names,
+            'Title': _titles(names, 'https://example.com/' + platform + '/'),
+            'Release': rng.randint(1980, 2022, n)}
+    if platform == 'bgg':
+        info['BGG Ranking'] = ['#' + str(rank) for rank in rng.permutation(n) + 1]
+        info['BGG Rating'] = average.round(1)
+    else:
+        info['Steam Rating'] = [str(rating) + '% (' + str(reviews) + ' reviews)'
+                                for (rating, reviews) in zip(rng.randint(40, 100, n), rng.randint(10, 10000, n))]
+    info['Average Rating'] = average
+    info['Average Rating Z'] = (average - average.mean()) / average.std()
+    tags = np.array(['Strategy', 'Card Game', 'Fantasy', 'Economic', 'Dice', 'Puzzle', 'Party', 'Wargame'])
+    info['Tags'] = [', '.join(rng.choice(tags, 3, replace=False)) for _ in range(n)]
+    return pd.DataFrame(info)
+
+
+def make_dataset(path, catalog_size, video_games=default_video_games, rank=32, block_size=1024, seed=0,
+                 users=0, games_per_user=12):
+    '''
+    Writes a synthetic dataset in the web app layout to path
+    Similarities come from random low-rank game embeddings, so games have
+    realistic neighbor structure (a few strong neighbors, mostly weak ones)
+    With users, also writes the raw go_analog_dataset CSVs (see build_similarity):
+    games_per_user ratings and playtimes per user, from the same embeddings
+    '''
+    rng = np.random.RandomState(seed)
+    bg_names = np.array(['Board Game ' + str(i) for i in range(catalog_size)], dtype=object)
+    vg_names = np.array(['Video Game ' + str(i) for i in range(video_games)], dtype=object)
+    os.makedirs(path, exist_ok=True)
+    _info(bg_names, rng, 'bgg').to_csv(os.path.join(path, 'bg_info_for_app.csv'), index=False)
+    _info(vg_names, rng, 'steam').to_csv(os.path.join(path, 'vg_info_for_app.csv'), index=False)
+
+    bg_factors = rng.normal(size=(catalog_size, rank))
+    vg_factors = rng.normal(size=(video_games, rank))
+    bg_factors /= np.linalg.norm(bg_factors, axis=1)[:, None]
+    vg_factors /= np.linalg.norm(vg_factors, axis=1)[:, None]
+    values = create_similarity_matrix(os.path.join(path, 'ism_bgg'), bg_names, vg_names, names=('Game', 'Game'))
+    for start in range(0, catalog_size, block_size):
+        values[start:start + block_size] = bg_factors[start:start + block_size].dot(vg_factors.T)
+    values.flush()
+    del values
+    build_neighbor_index(os.path.join(path, 'ism_bgg'), os.path.join(path, 'ism_bgg_neighbors'))
+    if users:
+        _raw_dataset(path, bg_factors, vg_factors, users, games_per_user, rng)
+
+
+def _raw_dataset(path, bg_factors, vg_factors, users, games_per_user, rng):
+    # Users like games close to their taste: ratings 1-10, playtimes in minutes
+    tastes = rng.normal(size=(users, bg_factors.shape[1]))
+    tastes /= np.linalg.norm(tastes, axis=1)[:, None]
+    bgg = []
+    steam = []
+    for (user, taste) in enumerate(tastes):
+        name = 'user' + str(user)
+        games = rng.choice(len(bg_factors), games_per_user, replace=False)
+        ratings = np.clip(np.round(5.5 + 4.5 * bg_factors[games].dot(taste) + rng.normal(0, 1, len(games))), 1, 10)
+        bgg += [(name, game + 1, rating) for (game, rating) in zip(games, ratings)]
+        games = rng.choice(len(vg_factors), games_per_user, replace=False)
+        playtimes = np.exp(6 + 2 * vg_factors[games].dot(taste) + rng.normal(0, 1, len(games))).astype(int) + 10
+        steam += [(name, game + 1, playtime) for (game, playtime) in zip(games, playtimes)]
+
+    pd.DataFrame(bgg, columns=['User', 'Game', 'Rating']).to_csv(os.path.join(path, 'BoardGameRatings.csv'),
+                                                                 index=False)
+    pd.DataFrame(steam, columns=['User', 'Game', 'Playtime']).to_csv(os.path.join(path, 'VideoGamePlaytimes.csv'),
+                                                                     index=False)
+    for (filename, info) in (('BoardGames.csv', 'bg_info_for_app.csv'), ('VideoGames.csv', 'vg_info_for_app.csv')):
+        pd.read_csv(os.path.join(path, info))[['Id', 'Name']].to_csv(os.path.join(path, filename), index=False)
+
+
+def make_library(names, size, rng):
+    '''
+    Steam library: list of (game name, playtime in minutes) tuples
+    '''
+    games = rng.choice(names, size, replace=False)
+    playtimes = np.maximum(rng.lognormal(6, 1.5, size).astype(int), 10)
+    return list(zip(games, playtimes.tolist()))
+
+
+# Timing
+
+def time_stage(func, repeats):
+    '''
+    Runs func repeats times (after one warm-up run)
+    Returns (latencies in ms, peak MB allocated during one more traced run)
+    '''
+    func()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1e3)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return latencies, peak / 2 ** 20
+
+
+def summarize(stage, latencies, peak_mb, **labels):
+    return dict(labels,
+                stage=stage,
+                p50_ms=round(float(np.percentile(latencies, 50)), 3),
+                p95_ms=round(float(np.percentile(latencies, 95)), 3),
+                mean_ms=round(float(np.mean(latencies)), 3),
+                peak_mb=round(peak_mb, 3),
+                repeats=len(latencies))
+
+
+def _set_data_dir(data_dir):
+    # Runs before the worker imports the core, which reads its paths from the environment
+    os.environ['GO_ANALOG_DATA_DIR'] = data_dir
+
+
+def _run_catalog(catalog_size, library_sizes, repeats, seed):
+    from src import go_analog_core as core
+    from src.scoring import (neighbor_counts, predict_scores, top_n_columns, explain,
+                             build_recommendations, select_recommendations)
+    from src.quantization import dequantize
+
+    results = []
+
+    def load():
+        core.clear_cache()
+        core.load_bgg_data()
+        core.load_bg_catalog()
+        core.load_vg_catalog()
+        core.load_bgg_alignment()
+        core.load_bg_renderer()
+
+    results.append(summarize('load', *time_stage(load, repeats), catalog_size=catalog_size, library_size=0))
+
+    ism = core.load_bgg_data()
+    aligned = core.load_bgg_alignment()
+    neighbor_index = core.load_bgg_neighbors()
+    rng = np.random.RandomState(seed)
+    for library_size in library_sizes:
+        library = make_library(ism.columns, library_size, rng)
+        games = core.normalize_ratings(library)
+        names = [game for (game, playtime) in games]
+        playtimes = np.array([playtime for (game, playtime) in games])
+        columns = aligned.matrix_columns[core.load_vg_catalog().positions(names)]
+        rows = np.ones(len(ism.index), dtype=bool)
+
+        # Intermediate results of every stage, for the next stage
+        values = dequantize(ism.to_numpy().take(columns, axis=1)[rows])
+        with_neighbors = np.flatnonzero(neighbor_counts(values, settings['neighbor_cutoff']) >= settings['min_neighbors'])
+        neighbors = values[with_neighbors]
+        predictions = predict_scores(neighbors, playtimes)
+        sim_games = top_n_columns(neighbors, settings['based_on_n'])
+        full = build_recommendations(ism.index, names, with_neighbors, predictions, sim_games,
+                                     averages=aligned.row_averages)
+        shown = select_recommendations(ism.index, names, with_neighbors, predictions, sim_games, top,
+                                       averages=aligned.row_averages, rows=aligned.row_positions >= 0)
+        video_games = rng.choice(neighbor_index.columns, repeats + 2)
+
+        stages = [
+            ('normalize', lambda: core.normalize_ratings(library)),
+            ('filter', lambda: dequantize(ism.to_numpy().take(columns, axis=1)[rows])),
+            ('neighbors', lambda: neighbor_counts(values, settings['neighbor_cutoff'])),
+            ('dot_product', lambda: predict_scores(neighbors, playtimes)),
+            ('explanation', lambda: explain(top_n_columns(neighbors, settings['based_on_n']), names)),
+            ('full_table', lambda: build_recommendations(ism.index, names, with_neighbors, predictions, sim_games,
+                                                         averages=aligned.row_averages)),
+            ('top_n', lambda: select_recommendations(ism.index, names, with_neighbors, predictions, sim_games, top,
+                                                     averages=aligned.row_averages,
+                                                     rows=aligned.row_positions >= 0)),
+            ('annotation', lambda: core.annotate_table(full, platform='bgg')),
+            ('render', lambda: core.render_games(shown, show_columns, 'bgg', 'Score', top, True)),
+        ]
+
+        def recommend():
+            core.recommendation_cache.clear()
+            core.recommend_games(games, 'bgg', top=top, **settings)
+
+        stages.append(('recommend', recommend))
+        stages.append(('cached', lambda: core.recommend_games(games, 'bgg', top=top, **settings)))
+        lookups = iter(video_games)
+        stages.append(('find_similar', lambda: core.find_similar_games(next(lookups), neighbor_index)))
+
+        for (stage, func) in stages:
+            results.append(summarize(stage, *time_stage(func, repeats), catalog_size=catalog_size,
+                                     library_size=library_size))
+    return results
+
+
+def run(catalog_sizes=default_catalog_sizes, library_sizes=default_library_sizes,
+        video_games=None, repeats=20, seed=0, work_dir=None):
+    '''
+    Runs the benchmarks, returns {'meta': {...}, 'results': [one dict per catalog size, library size and stage]}
+    Library sizes above video_games (see default_video_games) are skipped with a warning
+    '''
+    if video_games is None:
+        video_games = max([default_video_games] + list(library_sizes))
+    skipped = [size for size in library_sizes if size > video_games]
+    if skipped:
+        print('Skipping library sizes ' + ', '.join(map(str, skipped)) + ' (more than ' + str(video_games) +
+              ' video games, see --video-games)', file=sys.stderr)
+    library_sizes = [size for size in library_sizes if size <= video_games]
+    root = tempfile.mkdtemp(dir=work_dir)
+    results = []
+    try:
+        for catalog_size in catalog_sizes:
+            data_dir = os.path.join(root, str(catalog_size))
+            make_dataset(data_dir, catalog_size, video_games, seed=seed)
+
+            # Fresh process for every dataset, so the core loads it and caches don't carry over
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn'),
+                                     initializer=_set_data_dir, initargs=(data_dir,)) as pool:
+                results += pool.submit(_run_catalog, catalog_size, library_sizes, repeats, seed).result()
+            shutil.rmtree(data_dir)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform_info.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform_info.platform(),
+            'cpus': os.cpu_count(),
+            'video_games': video_games,
+            'skipped_library_sizes': skipped,
+            'repeats': repeats,
+            'settings': settings}
+    return {'meta': meta, 'results': results}
+
+
+def compare(before, after, threshold=1.2):
+    '''
+    Joins two runs on catalog size, library size and stage
+    Returns a DataFrame with the p50 latencies, their ratio, and whether the stage regressed
+    '''
+    keys = ['catalog_size', 'library_size', 'stage']
+    df = pd.DataFrame(before['results'])[keys + ['p50_ms', 'peak_mb']].merge(
+        pd.DataFrame(after['results'])[keys + ['p50_ms', 'peak_mb']], on=keys, suffixes=('_before', '_after'))
+    df['ratio'] = (df.p50_ms_after / df.p50_ms_before).round(2)
+    df['regressed'] = df.ratio > threshold
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the recommendation hot paths on synthetic data')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmarks and save the results as JSON')
+    run_parser.add_argument('output', help='.json file for the results')
+    run_parser.add_argument('--catalog-sizes', type=int, nargs='+', default=list(default_catalog_sizes))
+    run_parser.add_argument('--library-sizes', type=int, nargs='+', default=list(default_library_sizes))
+    run_parser.add_argument('--video-games', type=int, default=None,
+                            help='matrix columns (default: ' + str(default_video_games) +
+                                 ' or the largest library size), library sizes above this are skipped')
+    run_parser.add_argument('--repeats', type=int, default=20)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--work-dir', default=None, help='where the synthetic datasets are written')
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=1.2,
+                                help='p50 ratio above which a stage counts as a regression')
+    args = parser.parse_args(argv)
+
+    pd.set_option('display.width', 200)
+    if args.command == 'run':
+        out = run(args.catalog_sizes, args.library_sizes, args.video_games, args.repeats, args.seed, args.work_dir)
+        with open(args.output, 'w') as f:
+            json.dump(out, f, indent=1)
+        print(pd.DataFrame(out['results']).drop(columns='repeats').to_string(index=False))
+    elif args.command == 'compare':
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        df = compare(before, after, args.threshold)
+        print(df.to_string(index=False))
+        sys.exit(1 if df.regressed.any() else 0)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.similarity_store import create_similarity_matrix
+from src.quantization import quantize
+from src import dataset_cache
+
+# Scripted build of the item similarity matrices from go_analog_dataset
+#
+#   python -m src.build_similarity go_analog_dataset web_app_dataset --workers 4
+#   python -m src.build_similarity go_analog_dataset web_app_dataset --cached   (CSVs through dataset_cache)
+#   python -m src.build_similarity go_analog_dataset web_app_dataset --keep-state   (state for incremental_similarity)
+#
+# Same preprocessing as web_app_dataset/app_dataset.ipynb, but the user-item
+# matrices stay sparse (games x users, only the ratings users actually gave)
+# and cosine similarity is computed block_size rows at a time across a process
+# pool. Every finished block is rounded and written straight into the on-disk
+# similarity store, so neither the dense user-item matrices nor the full
+# similarity matrix are ever held in memory
+# (scipy is only needed here, see requirements.txt)
+
+default_block_size = 256
+
+_worker = {}
+
+
+def read_dataset(dataset_dir, cached=False):
+    '''
+    Returns (bgg ratings, steam playtimes, video games, board games) DataFrames
+    With cached, the CSVs are read through the columnar cache (see dataset_cache),
+    which is quicker after the first run but has float32 ratings
+    '''
+    read_csv = dataset_cache.read_csv if cached else pd.read_csv
+    bgg = read_csv(os.path.join(dataset_dir, 'BoardGameRatings.csv'))
+    steam = read_csv(os.path.join(dataset_dir, 'VideoGamePlaytimes.csv'))
+    vg = read_csv(os.path.join(dataset_dir, 'VideoGames.csv'))
+    bg = read_csv(os.path.join(dataset_dir, 'BoardGames.csv'))
+    return bgg, steam, vg, bg
+
+
+def _ranges(order, ptr, nodes):
+    # Records of every node in nodes, concatenated (order and ptr from _csr)
+    starts = ptr[nodes]
+    lengths = ptr[nodes + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return order[offsets + np.arange(lengths.sum())]
+
+
+def _csr(codes, n):
+    order = np.argsort(codes, kind='stable')
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=n), out=ptr[1:])
+    return order, ptr
+
+
+def prune_ratings(bgg, steam, min_scores_per_user=10, min_scores_per_game=5, verbose=False):
+    '''
+    k-core pruning of both rating tables jointly: keeps the largest set of users
+    and games where every user has min_scores_per_user+ reviews on both platforms
+    and every game has min_scores_per_game+ reviews
+    (same result as pruning each table and keeping shared users until nothing changes)
+
+    Users and games are integer coded and removed in passes from a queue of games
+    and users under the minimum, and each review is removed at most once, so time
+    is linear in the number of reviews
+    Returns the pruned (bgg, steam) DataFrames
+    '''
+    tables = [bgg, steam]
+    user_codes, users = pd.factorize(pd.concat([bgg.User, steam.User], ignore_index=True))
+    n_users = len(users)
+    min_user = max(min_scores_per_user, 1)
+
+    records = []
+    for (t, df) in enumerate(tables):
+        user = user_codes[:len(bgg)] if t == 0 else user_codes[len(bgg):]
+        game, games = pd.factorize(df.Game)
+        records.append({'user': user, 'game': game,
+                        'alive': np.ones(len(df), dtype=bool),
+                        'by_user': _csr(user, n_users),
+                        'by_game': _csr(game, len(games)),
+                        'game_degree': np.bincount(game, minlength=len(games)),
+                        'game_removed': np.zeros(len(games), dtype=bool)})
+    user_degrees = [np.bincount(r['user'], minlength=n_users) for r in records]
+    user_removed = np.zeros(n_users, dtype=bool)
+
+    queue_users = np.flatnonzero((user_degrees[0] < min_user) | (user_degrees[1] < min_user))
+    queue_games = [np.flatnonzero(r['game_degree'] < min_scores_per_game) for r in records]
+    lengths = [len(df) for df in tables]
+    n_pass = 0
+
+    while len(queue_users) > 0 or any(len(queue) > 0 for queue in queue_games):
+        n_pass += 1
+        before = list(lengths)
+        user_removed[queue_users] = True
+        for (t, r) in enumerate(records):
+            r['game_removed'][queue_games[t]] = True
+
+        touched_users = []
+        touched_games = []
+        for (t, r) in enumerate(records):
+            dead = np.concatenate([_ranges(*r['by_user'], queue_users),
+                                   _ranges(*r['by_game'], queue_games[t])])
+            dead = np.unique(dead[r['alive'][dead]])
+            r['alive'][dead] = False
+            lengths[t] -= len(dead)
+            np.subtract.at(user_degrees[t], r['user'][dead], 1)
+            np.subtract.at(r['game_degree'], r['game'][dead], 1)
+            touched_users.append(r['user'][dead])
+            touched_games.append(np.unique(r['game'][dead]))
+
+        # Queue the users and games that dropped under the minimum this pass
+        touched = np.unique(np.concatenate(touched_users))
+        touched = touched[~user_removed[touched]]
+        queue_users = touched[(user_degrees[0][touched] < min_user) | (user_degrees[1][touched] < min_user)]
+        queue_games = [games[~r['game_removed'][games] & (r['game_degree'][games] < min_scores_per_game)]
+                       for (r, games) in zip(records, touched_games)]
+
+        if verbose:
+            print('pass ' + str(n_pass))
+            print('bgg length before and after pruning: ' + str(before[0]) + ' -> ' + str(lengths[0]))
+            print('steam length before and after pruning: ' + str(before[1]) + ' -> ' + str(lengths[1]) + '\n')
+
+    return bgg[records[0]['alive']], steam[records[1]['alive']]
+
+
+def _dedupe_names(df):
+    # Steam/BGG id in parens for games that share a name
+    duped = df.Name.duplicated(keep=False)
+    df.loc[duped, 'Name'] = df.loc[duped, 'Name'] + ' (' + df.loc[duped, 'Id'].astype(str) + ')'
+    return df
+
+
+def add_z_scores(bgg, steam):
+    '''
+    Adds per-user z-scores: Rating_Z for bgg, Playtime_Z (of log playtimes) for steam
+    '''
+    grouped = bgg.groupby('User')
+    bgg = bgg.assign(Rating_Z=(bgg.Rating - grouped.Rating.transform('mean')) / grouped.Rating.transform('std'))
+    steam = steam.assign(Playtime_Log=np.log(steam.Playtime))
+    grouped = steam.groupby('User')
+    steam = steam.assign(Playtime_Z=(steam.Playtime_Log - grouped.Playtime_Log.transform('mean'))
+                                    / grouped.Playtime_Log.transform('std'))
+    return bgg, steam
+
+
+def prepare_ratings(bgg, steam, vg, bg, cutoff_users=10, cutoff_games=5, verbose=False):
+    '''
+    Preprocessing from the notebook: drops short playtimes and delisted games,
+    prunes to users on both platforms with cutoff_users+ reviews and games with
+    cutoff_games+ reviews (see prune_ratings), adds per-user z-scores (Rating_Z, Playtime_Z) and
+    makes game names unique
+    '''
+    # Users need at least 10 minutes to decide if it's a bad game
+    steam = steam[steam.Playtime >= 10]
+
+    # Exclude games no longer on Steam / BoardGameGeek
+    vg = vg[vg.Name.notnull()]
+    steam = steam[steam.Game.isin(vg.Id)]
+    bg = bg[bg.Name.notnull()]
+    bgg = bgg[bgg.Game.isin(bg.Id)]
+
+    bgg, steam = prune_ratings(bgg, steam, min_scores_per_user=cutoff_users,
+                               min_scores_per_game=cutoff_games, verbose=verbose)
+
+    bgg, steam = add_z_scores(bgg, steam)
+
+    vg = _dedupe_names(vg[vg.Id.isin(steam.Game)].copy())
+    bg = _dedupe_names(bg.copy())
+    return bgg, steam, vg, bg
+
+
+def user_item_matrix(df, value_column, users, games=None):
+    '''
+    Sparse (games x users) CSR matrix of df[value_column], games sorted by id
+    (or in the order of games, if given; ratings of other games are dropped)
+    Missing ratings (and NaN z-scores) are zeros, same as pivot(...).to_numpy(na_value=0)
+    Returns (matrix, game ids)
+    '''
+    df = df[df[value_column].notnull()]
+    if games is None:
+        games, game_positions = np.unique(df.Game.to_numpy(), return_inverse=True)
+    else:
+        game_positions = pd.Index(games).get_indexer(df.Game)
+        df = df[game_positions >= 0]
+        game_positions = game_positions[game_positions >= 0]
+    user_positions = pd.Index(users).get_indexer(df.User)
+    matrix = sparse.csr_matrix((df[value_column].to_numpy(dtype=np.float64),
+                                (game_positions, user_positions)),
+                               shape=(len(games), len(users)))
+    return matrix, games
+
+
+def unit_rows(matrix):
+    '''
+    Scales every row to length 1 (rows of zeros stay zeros), so dot products are cosine similarities
+    '''
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return sparse.csr_matrix(sparse.diags(scale) @ matrix)
+
+
+def _init_worker(rows, columns_t, cosine):
+    _worker['rows'] = rows
+    _worker['columns_t'] = columns_t
+    _worker['cosine'] = cosine
+
+
+def _similarity_block(start, stop):
+    block = (_worker['rows'][start:stop] @ _worker['columns_t']).toarray()
+    if _worker['cosine']:
+        block = np.clip(block, -1.0, 1.0).round(2)
+    return start, block
+
+
+def build_similarity_matrix(row_ui, column_ui, path, rows, columns, block_size=default_block_size,
+                            workers=1, dtype='float64', cosine=True):
+    '''
+    Cosine similarity between every row of row_ui and every row of column_ui
+    (both sparse games x users), written block by block to the similarity store at path
+    rows and columns are the labels (game names)
+    With cosine=False, writes the raw dot products instead (see incremental_similarity)
+    '''
+    values = create_similarity_matrix(path, rows, columns, dtype=dtype)
+    if cosine:
+        row_ui = unit_rows(row_ui)
+        column_ui = unit_rows(column_ui)
+    row_unit = sparse.csr_matrix(row_ui)
+    column_unit_t = sparse.csc_matrix(column_ui.T)
+    starts = range(0, row_unit.shape[0], block_size)
+
+    def write(start, block):
+        values[start:start + len(block)] = quantize(block, dtype)
+
+    if workers > 1 and len(starts) > 1:
+        # Keep a few blocks in flight per worker so finished blocks don't pile up in memory
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(row_unit, column_unit_t, cosine)) as pool:
+            pending = set()
+            for start in starts:
+                pending.add(pool.submit(_similarity_block, start, start + block_size))
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(*future.result())
+            for future in pending:
+                write(*future.result())
+    else:
+        _init_worker(row_unit, column_unit_t, cosine)
+        for start in starts:
+            write(*_similarity_block(start, start + block_size))
+        _worker.clear()
+
+    values.flush()
+    del values
+
+
+def build_matrices(bgg, steam, vg, bg, out_dir, block_size=default_block_size, workers=1,
+                   dtype='float64', bg_ids=None, vg_ids=None):
+    '''
+    Builds ism_bgg (board games x video games) and ism_steam (video games x video games)
+    in out_dir from prepared ratings (see prepare_ratings)
+    bg_ids and vg_ids fix the rows and columns, otherwise every rated game is included
+    Returns (board game ids, video game ids)
+    '''
+    users = np.unique(np.concatenate([bgg.User.unique(), steam.User.unique()]))
+    ui_bgg, bg_ids = user_item_matrix(bgg, 'Rating_Z', users, games=bg_ids)
+    ui_steam, vg_ids = user_item_matrix(steam, 'Playtime_Z', users, games=vg_ids)
+
+    # Games without a name keep their id, same as DataFrame.rename in the notebook
+    steam_names_key = dict(zip(vg.Id, vg.Name))
+    bgg_names_key = dict(zip(bg.Id, bg.Name))
+    vg_names = [steam_names_key.get(game, game) for game in vg_ids]
+    bg_names = [bgg_names_key.get(game, game) for game in bg_ids]
+
+    build_similarity_matrix(ui_bgg, ui_steam, os.path.join(out_dir, 'ism_bgg'), bg_names, vg_names,
+                            block_size=block_size, workers=workers, dtype=dtype)
+    build_similarity_matrix(ui_steam, ui_steam, os.path.join(out_dir, 'ism_steam'), vg_names, vg_names,
+                            block_size=block_size, workers=workers, dtype=dtype)
+    return bg_ids, vg_ids
+
+
+def build_all(dataset_dir, out_dir, block_size=default_block_size, workers=1, dtype='float64',
+              cutoff_users=10, cutoff_games=5, keep_state=False, cached=False, verbose=False):
+    '''
+    Builds ism_bgg (board games x video games) and ism_steam (video games x video games) in out_dir
+    With keep_state, also saves what incremental updates need to out_dir/ism_state
+    (see incremental_similarity)
+    '''
+    bgg, steam, vg, bg = prepare_ratings(*read_dataset(dataset_dir, cached=cached), cutoff_users=cutoff_users,
+                                         cutoff_games=cutoff_games, verbose=verbose)
+    bg_ids, vg_ids = build_matrices(bgg, steam, vg, bg, out_dir, block_size=block_size,
+                                    workers=workers, dtype=dtype)
+    if keep_state:
+        from src.incremental_similarity import save_state, state_dirname
+        save_state(bgg, steam, os.path.join(out_dir, state_dirname), bg_ids, vg_ids,
+                   block_size=block_size, workers=workers)
+
+    return {'users': len(set(bgg.User)),
+            'board_games': len(bg_ids),
+            'video_games': len(vg_ids),
+            'ratings': len(bgg) + len(steam)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the item similarity matrices from the Go Analog dataset')
+    parser.add_argument('dataset_dir', help='directory with the go_analog_dataset csv files')
+    parser.add_argument('out_dir', help='directory for ism_bgg and ism_steam (e.g. web_app_dataset)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--block-size', type=int, default=default_block_size, help='rows per block')
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32', 'float16', 'int8'])
+    parser.add_argument('--min-reviews-per-user', type=int, default=10)
+    parser.add_argument('--min-reviews-per-game', type=int, default=5)
+    parser.add_argument('--keep-state', action='store_true',
+                        help='save ratings and dot products for incremental updates')
+    parser.add_argument('--cached', action='store_true',
+                        help='read the csv files through the columnar cache (float32 ratings)')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    report = build_all(args.dataset_dir, args.out_dir, block_size=args.block_size, workers=args.workers,
+                       dtype=args.dtype, cutoff_users=args.min_reviews_per_user,
+                       cutoff_games=args.min_reviews_per_game, keep_state=args.keep_state,
+                       cached=args.cached, verbose=True)
+    for (key, value) in report.items():
+        print(key + ': ' + str(value))
+    print('Built in ' + str(round(time.time() - start, 1)) + 's')
+
+
+if __name__ == '__main__':
+    main()
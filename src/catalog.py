@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# Integer positions for games
+# A Catalog maps Steam/BGG ids and game names to positions in a platform's info
+# table once, and a MatrixAlignment maps those positions to similarity matrix
+# rows and columns, so requests only do integer indexing on arrays
+
+
+class Catalog:
+    '''
+    Game info for one platform (bg_info_for_app.csv or vg_info_for_app.csv)
+    '''
+
+    def __init__(self, info):
+        self.info = info.reset_index(drop=True)
+        self.names = pd.Index(self.info.Name)
+        self.ids = pd.Index(self.info.Id)
+        self.sorted_names = sorted(self.names)
+        self.average_z = self.info['Average Rating Z'].round(2).to_numpy()
+
+    def __len__(self):
+        return len(self.info)
+
+    def positions(self, names):
+        '''
+        Catalog position for every game name (-1 if it isn't in the catalog)
+        '''
+        return self.names.get_indexer(names)
+
+    def id_positions(self, ids):
+        '''
+        Catalog position for every Steam/BGG id (-1 if it isn't in the catalog)
+        '''
+        return self.ids.get_indexer(ids)
+
+    def named_playtimes(self, id_playtimes):
+        '''
+        Converts (Steam id, playtime) tuples to (game name, playtime) tuples,
+        dropping games that aren't in the catalog
+        '''
+        positions = self.id_positions([game_id for (game_id, playtime) in id_playtimes])
+        return [(self.names[position], playtime)
+                for (position, (game_id, playtime)) in zip(positions, id_playtimes) if position >= 0]
+
+    def annotate(self, df, on='Game'):
+        '''
+        Adds info columns to df, dropping games that aren't in the catalog
+        (same result as an inner merge of df[on] against Name)
+        '''
+        positions = self.positions(df[on])
+        found = positions >= 0
+        left = df[found].reset_index(drop=True)
+        right = self.info.take(positions[found]).reset_index(drop=True)
+        return pd.concat([left, right], axis=1)
+
+
+def _inverse(positions, size):
+    # For every catalog position, the matrix row/column it's in (-1 if none)
+    inverse = np.full(size + 1, -1)
+    found = positions >= 0
+    inverse[positions[found]] = np.flatnonzero(found)
+    return inverse
+
+
+class MatrixAlignment:
+    '''
+    Integer mappings between a similarity matrix and the catalogs of its rows and columns
+
+    Arrays indexed by catalog position have one extra trailing entry (-1),
+    so looking up a missing game (position -1) gives -1 instead of a real row
+    '''
+
+    def __init__(self, ism, row_catalog, column_catalog):
+        self.row_positions = row_catalog.positions(ism.index)
+        self.column_positions = column_catalog.positions(ism.columns)
+        self.matrix_rows = _inverse(self.row_positions, len(row_catalog))
+        self.matrix_columns = _inverse(self.column_positions, len(column_catalog))
+
+        # Dataset average for every matrix row, -100 if the game has no info
+        self.row_averages = np.append(row_catalog.average_z, -100.0)[self.row_positions]
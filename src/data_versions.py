@@ -0,0 +1,238 @@
+import argparse
+import os
+import shutil
+import sys
+import time
+from src.similarity_store import write_json, read_json
+
+# Versioned data directory, so refreshed data can be swapped into running servers
+#
+#   python -m src.data_versions publish web_app_dataset --root /srv/go_analog_data
+#   GO_ANALOG_DATA_ROOT=/srv/go_analog_data streamlit run app.py
+#   python -m src.data_versions status --root /srv/go_analog_data
+#   python -m src.data_versions rollback <version> --root /srv/go_analog_data
+#
+# Layout
+#   root/manifest.json : {"current": version, "versions": {version: {"published": ..., "source": ...,
+#                         "files": {name: bytes}}}}
+#   root/<version>/    : a complete web app data directory (info CSVs, matrices, neighbor indexes...)
+#
+# A version directory is written under a hidden name and renamed once it's
+# complete, then the manifest is replaced atomically, so readers only ever see
+# complete versions. Servers poll the manifest (see go_analog_core.check_data_version),
+# load a new current version in the background and swap it in; each process
+# pins the versions it has loaded (root/<version>/.attached/<pid>) and cleanup
+# only removes versions that aren't current and that no live process has pinned
+#
+# The shared-memory copies of the similarity stores (see shared_store) are a
+# root in the same layout, publish --shared-root mirrors a version there
+
+manifest_filename = 'manifest.json'
+attached_dirname = '.attached'
+
+
+def read_manifest(root):
+    try:
+        return read_json(os.path.join(root, manifest_filename))
+    except FileNotFoundError:
+        return {'current': None, 'versions': {}}
+
+
+def write_manifest(manifest, root):
+    filepath = os.path.join(root, manifest_filename)
+    tmp_filepath = filepath + '.' + str(os.getpid()) + '.tmp'
+    write_json(manifest, tmp_filepath)
+    os.replace(tmp_filepath, filepath)
+
+
+def current_version(root):
+    return read_manifest(root).get('current')
+
+
+def manifest_mtime(root):
+    try:
+        return os.stat(os.path.join(root, manifest_filename)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def version_path(root, version):
+    return os.path.join(root, version)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def attached_pids(root, version):
+    '''
+    Live processes that have version pinned (pid files of dead processes are removed)
+    '''
+    path = os.path.join(version_path(root, version), attached_dirname)
+    pids = []
+    for filename in os.listdir(path) if os.path.isdir(path) else []:
+        if _alive(int(filename)):
+            pids.append(int(filename))
+        else:
+            try:
+                os.remove(os.path.join(path, filename))
+            except FileNotFoundError:
+                pass
+    return pids
+
+
+def _files(path):
+    return {os.path.relpath(os.path.join(directory, filename), path):
+            os.path.getsize(os.path.join(directory, filename))
+            for (directory, _, filenames) in os.walk(path) for filename in filenames}
+
+
+def publish(data_dir, root, make_current=True, names=None, version=None):
+    '''
+    Copies data_dir (only the entries in names, if given, skipping missing ones)
+    into a new version under root and (by default) makes it current
+    version names the new version (e.g. to mirror a version of another root)
+    Returns the new version
+    '''
+    if version is None:
+        version = time.strftime('%Y%m%d-%H%M%S') + '-' + str(os.getpid())
+        while version in read_manifest(root)['versions']:
+            version += '-1'
+    elif version in read_manifest(root)['versions']:
+        raise ValueError('Version ' + version + ' is already published in ' + root)
+    os.makedirs(root, exist_ok=True)
+    tmp_path = os.path.join(root, '.' + version)
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    if names is None:
+        shutil.copytree(data_dir, tmp_path)
+    else:
+        os.makedirs(tmp_path)
+        for name in names:
+            source = os.path.join(data_dir, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(tmp_path, name))
+            elif os.path.isfile(source):
+                shutil.copy2(source, os.path.join(tmp_path, name))
+    os.makedirs(os.path.join(tmp_path, attached_dirname), exist_ok=True)
+    files = _files(tmp_path)
+    os.rename(tmp_path, version_path(root, version))
+
+    manifest = read_manifest(root)
+    manifest['versions'][version] = {'published': time.strftime('%Y-%m-%d %H:%M:%S'),
+                                     'source': os.path.abspath(data_dir),
+                                     'files': files}
+    if make_current:
+        manifest['current'] = version
+    write_manifest(manifest, root)
+    return version
+
+
+def set_current(root, version):
+    '''
+    Makes a published version current (e.g. to roll back)
+    '''
+    manifest = read_manifest(root)
+    if version not in manifest['versions'] or not os.path.isdir(version_path(root, version)):
+        raise ValueError('Unknown version ' + str(version))
+    manifest['current'] = version
+    write_manifest(manifest, root)
+
+
+def pin(root, version):
+    os.makedirs(os.path.join(version_path(root, version), attached_dirname), exist_ok=True)
+    open(os.path.join(version_path(root, version), attached_dirname, str(os.getpid())), 'w').close()
+
+
+def unpin(root, version):
+    try:
+        os.remove(os.path.join(version_path(root, version), attached_dirname, str(os.getpid())))
+    except FileNotFoundError:
+        pass
+
+
+def cleanup(root, keep=1, current=None):
+    '''
+    Removes versions that aren't current, aren't pinned by a live process and
+    aren't among the keep latest others (kept for rollbacks)
+    current overrides the manifest's (e.g. for shared copies of another root's versions)
+    Returns the removed versions
+    '''
+    manifest = read_manifest(root)
+    current = current or manifest['current']
+    others = sorted(version for version in manifest['versions'] if version != current)
+    removed = []
+    for version in others[:max(len(others) - keep, 0)]:
+        if len(attached_pids(root, version)) == 0:
+            shutil.rmtree(version_path(root, version), ignore_errors=True)
+            del manifest['versions'][version]
+            removed.append(version)
+    if removed:
+        # Re-read so a version published meanwhile isn't dropped from the manifest
+        latest = read_manifest(root)
+        for version in removed:
+            latest['versions'].pop(version, None)
+        write_manifest(latest, root)
+    return removed
+
+
+def status(root):
+    manifest = read_manifest(root)
+    return [{'version': version,
+             'current': version == manifest['current'],
+             'published': info.get('published'),
+             'mb': round(sum(info.get('files', {}).values()) / 2 ** 20, 1),
+             'attached_pids': attached_pids(root, version)}
+            for (version, info) in sorted(manifest['versions'].items())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Versioned data directory for hot reloads')
+    parser.add_argument('--root', default=os.environ.get('GO_ANALOG_DATA_ROOT'),
+                        help='versioned data directory (default: GO_ANALOG_DATA_ROOT)')
+    parser.add_argument('--shared-root', default=os.environ.get('ISM_SHARED_ROOT'),
+                        help='shared-memory copies of the similarity stores, kept in step with root '
+                             '(default: ISM_SHARED_ROOT, see shared_store)')
+    commands = parser.add_subparsers(dest='command')
+    publish_parser = commands.add_parser('publish', help='publish a data directory as the new current version')
+    publish_parser.add_argument('data_dir')
+    publish_parser.add_argument('--no-switch', action='store_true', help="publish but don't make it current")
+    rollback_parser = commands.add_parser('rollback', help='make an older version current')
+    rollback_parser.add_argument('version')
+    commands.add_parser('status', help='list versions and the processes using them')
+    cleanup_parser = commands.add_parser('cleanup', help='remove versions no process uses')
+    cleanup_parser.add_argument('--keep', type=int, default=1, help='older versions to keep for rollbacks')
+    args = parser.parse_args(argv)
+    if args.root is None:
+        parser.error('--root or GO_ANALOG_DATA_ROOT is required')
+
+    if args.command == 'publish':
+        version = publish(args.data_dir, args.root, make_current=not args.no_switch)
+        print('Published ' + version + ' to ' + args.root)
+        if args.shared_root:
+            from src import shared_store
+            shared_store.publish(args.data_dir, args.shared_root, version=version,
+                                 make_current=not args.no_switch)
+            print('Published ' + version + ' to ' + args.shared_root)
+    elif args.command == 'rollback':
+        set_current(args.root, args.version)
+        if args.shared_root and args.version in read_manifest(args.shared_root)['versions']:
+            set_current(args.shared_root, args.version)
+        print('Current version is ' + args.version)
+    elif args.command == 'status':
+        for version in status(args.root):
+            print(version)
+    elif args.command == 'cleanup':
+        print('Removed ' + str(cleanup(args.root, keep=args.keep)))
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -93,12 +93,14 @@ The web app uses four tables, which were all derived from the main dataset. The
 [Web App Dataset on Go Analog's GitHub](https://github.com/BrianWilliamSmith/go_analog_tools/tree/main/web_app_dataset)
 
 
-* **ism_bgg.pkl** : A pickled and compressed dataframe containing an item similarity matrix (ISM)
+* **ism_bgg** : A directory containing an item similarity matrix (ISM) as a raw memory-mapped array (values.bin) plus row and column label files
     * The ISM shows cosine similarity between board games and video games, calculated using z scores
     * The similarity scores are between -1 and +1 (since z-scores can be negative)
     * Due to negative similarity scores, you can't use weighted averages to make predictions
-    * load with `pd.read_pickle(filename, compression='bz2')`
-* **ism_steam.pkl** : Another pickled and compressed dataframe with an ISM containing similarity scores between video games and video games (see **ism_bgg.pkl ** above for more info)
+    * load with `load_similarity_matrix(directory)` from `src/similarity_store.py`
+* **ism_steam** : Another directory with an ISM containing similarity scores between video games and video games (see **ism_bgg** above for more info)
+* **ism\_bgg\_factorized** and **ism\_steam\_factorized** (optional) : Low-rank models of the two ISMs (game embeddings from a truncated SVD of the z scores), smaller stand-ins for the full matrices
+* **ism\_bgg\_neighbors** and **ism\_steam\_neighbors** : The 100 most and least similar games for every video game in each ISM, precomputed for the conversion tools
 * **bg\_info\_for_app.csv** : Used to add board game information to the output tables in the app. Contains html-safe titles, links, tags, etc.
 * **vg\_info\_for\_app.csv** : Used to add video game information to the output tables in the app. Contains html-safe titles, links, tags, etc.
 ''')
@@ -0,0 +1,287 @@
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+import sys
+import numpy as np
+import pandas as pd
+from src.similarity_store import write_json, read_json
+
+# Typed columnar cache of the raw go_analog_dataset CSVs
+#
+#   python -m src.dataset_cache ingest go_analog_dataset
+#   python -m src.dataset_cache status go_analog_dataset
+#   python -m src.dataset_cache verify go_analog_dataset
+#
+#   from src.dataset_cache import read_csv
+#   bgg = read_csv('go_analog_dataset/BoardGameRatings.csv')   # ingests the first time
+#
+# Every CSV becomes a directory in the cache (BoardGameRatings.csv -> BoardGameRatings/)
+#   <column>.bin  : raw array of the column, memory-mapped on load
+#   <column>.json : values of an integer-coded column (code -> user name or game id)
+#   meta.json     : number of rows, dtype of every column, checksums of the
+#                   source CSV (to tell if the cache is stale) and of every .bin file
+# Users and games (and any other text column) are integer coded, floats are
+# stored as float32. The CSV is read chunk_size rows at a time and every chunk
+# is appended to the .bin files, so memory stays bounded as the dataset grows.
+# Loads skip CSV parsing; ratings come back as float32, so results that depend
+# on the last bits of a rating can differ slightly from reading the CSV
+
+cache_dirname = '.columnar'
+meta_filename = 'meta.json'
+coded_columns = ('User', 'Game')
+default_chunk_size = 100000
+
+
+def default_cache_dir(csv_path):
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), cache_dirname)
+
+
+def table_name(csv_path):
+    return os.path.splitext(os.path.basename(csv_path))[0]
+
+
+def file_checksum(filepath, block_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _storage_dtype(column, dtype, float_dtype):
+    # None for integer-coded columns
+    if column in coded_columns or dtype.kind not in 'fiub':
+        return None
+    if dtype.kind == 'f':
+        return np.dtype(float_dtype)
+    return dtype
+
+
+class _Coder:
+    '''
+    Integer codes for the values of a column, assigned in order of first appearance
+    (-1 for missing values)
+    '''
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, series):
+        present = series.notnull().to_numpy()
+        for value in pd.unique(series[present]):
+            if value not in self.codes:
+                self.codes[value] = len(self.values)
+                self.values.append(value.item() if isinstance(value, np.generic) else value)
+        codes = np.full(len(series), -1, dtype=np.int32)
+        codes[present] = series[present].map(self.codes).to_numpy(dtype=np.int32)
+        return codes
+
+
+def ingest_csv(csv_path, cache_dir=None, chunk_size=default_chunk_size, float_dtype='float32'):
+    '''
+    Converts one CSV to the cache (see above), replacing what was there
+    Returns the table's meta
+    '''
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    name = table_name(csv_path)
+    path = os.path.join(cache_dir, name)
+    tmp_path = os.path.join(cache_dir, '.' + name + '.tmp-' + str(os.getpid()))
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    files = {}
+    digests = {}
+    dtypes = {}
+    coders = {}
+    n_rows = 0
+    stat = os.stat(csv_path)
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            if n_rows == 0:
+                # The first chunk decides how every column is stored
+                for column in chunk.columns:
+                    dtype = _storage_dtype(column, chunk[column].dtype, float_dtype)
+                    if dtype is None:
+                        coders[column] = _Coder()
+                        dtype = np.dtype(np.int32)
+                    dtypes[column] = dtype
+                    files[column] = open(os.path.join(tmp_path, column + '.bin'), 'wb')
+                    digests[column] = hashlib.blake2b(digest_size=16)
+
+            for column in dtypes:
+                if column in coders:
+                    values = coders[column].encode(chunk[column])
+                elif dtypes[column].kind in 'iub' and chunk[column].dtype.kind not in 'iub':
+                    raise ValueError(column + ' has missing or non-integer values after row ' + str(n_rows)
+                                     + ', it was stored as ' + dtypes[column].name)
+                else:
+                    values = np.ascontiguousarray(chunk[column].to_numpy(dtype=dtypes[column]))
+                values.tofile(files[column])
+                digests[column].update(values.tobytes())
+            n_rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+
+    meta = {'source': os.path.basename(csv_path),
+            'source_size': stat.st_size,
+            'source_mtime_ns': stat.st_mtime_ns,
+            'source_sha256': file_checksum(csv_path),
+            'rows': n_rows,
+            'columns': list(dtypes),
+            'dtypes': {column: dtype.str for (column, dtype) in dtypes.items()},
+            'coded': list(coders),
+            'checksums': {column: digest.hexdigest() for (column, digest) in digests.items()}}
+    for (column, coder) in coders.items():
+        write_json(coder.values, os.path.join(tmp_path, column + '.json'))
+    write_json(meta, os.path.join(tmp_path, meta_filename))
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+    return meta
+
+
+def read_meta(cache_dir, name):
+    return read_json(os.path.join(cache_dir, name, meta_filename))
+
+
+def is_fresh(csv_path, cache_dir=None):
+    '''
+    True if the cache has csv_path as it is now (same size and modification
+    time, or same checksum if it was only touched)
+    '''
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    try:
+        meta = read_meta(cache_dir, table_name(csv_path))
+    except FileNotFoundError:
+        return False
+    stat = os.stat(csv_path)
+    if stat.st_size != meta['source_size']:
+        return False
+    return stat.st_mtime_ns == meta['source_mtime_ns'] or file_checksum(csv_path) == meta['source_sha256']
+
+
+def load_columns(cache_dir, name):
+    '''
+    Returns ({column: memmapped array}, {coded column: array of values}, meta)
+    Coded columns are the int32 codes (-1 for missing values)
+    '''
+    path = os.path.join(cache_dir, name)
+    meta = read_meta(cache_dir, name)
+    columns = {}
+    for column in meta['columns']:
+        dtype = np.dtype(meta['dtypes'][column])
+        if meta['rows'] == 0:
+            columns[column] = np.empty(0, dtype=dtype)
+        else:
+            columns[column] = np.memmap(os.path.join(path, column + '.bin'), dtype=dtype, mode='r',
+                                        shape=(meta['rows'],))
+    # Through an Index so game ids come back as ints and names as objects
+    dictionaries = {column: pd.Index(read_json(os.path.join(path, column + '.json'))).to_numpy()
+                    for column in meta['coded']}
+    return columns, dictionaries, meta
+
+
+def verify(cache_dir, name):
+    '''
+    Raises ValueError if a column file doesn't match the checksum it was written with
+    '''
+    columns, _, meta = load_columns(cache_dir, name)
+    for (column, values) in columns.items():
+        digest = hashlib.blake2b(digest_size=16)
+        for start in range(0, len(values), default_chunk_size):
+            digest.update(np.ascontiguousarray(values[start:start + default_chunk_size]).tobytes())
+        if digest.hexdigest() != meta['checksums'][column]:
+            raise ValueError(name + '/' + column + '.bin is corrupt (checksum mismatch)')
+
+
+def read_table(cache_dir, name, categorical=False):
+    '''
+    Returns the cached table as a DataFrame, with the same columns and values
+    as pd.read_csv (floats as float32)
+    With categorical, coded columns are Categoricals on the cached codes
+    instead of being decoded (less memory for user ids)
+    '''
+    columns, dictionaries, meta = load_columns(cache_dir, name)
+    data = {}
+    for column in meta['columns']:
+        values = columns[column]
+        if column in dictionaries:
+            codes = np.asarray(values)
+            if categorical:
+                values = pd.Categorical.from_codes(codes, categories=dictionaries[column])
+            elif (codes < 0).any():
+                values = pd.Series(dictionaries[column]).reindex(codes).to_numpy()
+            else:
+                values = dictionaries[column].take(codes)
+        data[column] = values
+    return pd.DataFrame(data, columns=meta['columns'])
+
+
+def read_csv(csv_path, cache_dir=None, categorical=False, chunk_size=default_chunk_size):
+    '''
+    pd.read_csv through the cache: ingests csv_path if it isn't cached or
+    changed since, then reads the cached table
+    '''
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    if not is_fresh(csv_path, cache_dir):
+        ingest_csv(csv_path, cache_dir, chunk_size=chunk_size)
+    return read_table(cache_dir, table_name(csv_path), categorical=categorical)
+
+
+def ingest(dataset_dir, cache_dir=None, chunk_size=default_chunk_size, force=False):
+    '''
+    Ingests every CSV in dataset_dir that isn't cached or changed since
+    Returns {table name: 'ingested' or 'fresh'}
+    '''
+    cache_dir = cache_dir or os.path.join(dataset_dir, cache_dirname)
+    report = {}
+    for csv_path in sorted(glob.glob(os.path.join(dataset_dir, '*.csv'))):
+        if not force and is_fresh(csv_path, cache_dir):
+            report[table_name(csv_path)] = 'fresh'
+        else:
+            ingest_csv(csv_path, cache_dir, chunk_size=chunk_size)
+            report[table_name(csv_path)] = 'ingested'
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Typed columnar cache of the go_analog_dataset CSVs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command in ('ingest', 'status', 'verify'):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument('dataset_dir')
+        subparser.add_argument('--cache-dir', help='default: <dataset_dir>/' + cache_dirname)
+        if command == 'ingest':
+            subparser.add_argument('--chunk-size', type=int, default=default_chunk_size, help='rows per chunk')
+            subparser.add_argument('--force', action='store_true', help='ingest fresh tables too')
+    args = parser.parse_args(argv)
+    cache_dir = args.cache_dir or os.path.join(args.dataset_dir, cache_dirname)
+
+    if args.command == 'ingest':
+        for (name, state) in ingest(args.dataset_dir, cache_dir, args.chunk_size, args.force).items():
+            print(name + ': ' + state)
+        return
+
+    failed = False
+    for csv_path in sorted(glob.glob(os.path.join(args.dataset_dir, '*.csv'))):
+        name = table_name(csv_path)
+        if args.command == 'status':
+            state = 'fresh' if is_fresh(csv_path, cache_dir) else 'stale or missing'
+            print(name + ': ' + state)
+            continue
+        try:
+            verify(cache_dir, name)
+            print(name + ': ok')
+        except (ValueError, FileNotFoundError) as e:
+            print(name + ': ' + str(e))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from src.similarity_store import load_similarity_values, read_json, write_json
+from src.scoring import neighbor_counts, normalize_predictions, normalize_ratings, score_games, TopColumns
+from src.quantization import dequantize
+
+# Low-rank (factorized) stand-in for the item similarity matrices
+#
+#   python -m src.factorized_similarity build go_analog_dataset web_app_dataset --rank 64
+#   python -m src.factorized_similarity evaluate go_analog_dataset --rank 64
+#
+# The z-scored user-item matrix from the build pipeline (board games and video
+# games stacked, x users) is factorized with a randomized truncated SVD, M ~ U S V'.
+# Every game gets an embedding U S / |m| (|m| is the length of the game's full
+# z-score vector), so the dot product of two embeddings approximates the cosine
+# similarity of the two games. Memory is (games x rank) instead of games x games
+#   row_factors.npy / column_factors.npy : embeddings of the rows and columns
+#   rows.json / columns.json             : labels, same as the similarity matrix
+#   meta.json                            : shape, rank and the share of M's energy the rank keeps
+#
+# Set ISM_FORMAT=factorized to use ism_bgg_factorized and ism_steam_factorized in the app
+
+default_rank = 64
+
+
+def truncated_svd(matrix, rank, n_iter=4, oversample=10, seed=0):
+    '''
+    Randomized truncated SVD (Halko et al.) of a dense array or scipy sparse matrix
+    Returns (U, singular values) for the top rank singular values
+    '''
+    rng = np.random.RandomState(seed)
+    rank = min(rank, *matrix.shape)
+    size = min(rank + oversample, *matrix.shape)
+
+    q, _ = np.linalg.qr(matrix @ rng.normal(size=(matrix.shape[1], size)))
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(matrix.T @ q)
+        q, _ = np.linalg.qr(matrix @ q)
+
+    u, s, _ = np.linalg.svd(np.asarray((matrix.T @ q).T), full_matrices=False)
+    return (q @ u)[:, :rank], s[:rank]
+
+
+def _save_factors(path, row_factors, column_factors, rows, columns, meta):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'row_factors.npy'), row_factors)
+    np.save(os.path.join(path, 'column_factors.npy'), column_factors)
+    write_json(rows, os.path.join(path, 'rows.json'))
+    write_json(columns, os.path.join(path, 'columns.json'))
+    write_json(dict(meta, shape=(len(rows), len(columns))), os.path.join(path, 'meta.json'))
+
+
+def build_factorized(bgg, steam, vg, bg, out_dir, rank=default_rank, bg_ids=None, vg_ids=None, seed=0):
+    '''
+    Factorizes prepared ratings (see build_similarity.prepare_ratings) and writes
+    ism_bgg_factorized and ism_steam_factorized to out_dir
+    '''
+    # scipy is only needed to build (see build_similarity)
+    from scipy import sparse
+    from src.build_similarity import user_item_matrix
+
+    users = np.unique(np.concatenate([bgg.User.unique(), steam.User.unique()]))
+    ui_bgg, bg_ids = user_item_matrix(bgg, 'Rating_Z', users, games=bg_ids)
+    ui_steam, vg_ids = user_item_matrix(steam, 'Playtime_Z', users, games=vg_ids)
+    matrix = sparse.vstack([ui_bgg, ui_steam]).tocsr()
+
+    u, s = truncated_svd(matrix, rank, seed=seed)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    factors = (u * s * scale[:, None]).astype(np.float32)
+    bg_factors, vg_factors = factors[:len(bg_ids)], factors[len(bg_ids):]
+
+    steam_names_key = dict(zip(vg.Id, vg.Name))
+    bgg_names_key = dict(zip(bg.Id, bg.Name))
+    vg_names = [steam_names_key.get(game, game) for game in vg_ids]
+    bg_names = [bgg_names_key.get(game, game) for game in bg_ids]
+    meta = {'rank': len(s), 'energy': float((s ** 2).sum() / matrix.multiply(matrix).sum())}
+
+    _save_factors(os.path.join(out_dir, 'ism_bgg_factorized'), bg_factors, vg_factors,
+                  bg_names, vg_names, meta)
+    _save_factors(os.path.join(out_dir, 'ism_steam_factorized'), vg_factors, vg_factors,
+                  vg_names, vg_names, meta)
+    return meta
+
+
+class FactorizedSimilarity:
+    '''
+    Low-rank similarity matrix, loaded from a directory written by build_factorized
+    '''
+
+    def __init__(self, path):
+        self.row_factors = np.load(os.path.join(path, 'row_factors.npy'), mmap_mode='r')
+        self.column_factors = np.load(os.path.join(path, 'column_factors.npy'), mmap_mode='r')
+        meta = read_json(os.path.join(path, 'meta.json'))
+        self.shape = tuple(meta['shape'])
+        self.rank = meta['rank']
+        self.energy = meta['energy']
+        # Same labels as the similarity DataFrame, so it can be used in its place
+        self.index = pd.Index(read_json(os.path.join(path, 'rows.json')), name='Game')
+        self.columns = pd.Index(read_json(os.path.join(path, 'columns.json')), name='Game')
+
+    @property
+    def nbytes(self):
+        return self.row_factors.nbytes + self.column_factors.nbytes
+
+    def similarities(self, columns, rows=None):
+        '''
+        Approximate similarity scores (rounded to 2 decimals, like the matrices)
+        of every row (or the rows in the boolean mask rows) with the given column positions
+        '''
+        row_factors = self.row_factors if rows is None else self.row_factors[rows]
+        values = np.asarray(row_factors, dtype=np.float64) @ np.asarray(self.column_factors[columns], dtype=np.float64).T
+        return values.round(2)
+
+
+def load_factorized_similarity(path):
+    return FactorizedSimilarity(path)
+
+
+def score_games_factorized(matrix, columns, playtimes, rows=None, min_neighbors=3,
+                           neighbor_cutoff=0.15, based_on_n=3):
+    '''
+    Same as scoring.score_games, but computed from a FactorizedSimilarity
+
+    Predictions are the candidate embeddings times the user's vector in the
+    rank-r space (the playtime-weighted sum of the embeddings of the user's games);
+    neighbor counts and "Recommended because…" come from the approximate scores
+    rows : optional boolean mask of candidate rows, returned row positions are relative to it
+    '''
+    columns = np.asarray(columns, dtype=np.int64)
+    playtimes = np.asarray(playtimes, dtype=float)
+    values = matrix.similarities(columns, rows)
+
+    with_neighbors = np.flatnonzero(neighbor_counts(values, neighbor_cutoff) >= min_neighbors)
+    if len(with_neighbors) == 0:
+        return with_neighbors, np.empty(0), np.empty((0, based_on_n), dtype=int)
+
+    user_vector = np.asarray(matrix.column_factors[columns], dtype=np.float64).T @ playtimes
+    row_factors = matrix.row_factors if rows is None else matrix.row_factors[rows]
+    predictions = normalize_predictions(np.asarray(row_factors[with_neighbors], dtype=np.float64) @ user_vector)
+    return with_neighbors, predictions, TopColumns(values[with_neighbors], based_on_n)
+
+
+def _ranking(result, top):
+    # Row positions of the top recommendations, best first
+    with_neighbors, predictions, _ = result
+    return with_neighbors[np.argsort(-predictions, kind='stable')[:top]]
+
+
+def _ndcg(ranking, relevant, top):
+    hits = np.isin(ranking, relevant)
+    dcg = (hits / np.log2(np.arange(len(ranking)) + 2)).sum()
+    ideal = (1 / np.log2(np.arange(min(top, len(relevant))) + 2)).sum()
+    return dcg / ideal if ideal > 0 else 0.0
+
+
+def evaluate(dataset_dir, rank=default_rank, n_users=100, holdout=0.2, top=20, seed=0,
+             min_neighbors=2, neighbor_cutoff=0.1, based_on_n=3):
+    '''
+    Offline comparison of the item-item matrices and the factorized model
+
+    Both are built without the board game ratings and a holdout share of the
+    Steam games of n_users test users. The test users are then scored from their
+    remaining Steam games:
+      steam : recall/NDCG of the held out video games in the top recommendations
+      bgg   : recall/NDCG of the board games the user rated above their average
+    Returns a DataFrame with quality, agreement and latency for every engine and platform
+    '''
+    from src.build_similarity import read_dataset, prepare_ratings, add_z_scores, build_matrices
+
+    bgg, steam, vg, bg = prepare_ratings(*read_dataset(dataset_dir))
+    bg_ids = np.unique(bgg.Game)
+    vg_ids = np.unique(steam.Game)
+    rng = np.random.RandomState(seed)
+    test_users = rng.choice(np.unique(steam.User), min(n_users, steam.User.nunique()), replace=False)
+
+    test_steam = steam[steam.User.isin(test_users)]
+    held_out = test_steam.index[rng.rand(len(test_steam)) < holdout]
+    train_bgg = bgg[~bgg.User.isin(test_users)][['User', 'Game', 'Rating']]
+    train_steam = steam.drop(held_out)[['User', 'Game', 'Playtime']]
+
+    tmp = tempfile.mkdtemp()
+    try:
+        train_bgg, train_steam = add_z_scores(train_bgg, train_steam)
+        build_matrices(train_bgg, train_steam, vg, bg, tmp, bg_ids=bg_ids, vg_ids=vg_ids)
+        build_factorized(train_bgg, train_steam, vg, bg, tmp, rank=rank, bg_ids=bg_ids, vg_ids=vg_ids,
+                         seed=seed)
+
+        engines = {}
+        for platform in ('bgg', 'steam'):
+            dense, _, _ = load_similarity_values(os.path.join(tmp, 'ism_' + platform))
+            engines[platform] = (np.array(dense), load_factorized_similarity(
+                os.path.join(tmp, 'ism_' + platform + '_factorized')))
+
+        settings = {'min_neighbors': min_neighbors, 'neighbor_cutoff': neighbor_cutoff,
+                    'based_on_n': based_on_n}
+        vg_positions = pd.Index(vg_ids)
+        bg_positions = pd.Index(bg_ids)
+        stats = []
+        for user in test_users:
+            user_steam = steam[steam.User == user]
+            train = user_steam.drop(user_steam.index.intersection(held_out))
+            games = normalize_ratings(list(zip(vg_positions.get_indexer(train.Game), train.Playtime)))
+            if len(games) < 2:
+                continue
+            columns = np.array([game for (game, playtime) in games])
+            playtimes = np.array([playtime for (game, playtime) in games])
+
+            owned = np.ones(len(vg_ids), dtype=bool)
+            owned[columns] = False
+            liked = bgg[(bgg.User == user) & (bgg.Rating_Z > 0)].Game
+            cases = {'steam': (owned, vg_positions.get_indexer(user_steam.Game.loc[
+                         user_steam.index.intersection(held_out)])),
+                     'bgg': (None, bg_positions.get_indexer(liked))}
+
+            for (platform, (rows, relevant)) in cases.items():
+                if len(relevant) == 0:
+                    continue
+                dense, factorized = engines[platform]
+                rankings = {}
+                for engine in ('item-item', 'factorized'):
+                    start = time.perf_counter()
+                    if engine == 'item-item':
+                        values = dequantize(dense.take(columns, axis=1))
+                        result = score_games(values if rows is None else values[rows], playtimes, **settings)
+                    else:
+                        result = score_games_factorized(factorized, columns, playtimes, rows=rows, **settings)
+                    elapsed = time.perf_counter() - start
+
+                    ranking = _ranking(result, top)
+                    if rows is not None:
+                        ranking = np.flatnonzero(rows)[ranking]
+                    rankings[engine] = ranking
+                    stats.append({'platform': platform, 'engine': engine, 'ms': elapsed * 1000,
+                                  'recall': np.isin(relevant, ranking).mean(),
+                                  'ndcg': _ndcg(ranking, relevant, top)})
+                overlap = len(np.intersect1d(*rankings.values())) / top
+                stats[-1]['overlap'] = stats[-2]['overlap'] = overlap
+
+        megabytes = {(platform, 'item-item'): dense.nbytes / 1e6 for (platform, (dense, _)) in engines.items()}
+        megabytes.update({(platform, 'factorized'): factorized.nbytes / 1e6
+                          for (platform, (_, factorized)) in engines.items()})
+    finally:
+        shutil.rmtree(tmp)
+
+    stats = pd.DataFrame(stats)
+    report = stats.groupby(['platform', 'engine']).agg(
+        users=('ms', 'size'),
+        **{'recall@' + str(top): ('recall', 'mean'),
+           'ndcg@' + str(top): ('ndcg', 'mean'),
+           'top_' + str(top) + '_overlap': ('overlap', 'mean'),
+           'median_ms': ('ms', 'median'),
+           'p95_ms': ('ms', lambda ms: ms.quantile(0.95))})
+    report['mb'] = [megabytes[key] for key in report.index]
+    return report.round(3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Low-rank factorized similarity models')
+    commands = parser.add_subparsers(dest='command')
+    build = commands.add_parser('build', help='factorize the dataset and write the models')
+    build.add_argument('dataset_dir', help='directory with the go_analog_dataset csv files')
+    build.add_argument('out_dir', help='directory for ism_bgg_factorized and ism_steam_factorized')
+    build.add_argument('--rank', type=int, default=default_rank)
+    evaluate_parser = commands.add_parser('evaluate', help='compare with the item-item matrices')
+    evaluate_parser.add_argument('dataset_dir', help='directory with the go_analog_dataset csv files')
+    evaluate_parser.add_argument('--rank', type=int, default=default_rank)
+    evaluate_parser.add_argument('--users', type=int, default=100, help='number of test users')
+    evaluate_parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        from src.build_similarity import read_dataset, prepare_ratings
+        meta = build_factorized(*prepare_ratings(*read_dataset(args.dataset_dir)), args.out_dir, rank=args.rank)
+        print('rank: ' + str(meta['rank']) + ', energy kept: ' + str(round(meta['energy'], 3)))
+    elif args.command == 'evaluate':
+        with pd.option_context('display.width', 200, 'display.max_columns', 20):
+            print(evaluate(args.dataset_dir, rank=args.rank, n_users=args.users, top=args.top))
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import streamlit as st
+from src.go_analog_shared_functions import *
+
+def app():
+
+    st.title('🎲 Game night 🕹')
+    st.header('recommend board games for a whole group of Steam players')
+
+    game_night_app(platform = 'bgg')
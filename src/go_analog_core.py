@@ -0,0 +1,767 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from src.similarity_store import load_similarity_matrix
+from src.scoring import (score_games, score_users, build_recommendations, select_recommendations,
+                         select_group_recommendations, normalize_ratings)
+from src.neighbor_index import load_neighbor_index
+from src.sparse_similarity import SparseSimilarity, load_sparse_similarity, score_games_sparse
+from src.factorized_similarity import FactorizedSimilarity, load_factorized_similarity, score_games_factorized
+from src.catalog import Catalog, MatrixAlignment
+from src.quantization import dequantize
+from src.recommendation_cache import RecommendationCache, canonical_profile, profile_fingerprint
+from src import shared_store
+from src import data_versions
+from src.table_rendering import TableRenderer
+from src.instrumentation import stage, timed, note, logger, current_trace, attached
+
+# Recommender core: data loading, scoring and table helpers
+# Doesn't import streamlit or requests, so it can be used as a library, from
+# scripts, or behind the JSON service (src/service.py). The Streamlit pages go
+# through go_analog_shared_functions, a thin adapter on top of this module
+
+# Filepaths for video game and board game info
+# Used in web app
+data_dir = os.environ.get('GO_ANALOG_DATA_DIR', 'web_app_dataset')
+bg_app_filepath = os.path.join(data_dir, 'bg_info_for_app.csv')
+vg_app_filepath = os.path.join(data_dir, 'vg_info_for_app.csv')
+# Item similarity matrices are directories in the memory-mapped format (see similarity_store)
+ism_bgg_filepath = os.path.join(data_dir, 'ism_bgg')
+ism_steam_filepath = os.path.join(data_dir, 'ism_steam')
+
+# Set ISM_FORMAT=sparse to score with the thresholded matrices (see sparse_similarity)
+# or ISM_FORMAT=factorized to score with the low-rank models (see factorized_similarity)
+similarity_format = os.environ.get('ISM_FORMAT', 'dense')
+ism_bgg_sparse_filepath = os.path.join(data_dir, 'ism_bgg_sparse')
+ism_steam_sparse_filepath = os.path.join(data_dir, 'ism_steam_sparse')
+ism_bgg_factorized_filepath = os.path.join(data_dir, 'ism_bgg_factorized')
+ism_steam_factorized_filepath = os.path.join(data_dir, 'ism_steam_factorized')
+
+# Most/least similar games for every video game (see neighbor_index)
+# Used by the conversion pages instead of the full matrices
+bgg_neighbors_filepath = os.path.join(data_dir, 'ism_bgg_neighbors')
+steam_neighbors_filepath = os.path.join(data_dir, 'ism_steam_neighbors')
+
+# Most Steam profiles fetched at the same time in group mode (see get_group_games)
+group_fetch_workers = int(os.environ.get('GROUP_FETCH_WORKERS', 4))
+
+# Set STEAM_API_URL to fetch libraries from somewhere else than api.steampowered.com
+# (e.g. the load test's stub, see load_test)
+steam_api_url = os.environ.get('STEAM_API_URL')
+
+# Set ISM_SHARED_ROOT to map the matrices and neighbor indexes from the copy
+# published to shared memory (see shared_store) instead of from data_dir
+shared_root = os.environ.get('ISM_SHARED_ROOT')
+
+# Set GO_ANALOG_DATA_ROOT to serve a versioned data directory (see data_versions)
+# instead of data_dir. Every GO_ANALOG_RELOAD_INTERVAL seconds the manifest is
+# checked, and a new current version is loaded in the background and swapped in
+data_root = os.environ.get('GO_ANALOG_DATA_ROOT')
+reload_interval = float(os.environ.get('GO_ANALOG_RELOAD_INTERVAL', 30))
+
+# Where the data version comes from: the versioned data directory, otherwise
+# the shared stores (versioned the same way)
+version_root = data_root or shared_root
+
+
+def data_path(filepath):
+    '''
+    filepath in the data version this thread uses (see data_version)
+    '''
+    if data_root is None:
+        return filepath
+    return os.path.join(data_versions.version_path(data_root, data_version()), os.path.basename(filepath))
+
+
+def store_path(filepath):
+    '''
+    Similarity store at filepath, from the shared copy of this thread's data
+    version if there is one
+    '''
+    if shared_root is not None:
+        path = os.path.join(data_versions.version_path(shared_root, data_version()), os.path.basename(filepath))
+        # Versions that weren't copied to shared memory are mapped from the data root
+        if data_root is None or os.path.isdir(path):
+            return path
+    return data_path(filepath)
+
+
+# Caching
+# Loaded data is kept for the life of the process (or of its data version),
+# keyed on the loader, the data version and the loader's arguments
+# Concurrent callers wait for the first load instead of loading the same data twice
+
+_cache = {}
+_cache_lock = threading.RLock()
+_missing = object()
+_loaders = {}
+
+
+def cached(func=None, versioned=True):
+    if func is None:
+        return functools.partial(cached, versioned=versioned)
+
+    def key(args):
+        return (func.__name__, data_version() if versioned else None) + args
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        value = _cache.get(key(args), _missing)
+        if value is not _missing:
+            return value
+        with _cache_lock:
+            value = _cache.get(key(args), _missing)
+            if value is _missing:
+                value = func(*args)
+                _cache[key(args)] = value
+            return value
+
+    wrapper.is_cached = lambda *args: key(args) in _cache
+    _loaders[func.__name__] = wrapper
+    return wrapper
+
+
+def clear_cache():
+    global _active_version
+    with _cache_lock:
+        _cache.clear()
+    recommendation_cache.clear()
+    # The next load uses the latest published version
+    with _versions_lock:
+        version, _active_version = _active_version, None
+        in_flight = _in_flight.get(version, 0)
+    if version is not None and in_flight == 0:
+        _unpin(version)
+
+
+# Recommendations for recent profiles (see recommendation_cache)
+# Keyed on the data version too, so a new version never serves old recommendations
+recommendation_cache = RecommendationCache(
+    max_entries=int(os.environ.get('RECOMMENDATION_CACHE_ENTRIES', 128)),
+    max_bytes=int(float(os.environ.get('RECOMMENDATION_CACHE_MB', 256)) * 2 ** 20))
+
+
+# Data versions (only with data_root or shared_root)
+# A request pins the active version when it starts (using_data_version), so a
+# swap never mixes versions within a request. A replaced version's data and
+# recommendations are dropped when its last request is done
+
+_versions_lock = threading.Lock()
+_active_version = None
+_in_flight = {}
+_retired = set()
+_failed_versions = set()
+_local = threading.local()
+_watcher = None
+
+
+def data_version():
+    '''
+    Data version this thread uses: the one its request pinned, otherwise the
+    active one (None without data_root or shared_root)
+    '''
+    global _active_version
+    if version_root is None:
+        return None
+    version = getattr(_local, 'version', None)
+    if version is not None:
+        return version
+    if _active_version is None:
+        with _versions_lock:
+            if _active_version is None:
+                version = data_versions.current_version(version_root)
+                if version is None:
+                    raise FileNotFoundError('Nothing published in ' + version_root + ' (run python -m ' +
+                                            ('src.data_versions' if data_root else 'src.shared_store') +
+                                            ' publish)')
+                _pin(version)
+                _active_version = version
+    return _active_version
+
+
+@contextmanager
+def using_data_version(version=None):
+    '''
+    Pins a data version (the active one by default) on this thread, e.g. for a request
+    '''
+    if version_root is None or getattr(_local, 'version', None) is not None:
+        yield data_version()
+        return
+
+    data_version()
+    with _versions_lock:
+        version = version or _active_version
+        _in_flight[version] = _in_flight.get(version, 0) + 1
+    _local.version = version
+    try:
+        yield version
+    finally:
+        _local.version = None
+        with _versions_lock:
+            _in_flight[version] -= 1
+            drained = _in_flight[version] == 0 and version in _retired
+        if drained:
+            _drop_version(version)
+
+
+def _drop_version(version):
+    with _cache_lock:
+        for key in [key for key in _cache if key[1] == version]:
+            del _cache[key]
+    recommendation_cache.remove_if(lambda key: key[0] == version)
+    with _versions_lock:
+        _retired.discard(version)
+        _in_flight.pop(version, None)
+    _unpin(version)
+
+
+def _version_roots(version):
+    # Roots that have version (a data root version may not be in shared memory)
+    return [root for root in (data_root, shared_root)
+            if root is not None and os.path.isdir(data_versions.version_path(root, version))]
+
+
+def _pin(version):
+    for root in _version_roots(version):
+        data_versions.pin(root, version)
+
+
+def _unpin(version):
+    # Then removes the versions no process uses anymore (shared copies without
+    # rollback copies, and the data root decides which version is current)
+    current = data_versions.current_version(version_root)
+    for root in (data_root, shared_root):
+        if root is None:
+            continue
+        data_versions.unpin(root, version)
+        try:
+            if root == shared_root:
+                shared_store.cleanup(root, current=current)
+            else:
+                data_versions.cleanup(root)
+        except OSError:
+            pass
+
+
+def check_data_version():
+    '''
+    If the manifest's current version is new, loads everything that's loaded
+    for the active version from it (on the calling thread), then swaps it in
+    Returns the new version, or None if nothing changed
+    '''
+    global _active_version
+    if version_root is None:
+        return None
+    version = data_versions.current_version(version_root)
+    active = data_version()
+    if version is None or version == active or version in _failed_versions:
+        return None
+
+    start = time.perf_counter()
+    _pin(version)
+    try:
+        with using_data_version(version):
+            for key in [key for key in list(_cache) if key[1] == active]:
+                _loaders[key[0]](*key[2:])
+    except Exception as e:
+        # Keep serving the active version, don't retry a broken version
+        _failed_versions.add(version)
+        logger.error(json.dumps({'data_version': version, 'status': 'failed', 'error': repr(e)}))
+        _drop_version(version)
+        return None
+
+    with _versions_lock:
+        _active_version = version
+        _retired.add(active)
+        drained = _in_flight.get(active, 0) == 0
+    if drained:
+        _drop_version(active)
+    logger.info(json.dumps({'data_version': version, 'status': 'active', 'replaced': active,
+                            'load_ms': round((time.perf_counter() - start) * 1e3, 3)}))
+    return version
+
+
+def watch_data_versions(interval=reload_interval):
+    '''
+    Starts a daemon thread (once per process) that checks for a new data version
+    every interval seconds
+    '''
+    global _watcher
+    if version_root is None:
+        return
+
+    def watch():
+        mtime = data_versions.manifest_mtime(version_root)
+        while True:
+            time.sleep(interval)
+            latest = data_versions.manifest_mtime(version_root)
+            if latest == mtime:
+                continue
+            mtime = latest
+            try:
+                check_data_version()
+            except Exception as e:
+                logger.error(json.dumps({'data_version': None, 'status': 'failed', 'error': repr(e)}))
+
+    with _versions_lock:
+        if _watcher is not None:
+            return
+        _watcher = threading.Thread(target=watch, name='go-analog-data-versions', daemon=True)
+    _watcher.start()
+
+
+# Functions for loading data
+# Separate functions for different dataests so they can all be cached
+
+@cached
+def load_steam_data():
+    if similarity_format == 'sparse':
+        return load_sparse_similarity(store_path(ism_steam_sparse_filepath))
+    if similarity_format == 'factorized':
+        return load_factorized_similarity(store_path(ism_steam_factorized_filepath))
+    return load_similarity_matrix(store_path(ism_steam_filepath))
+
+
+@cached
+def load_bgg_data():
+    if similarity_format == 'sparse':
+        return load_sparse_similarity(store_path(ism_bgg_sparse_filepath))
+    if similarity_format == 'factorized':
+        return load_factorized_similarity(store_path(ism_bgg_factorized_filepath))
+    return load_similarity_matrix(store_path(ism_bgg_filepath))
+
+
+@cached
+def load_steam_neighbors():
+    return load_neighbor_index(store_path(steam_neighbors_filepath))
+
+
+@cached
+def load_bgg_neighbors():
+    return load_neighbor_index(store_path(bgg_neighbors_filepath))
+
+
+@cached
+def load_bg_data_for_web_app():
+    return pd.read_csv(data_path(bg_app_filepath))
+
+
+@cached
+def load_vg_data_for_web_app():
+    return pd.read_csv(data_path(vg_app_filepath))
+
+
+# Catalogs map ids and names to integer positions once per process
+
+@cached
+def load_bg_catalog():
+    return Catalog(load_bg_data_for_web_app())
+
+
+@cached
+def load_vg_catalog():
+    return Catalog(load_vg_data_for_web_app())
+
+
+# Info cells of every game rendered once per process (see table_rendering)
+
+@cached
+def load_bg_renderer():
+    return TableRenderer(load_bg_catalog())
+
+
+@cached
+def load_vg_renderer():
+    return TableRenderer(load_vg_catalog())
+
+
+@cached
+def load_bgg_alignment():
+    return MatrixAlignment(load_bgg_data(), load_bg_catalog(), load_vg_catalog())
+
+
+@cached
+def load_steam_alignment():
+    return MatrixAlignment(load_steam_data(), load_vg_catalog(), load_vg_catalog())
+
+
+def memory_footprint():
+    '''
+    MB of the similarity data loaded so far (memory-mapped, so shared with
+    other processes and only resident once used) and resident memory of this process
+    '''
+    footprint = {}
+    for (name, loader) in (('ism_bgg', load_bgg_data), ('ism_steam', load_steam_data),
+                           ('ism_bgg_neighbors', load_bgg_neighbors),
+                           ('ism_steam_neighbors', load_steam_neighbors)):
+        if loader.is_cached():
+            data = loader()
+            nbytes = data.to_numpy().nbytes if isinstance(data, pd.DataFrame) else getattr(data, 'nbytes', None)
+            footprint[name + '_mb'] = round(nbytes / 2 ** 20, 1) if nbytes is not None else None
+    footprint.update(shared_store.memory_usage())
+    return footprint
+
+
+@cached(versioned=False)
+def load_steam_client(steam_api_key):
+    # One client per process, so connections and cached profiles are shared between sessions
+    # (imported here so requests is only loaded when Steam is used)
+    from src.steam_client import SteamClient
+    if steam_api_url:
+        return SteamClient(steam_api_key, base_url=steam_api_url)
+    return SteamClient(steam_api_key)
+
+
+@timed('find_similar')
+def find_similar_games(game_name, neighbor_index, reverse=False):
+    # Returns 2-column data frame, sorted by descending similarity
+    # Only has the most (or least, if reverse) similar games from the precomputed index
+    try:
+        games, scores = neighbor_index.neighbors(game_name, reverse=reverse)
+        if not reverse:
+            games, scores = games[1:], scores[1:]
+        out = pd.DataFrame(zip(games, scores), columns=['Game','Similarity Score'])
+        return out
+    except:
+        return 'Game not in database'
+
+
+def annotate_table(df, left_on='Game', right_on='Name', platform='bgg'):
+    if platform == 'bgg':
+        catalog = load_bg_catalog()
+    if platform == 'steam':
+        catalog = load_vg_catalog()
+
+    # Names are already indexed by the catalog, other keys need a merge
+    if right_on == 'Name':
+        return catalog.annotate(df, on=left_on)
+    df = df.merge(catalog.info, left_on=left_on, right_on=right_on)
+    return df
+
+
+def rearrange_table(df, columns_to_show, order_by='Title', how_many_rows=10,
+                    desc=False, reverse=False):
+    if reverse == False:
+        df = df.head(how_many_rows)
+    else:
+        df = df.tail(how_many_rows)
+    df = df.sort_values(by = [order_by], ascending = not desc)
+    return df[columns_to_show]
+
+
+def render_table(df):
+    out = df.to_html(index=False, justify='center', escape=False)
+    out = out.replace('<td>', '<td align="center" valign="center">')
+    return out
+
+
+@timed('render')
+def render_games(df, columns_to_show, platform='bgg', order_by='Title', how_many_rows=10,
+                 desc=False, reverse=False, on='Game'):
+    '''
+    Same HTML as annotate_table, rearrange_table and render_table in a row,
+    with the info cells pre-rendered instead of merged and formatted per request
+    '''
+    if platform == 'bgg':
+        renderer = load_bg_renderer()
+    if platform == 'steam':
+        renderer = load_vg_renderer()
+    return renderer.render(df, columns_to_show, order_by=order_by, how_many_rows=how_many_rows,
+                           desc=desc, reverse=reverse, on=on)
+
+
+def get_games(steam_id, steam_api_key):
+    '''
+    Returns a list of (game ids, playtime) tuples
+    '''
+    from src.steam_client import SteamAPIError
+
+    try:
+        with stage('steam_api'):
+            games_list = load_steam_client(steam_api_key).owned_games(steam_id) # List of dictionaries
+    except SteamAPIError:
+        return("500")
+
+    if games_list == None:
+        return("No games")
+
+    else:
+        out =[(game.get('appid'), game.get('playtime_forever')) for game in games_list \
+              if game.get('playtime_forever') > 0]
+
+        # Convert game ids to names, dropping games that aren't in the dataset
+        out = load_vg_catalog().named_playtimes(out)
+
+        return out
+
+
+def recommend_games(games,
+    platform='bgg',
+    min_neighbors=3,
+    neighbor_cutoff=0.15,
+    based_on_n=3,
+    popular_games=True,
+    top=None,
+    reverse=False):
+    '''
+    Takes list of (game, ratings) tuples and returns pandas dataframe
+    With top, only the top games with positive scores (the bottom games with
+    negative scores if reverse) that are in the catalog, otherwise every game
+    (for exports)
+    Results are cached per canonical profile (see recommendation_cache), the
+    games as given are scored; a profile with the same canonical form as a
+    cached one gets the cached recommendations
+    '''
+    user_games = load_vg_catalog().positions([game_name for (game_name, playtime) in games])
+    canonical_games, canonical_positions = canonical_profile(games, user_games)
+    key = (data_version(), profile_fingerprint(platform, canonical_games, canonical_positions, min_neighbors,
+                                               neighbor_cutoff, based_on_n, popular_games, top, reverse))
+
+    output_df = recommendation_cache.get(key)
+    note(recommendation_cache='miss' if output_df is None else 'hit')
+    if output_df is None:
+        output_df = _recommend_games(games, user_games, platform, min_neighbors, neighbor_cutoff,
+                                     based_on_n, popular_games, top, reverse)
+        recommendation_cache.set(key, output_df)
+
+    # Callers get their own copy, the cached frame is shared
+    return output_df.copy()
+
+
+def _recommend_games(games, user_games, platform, min_neighbors, neighbor_cutoff, based_on_n,
+                     popular_games, top=None, reverse=False):
+
+    game_names = [game_name for (game_name, playtime) in games]
+    playtimes = [playtime for (game_name, playtime) in games]
+
+    # Item similarity matrix -- df with video games as columns, board or board games as rows
+    # For video games, remove rows corresponding to already owned games
+    if platform == 'bgg':
+        ism = load_bgg_data()
+        aligned = load_bgg_alignment()
+        rows = np.ones(len(ism.index), dtype=bool)
+    else:
+        ism = load_steam_data()
+        aligned = load_steam_alignment()
+        rows = np.ones(len(ism.index), dtype=bool)
+        owned = aligned.matrix_rows[user_games]
+        rows[owned[owned >= 0]] = False
+
+    # Only include columns for games that user has played
+    columns = aligned.matrix_columns[user_games]
+    if (columns < 0).any():
+        raise KeyError([game for (game, column) in zip(game_names, columns) if column < 0])
+
+    # Neighbor counts, predictions, and 'Recommended because…' games in one pass
+    with stage('score'):
+        if isinstance(ism, SparseSimilarity):
+            games_with_neighbors, predictions, sim_games = score_games_sparse(ism, columns, playtimes,
+                                                                              rows=rows,
+                                                                              min_neighbors=min_neighbors,
+                                                                              neighbor_cutoff=neighbor_cutoff,
+                                                                              based_on_n=based_on_n)
+        elif isinstance(ism, FactorizedSimilarity):
+            games_with_neighbors, predictions, sim_games = score_games_factorized(ism, columns, playtimes,
+                                                                                  rows=rows,
+                                                                                  min_neighbors=min_neighbors,
+                                                                                  neighbor_cutoff=neighbor_cutoff,
+                                                                                  based_on_n=based_on_n)
+        else:
+            # Quantized (int8/float16) matrices are widened to float64 for the user's columns only
+            with stage('filter'):
+                values = dequantize(ism.to_numpy().take(columns, axis=1)[rows])
+            games_with_neighbors, predictions, sim_games = score_games(values, playtimes,
+                                                                      min_neighbors=min_neighbors,
+                                                                      neighbor_cutoff=neighbor_cutoff,
+                                                                      based_on_n=based_on_n)
+
+    if len(games_with_neighbors) == 0:
+        print('There are no similar board games in the dataset. Try changing advanced settings.')
+
+    # Global average for every game, used if a game doesn't have neighbors
+    # No averages if user doesn't want popular games reccommended
+    if popular_games:
+        averages = aligned.row_averages[rows]
+    else:
+        averages = None
+
+    with stage('select'):
+        if top is None:
+            return build_recommendations(ism.index[rows], game_names, games_with_neighbors,
+                                         predictions, sim_games, averages=averages)
+
+        # Only games that can be shown are selected
+        return select_recommendations(ism.index[rows], game_names, games_with_neighbors, predictions,
+                                      sim_games, top, averages=averages, reverse=reverse,
+                                      rows=aligned.row_positions[rows] >= 0)
+
+
+def _score_profiles(ism, profiles, rows, **settings):
+    # score_games results for a list of (columns, playtimes), one row mask per profile
+    # (one matrix product for everyone on the dense matrices)
+    if isinstance(ism, SparseSimilarity):
+        return [score_games_sparse(ism, columns, playtimes, rows=mask, **settings)
+                for ((columns, playtimes), mask) in zip(profiles, rows)]
+    if isinstance(ism, FactorizedSimilarity):
+        return [score_games_factorized(ism, columns, playtimes, rows=mask, **settings)
+                for ((columns, playtimes), mask) in zip(profiles, rows)]
+    return score_users(ism.to_numpy(), profiles, rows=rows, **settings)
+
+
+# Group mode: recommendations for several players at once
+
+def get_group_games(steam_ids, steam_api_key, max_workers=group_fetch_workers):
+    '''
+    get_games for every steam id, at most max_workers requests at a time
+    Returns (OrderedDict steam id -> list of (game, playtime) tuples,
+             OrderedDict steam id -> error message) so one private profile
+             or Steam error doesn't stop the others
+    '''
+    steam_ids = list(OrderedDict.fromkeys(str(steam_id).strip() for steam_id in steam_ids))
+
+    # Worker threads filter the libraries with the caller's data version (not the
+    # active one, which can change during the fetch) and time into its trace
+    version = data_version()
+    request_trace = current_trace()
+
+    def fetch(steam_id):
+        with using_data_version(version), attached(request_trace):
+            return get_games(steam_id, steam_api_key)
+
+    with stage('steam_api_group'):
+        with ThreadPoolExecutor(max_workers=max(min(max_workers, len(steam_ids)), 1)) as pool:
+            results = list(pool.map(fetch, steam_ids))
+
+    games = OrderedDict()
+    errors = OrderedDict()
+    for (steam_id, result) in zip(steam_ids, results):
+        if result == '500':
+            errors[steam_id] = 'Steam API error (not a valid Steam ID?)'
+        elif result == 'No games':
+            errors[steam_id] = 'no games (private profile?)'
+        elif len(result) == 0:
+            errors[steam_id] = 'no games in the dataset'
+        else:
+            games[steam_id] = result
+    return games, errors
+
+
+def recommend_group_games(members,
+    platform='bgg',
+    rule='mean',
+    min_neighbors=3,
+    neighbor_cutoff=0.15,
+    based_on_n=3,
+    popular_games=True,
+    top=10,
+    reverse=False):
+    '''
+    Takes an OrderedDict of member name -> list of (game, ratings) tuples
+    (normalized per member) and returns the top games for the whole group,
+    with the members' scores combined by rule (see scoring.group_rules)
+    Everyone is scored in one matrix product on the dense matrices; for
+    video games, games anyone in the group owns aren't recommended
+    '''
+    vg_catalog = load_vg_catalog()
+    if platform == 'bgg':
+        ism = load_bgg_data()
+        aligned = load_bgg_alignment()
+    else:
+        ism = load_steam_data()
+        aligned = load_steam_alignment()
+    rows = np.ones(len(ism.index), dtype=bool)
+
+    profiles = []
+    for (member, games) in members.items():
+        user_games = vg_catalog.positions([game_name for (game_name, playtime) in games])
+        columns = aligned.matrix_columns[user_games]
+        if (columns < 0).any():
+            raise KeyError([game for ((game, _), column) in zip(games, columns) if column < 0])
+        profiles.append((columns, np.array([playtime for (game_name, playtime) in games], dtype=float)))
+        if platform != 'bgg':
+            owned = aligned.matrix_rows[user_games]
+            rows[owned[owned >= 0]] = False
+
+    with stage('score'):
+        results = _score_profiles(ism, profiles, [rows] * len(profiles), min_neighbors=min_neighbors,
+                                  neighbor_cutoff=neighbor_cutoff, based_on_n=based_on_n)
+
+    averages = aligned.row_averages[rows] if popular_games else None
+    with stage('select'):
+        return select_group_recommendations(ism.index[rows],
+                                            [(member, [game_name for (game_name, playtime) in games], result)
+                                             for ((member, games), result) in zip(members.items(), results)],
+                                            top, rule=rule, averages=averages, reverse=reverse,
+                                            rows=aligned.row_positions[rows] >= 0)
+
+
+# Batch mode: recommendations for many users at once (see batch_recommend)
+
+def split_known_games(games, platform='bgg'):
+    '''
+    Splits a list of (game, ratings) tuples into the ones that can be scored
+    on platform's matrix and the names of the others
+    '''
+    aligned = load_bgg_alignment() if platform == 'bgg' else load_steam_alignment()
+    positions = load_vg_catalog().positions([game_name for (game_name, playtime) in games])
+    known = positions >= 0
+    known[known] = aligned.matrix_columns[positions[known]] >= 0
+    return ([game for (game, is_known) in zip(games, known) if is_known],
+            [game_name for ((game_name, playtime), is_known) in zip(games, known) if not is_known])
+
+
+def recommend_users(users,
+    platform='bgg',
+    min_neighbors=3,
+    neighbor_cutoff=0.15,
+    based_on_n=3,
+    popular_games=True,
+    top=10):
+    '''
+    Takes a list of lists of (game, ratings) tuples, one per user, and returns
+    a list of dataframes with every user's top games (as recommend_games)
+    Everyone is scored in one matrix product on the dense matrices
+    '''
+    vg_catalog = load_vg_catalog()
+    if platform == 'bgg':
+        ism = load_bgg_data()
+        aligned = load_bgg_alignment()
+    else:
+        ism = load_steam_data()
+        aligned = load_steam_alignment()
+
+    profiles = []
+    masks = []
+    for games in users:
+        user_games = vg_catalog.positions([game_name for (game_name, playtime) in games])
+        columns = aligned.matrix_columns[user_games]
+        if (columns < 0).any():
+            raise KeyError([game for ((game, _), column) in zip(games, columns) if column < 0])
+        profiles.append((columns, np.array([playtime for (game_name, playtime) in games], dtype=float)))
+
+        # For video games, remove rows corresponding to already owned games
+        rows = np.ones(len(ism.index), dtype=bool)
+        if platform != 'bgg':
+            owned = aligned.matrix_rows[user_games]
+            rows[owned[owned >= 0]] = False
+        masks.append(rows)
+
+    if len(profiles) == 0:
+        return []
+    with stage('score'):
+        results = _score_profiles(ism, profiles, masks, min_neighbors=min_neighbors,
+                                  neighbor_cutoff=neighbor_cutoff, based_on_n=based_on_n)
+
+    with stage('select'):
+        return [select_recommendations(ism.index[rows], [game_name for (game_name, playtime) in games],
+                                       games_with_neighbors, predictions, sim_games, top,
+                                       averages=aligned.row_averages[rows] if popular_games else None,
+                                       rows=aligned.row_positions[rows] >= 0)
+                for (games, rows, (games_with_neighbors, predictions, sim_games)) in zip(users, masks, results)]
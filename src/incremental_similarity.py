@@ -0,0 +1,361 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from src.similarity_store import load_similarity_values, read_similarity_meta, values_filename
+from src.quantization import quantize, dequantize
+from src.build_similarity import (read_dataset, prepare_ratings, add_z_scores, user_item_matrix,
+                                  build_similarity_matrix, build_matrices, default_block_size)
+
+# Incremental updates of the item similarity matrices
+#
+#   python -m src.build_similarity go_analog_dataset web_app_dataset --keep-state
+#   python -m src.incremental_similarity update web_app_dataset --bgg new_ratings.csv --steam new_playtimes.csv
+#   python -m src.incremental_similarity check go_analog_dataset
+#
+# Cosine similarity is dot(a, b) / (|a| |b|), so next to the matrices we keep
+# (in web_app_dataset/ism_state)
+#   bgg_ratings.csv / steam_playtimes.csv : the pruned ratings the matrices were built from
+#   dots_bgg / dots_steam                 : raw dot products of the z-score vectors (similarity store format)
+#   bg_norms.npy / vg_norms.npy           : squared length of every game's z-score vector
+# A batch of new (User, Game, Rating/Playtime) rows replaces those users' old
+# scores, their z-scores are recomputed, and only the dot products, norms and
+# similarity rows/columns of games those users rated are updated
+#
+# Ratings for games that aren't in the matrices are skipped (adding games needs
+# a full build, which also re-runs pruning). The neighbor indexes and sparse
+# matrices are derived from the matrices, so rebuild them after an update
+#
+# An update is written to copies of the files, which replace the originals
+# (os.replace) once everything is written. Servers that have a matrix mapped
+# keep reading the old file until they reload it, they never see a half-written
+# one. For running servers, update a copy of the data and publish it as a new
+# version (see data_versions), so they swap in the new matrices and catalogs together
+#
+# Updates don't re-run pruning. Rows from users the matrices were built
+# without (new users, or users the build pruned) are skipped and listed in
+# the report as pruned_users; whether they'd survive pruning takes a full
+# build, so rebuild when that list grows. Games that pruning would now keep
+# or drop stay as they are
+#
+# check compares an update with a full build (pruning included) from the
+# ratings the update applied, and reports the games only one of them has
+
+state_dirname = 'ism_state'
+
+# Stored similarity scores are rounded to 2 decimals (see quantization)
+score_step = 0.01
+# Largest difference between exact similarities (before rounding) of an update
+# and a full build: dot products summed in a different order, float64 rounding only
+exact_tolerance = 1e-9
+
+
+def _state_files(path):
+    return {'bgg': os.path.join(path, 'bgg_ratings.csv'),
+            'steam': os.path.join(path, 'steam_playtimes.csv'),
+            'dots_bgg': os.path.join(path, 'dots_bgg'),
+            'dots_steam': os.path.join(path, 'dots_steam'),
+            'bg_norms': os.path.join(path, 'bg_norms.npy'),
+            'vg_norms': os.path.join(path, 'vg_norms.npy')}
+
+
+def _squared_norms(ui):
+    return np.asarray(ui.multiply(ui).sum(axis=1)).ravel()
+
+
+def save_state(bgg, steam, path, bg_ids, vg_ids, block_size=default_block_size, workers=1):
+    '''
+    Saves ratings, dot products and norms for the matrices built from bgg and steam
+    (prepared ratings, see prepare_ratings) with rows/columns bg_ids and vg_ids
+    '''
+    files = _state_files(path)
+    os.makedirs(path, exist_ok=True)
+    bgg[['User', 'Game', 'Rating']].to_csv(files['bgg'], index=False)
+    steam[['User', 'Game', 'Playtime']].to_csv(files['steam'], index=False)
+
+    users = np.unique(np.concatenate([bgg.User.unique(), steam.User.unique()]))
+    ui_bgg, _ = user_item_matrix(bgg, 'Rating_Z', users, games=bg_ids)
+    ui_steam, _ = user_item_matrix(steam, 'Playtime_Z', users, games=vg_ids)
+    build_similarity_matrix(ui_bgg, ui_steam, files['dots_bgg'], bg_ids, vg_ids, block_size=block_size,
+                            workers=workers, cosine=False)
+    build_similarity_matrix(ui_steam, ui_steam, files['dots_steam'], vg_ids, vg_ids, block_size=block_size,
+                            workers=workers, cosine=False)
+    np.save(files['bg_norms'], _squared_norms(ui_bgg))
+    np.save(files['vg_norms'], _squared_norms(ui_steam))
+
+
+def _upsert(ratings, updates, value_column):
+    # New scores replace the old ones for the same (User, Game)
+    keys = pd.MultiIndex.from_frame(updates[['User', 'Game']])
+    old = pd.MultiIndex.from_frame(ratings[['User', 'Game']]).isin(keys)
+    updates = updates.drop_duplicates(['User', 'Game'], keep='last')
+    return pd.concat([ratings[~old], updates[['User', 'Game', value_column]]], ignore_index=True)
+
+
+def _cosine(dots, row_norms, column_norms, decimals=2):
+    lengths = np.sqrt(np.outer(row_norms, column_norms))
+    out = np.clip(np.divide(dots, lengths, out=np.zeros_like(dots), where=lengths > 0), -1.0, 1.0)
+    return out if decimals is None else out.round(decimals)
+
+
+def _touched(*matrices):
+    # Rows (games) with a score from any of the changed users
+    return np.unique(np.concatenate([matrix.nonzero()[0] for matrix in matrices]))
+
+
+def _add_block(values, rows, columns, delta):
+    if len(rows) and len(columns):
+        values[np.ix_(rows, columns)] = values[np.ix_(rows, columns)] + delta
+
+
+def _write_rows(values, rows, block):
+    if len(rows):
+        values[rows] = quantize(block, values.dtype)
+
+
+def _write_columns(values, columns, block):
+    if len(columns):
+        values[:, columns] = quantize(block, values.dtype)
+
+
+def _tmp_filepath(filepath):
+    return filepath + '.' + str(os.getpid()) + '.tmp'
+
+
+def _working_copy(path):
+    '''
+    Writable copy of the values of the store at path, next to them
+    '''
+    meta = read_similarity_meta(path)
+    filepath = os.path.join(path, values_filename)
+    shutil.copyfile(filepath, _tmp_filepath(filepath))
+    return np.memmap(_tmp_filepath(filepath), dtype=np.dtype(meta['dtype']), mode='r+',
+                     shape=tuple(meta['shape']))
+
+
+def apply_updates(out_dir, bgg_updates=None, steam_updates=None):
+    '''
+    Folds new board game ratings (User, Game, Rating) and Steam playtimes
+    (User, Game, Playtime) into the matrices in out_dir and their saved state
+    Every file is replaced atomically once all of them are written (see above)
+    Returns a dict with the number of users, ratings and similarity rows/columns
+    updated, and the users whose rows were skipped (pruned_users, see above)
+    '''
+    files = _state_files(os.path.join(out_dir, state_dirname))
+    stores = [files['dots_bgg'], files['dots_steam'], os.path.join(out_dir, 'ism_bgg'),
+              os.path.join(out_dir, 'ism_steam')]
+    replaced = [files['bg_norms'], files['vg_norms'], files['bgg'], files['steam']] + \
+        [os.path.join(path, values_filename) for path in stores]
+    try:
+        report = _apply_updates(files, stores, bgg_updates, steam_updates)
+        # State first, so a crash in between leaves matrices the state can still update
+        for filepath in replaced:
+            os.replace(_tmp_filepath(filepath), filepath)
+    finally:
+        for filepath in replaced:
+            if os.path.exists(_tmp_filepath(filepath)):
+                os.remove(_tmp_filepath(filepath))
+    return report
+
+
+def _apply_updates(files, stores, bgg_updates, steam_updates):
+    # Writes the updated copies of every file (see apply_updates)
+    _, bg_ids, vg_ids = load_similarity_values(files['dots_bgg'])
+    dots_bgg, dots_steam, ism_bgg, ism_steam = [_working_copy(path) for path in stores]
+    bg_norms = np.load(files['bg_norms'])
+    vg_norms = np.load(files['vg_norms'])
+
+    bgg = pd.read_csv(files['bgg'])
+    steam = pd.read_csv(files['steam'])
+    if bgg_updates is None:
+        bgg_updates = bgg.iloc[:0]
+    if steam_updates is None:
+        steam_updates = steam.iloc[:0]
+
+    # Only games that are in the matrices, from users the matrices were built with
+    n_updates = len(bgg_updates) + len(steam_updates)
+    bgg_updates = bgg_updates[bgg_updates.Game.isin(bg_ids)]
+    steam_updates = steam_updates[steam_updates.Game.isin(vg_ids)]
+    pruned_users = np.setdiff1d(np.concatenate([bgg_updates.User.unique(), steam_updates.User.unique()]),
+                                np.concatenate([bgg.User.unique(), steam.User.unique()]))
+    bgg_updates = bgg_updates[~bgg_updates.User.isin(pruned_users)]
+    steam_updates = steam_updates[~steam_updates.User.isin(pruned_users)]
+    users = np.unique(np.concatenate([bgg_updates.User.unique(), steam_updates.User.unique()]))
+
+    # Scores of the changed users before and after the batch
+    old_bgg, old_steam = add_z_scores(bgg[bgg.User.isin(users)], steam[steam.User.isin(users)])
+    bgg = _upsert(bgg, bgg_updates, 'Rating')
+    # Playtimes under 10 minutes are dropped, same as a full build
+    steam = _upsert(steam, steam_updates, 'Playtime')
+    steam = steam[steam.Playtime >= 10]
+    new_bgg, new_steam = add_z_scores(bgg[bgg.User.isin(users)], steam[steam.User.isin(users)])
+    x_old, _ = user_item_matrix(old_bgg, 'Rating_Z', users, games=bg_ids)
+    x_new, _ = user_item_matrix(new_bgg, 'Rating_Z', users, games=bg_ids)
+    y_old, _ = user_item_matrix(old_steam, 'Playtime_Z', users, games=vg_ids)
+    y_new, _ = user_item_matrix(new_steam, 'Playtime_Z', users, games=vg_ids)
+
+    # Dot products change only between games the changed users scored
+    bg_touched = _touched(x_old, x_new)
+    vg_touched = _touched(y_old, y_new)
+    _add_block(dots_bgg, bg_touched, vg_touched,
+               (x_new[bg_touched] @ y_new[vg_touched].T - x_old[bg_touched] @ y_old[vg_touched].T).toarray())
+    _add_block(dots_steam, vg_touched, vg_touched,
+               (y_new[vg_touched] @ y_new[vg_touched].T - y_old[vg_touched] @ y_old[vg_touched].T).toarray())
+    bg_norms = bg_norms + _squared_norms(x_new) - _squared_norms(x_old)
+    vg_norms = vg_norms + _squared_norms(y_new) - _squared_norms(y_old)
+
+    # Similarity for every pair that involves a touched game
+    _write_rows(ism_bgg, bg_touched, _cosine(np.asarray(dots_bgg[bg_touched]), bg_norms[bg_touched], vg_norms))
+    _write_columns(ism_bgg, vg_touched, _cosine(np.asarray(dots_bgg[:, vg_touched]), bg_norms, vg_norms[vg_touched]))
+    _write_rows(ism_steam, vg_touched, _cosine(np.asarray(dots_steam[vg_touched]), vg_norms[vg_touched], vg_norms))
+    _write_columns(ism_steam, vg_touched, _cosine(np.asarray(dots_steam[:, vg_touched]), vg_norms, vg_norms[vg_touched]))
+
+    for values in (dots_bgg, dots_steam, ism_bgg, ism_steam):
+        values.flush()
+    for (name, norms) in (('bg_norms', bg_norms), ('vg_norms', vg_norms)):
+        with open(_tmp_filepath(files[name]), 'wb') as f:
+            np.save(f, norms)
+    bgg.to_csv(_tmp_filepath(files['bgg']), index=False)
+    steam.to_csv(_tmp_filepath(files['steam']), index=False)
+
+    return {'users': len(users),
+            'pruned_users': pruned_users.tolist(),
+            'ratings': len(bgg_updates) + len(steam_updates),
+            'skipped': n_updates - len(bgg_updates) - len(steam_updates),
+            'board_game_rows': len(bg_touched),
+            'video_game_rows': len(vg_touched)}
+
+
+def _aligned(a_ids, b_ids):
+    # Positions of the ids both have, in a_ids and in b_ids
+    common = np.intersect1d(a_ids, b_ids)
+    return pd.Index(a_ids).get_indexer(common), pd.Index(b_ids).get_indexer(common)
+
+
+def _similarities(out_dir):
+    '''
+    {matrix name: (exact similarities from the saved state, stored (rounded) similarities, row ids, column ids)}
+    '''
+    files = _state_files(os.path.join(out_dir, state_dirname))
+    bg_norms = np.load(files['bg_norms'])
+    vg_norms = np.load(files['vg_norms'])
+    out = {}
+    for (name, dots_name, row_norms) in (('ism_bgg', 'dots_bgg', bg_norms), ('ism_steam', 'dots_steam', vg_norms)):
+        dots, rows, columns = load_similarity_values(files[dots_name])
+        stored, _, _ = load_similarity_values(os.path.join(out_dir, name))
+        out[name] = (_cosine(np.asarray(dots), row_norms, vg_norms, decimals=None),
+                     dequantize(np.asarray(stored)), np.asarray(rows), np.asarray(columns))
+    return out
+
+
+def check_consistency(dataset_dir, holdout=0.05, changed=0.02, seed=0, cutoff_users=10, cutoff_games=5):
+    '''
+    Builds the matrices from the dataset without a holdout share of the ratings,
+    applies the holdout (plus changed scores for another share of ratings) as an
+    incremental update, and compares the result with a full build from the
+    ratings the update applied (preprocessing and pruning included)
+    Returns a dict with the games only one of them has and, for the games both
+    have, the largest difference of the exact similarities and of the stored scores
+    '''
+    bgg, steam, vg, bg = read_dataset(dataset_dir)
+    bgg = bgg[['User', 'Game', 'Rating']]
+    steam = steam[['User', 'Game', 'Playtime']]
+    rng = np.random.RandomState(seed)
+
+    def split(df, value_column, scale):
+        held_out = rng.rand(len(df)) < holdout
+        base = df[~held_out]
+        updates = df[held_out]
+        changes = base[rng.rand(len(base)) < changed]
+        changes = changes.assign(**{value_column: scale(changes[value_column])})
+        return base, pd.concat([updates, changes], ignore_index=True)
+
+    bgg_base, bgg_updates = split(bgg, 'Rating', lambda x: (10 - x).clip(1, 10))
+    steam_base, steam_updates = split(steam, 'Playtime', lambda x: x * rng.randint(1, 4, len(x)))
+
+    def build(bgg, steam, out_dir):
+        bgg, steam, vg_prepared, bg_prepared = prepare_ratings(bgg, steam, vg, bg, cutoff_users=cutoff_users,
+                                                               cutoff_games=cutoff_games)
+        bg_ids, vg_ids = build_matrices(bgg, steam, vg_prepared, bg_prepared, out_dir)
+        save_state(bgg, steam, os.path.join(out_dir, state_dirname), bg_ids, vg_ids)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        incremental_dir = os.path.join(tmp, 'incremental')
+        full_dir = os.path.join(tmp, 'full')
+        build(bgg_base, steam_base, incremental_dir)
+        report = apply_updates(incremental_dir, bgg_updates, steam_updates)
+        # Without the rows the update skipped (see pruned_users)
+        bgg_updates = bgg_updates[~bgg_updates.User.isin(report['pruned_users'])]
+        steam_updates = steam_updates[~steam_updates.User.isin(report['pruned_users'])]
+        build(_upsert(bgg_base, bgg_updates, 'Rating'), _upsert(steam_base, steam_updates, 'Playtime'), full_dir)
+
+        incremental = _similarities(incremental_dir)
+        full = _similarities(full_dir)
+        consistent = True
+        for name in ('ism_bgg', 'ism_steam'):
+            (exact, stored, rows, columns) = incremental[name]
+            (full_exact, full_stored, full_rows, full_columns) = full[name]
+            # Games pruning keeps in one build and not in the other
+            only_incremental = len(np.setdiff1d(rows, full_rows)) + len(np.setdiff1d(columns, full_columns))
+            only_full = len(np.setdiff1d(full_rows, rows)) + len(np.setdiff1d(full_columns, columns))
+            row_positions, full_row_positions = _aligned(rows, full_rows)
+            column_positions, full_column_positions = _aligned(columns, full_columns)
+            cells = np.ix_(row_positions, column_positions)
+            full_cells = np.ix_(full_row_positions, full_column_positions)
+            exact_diff = np.abs(exact[cells] - full_exact[full_cells])
+            diff = np.abs(stored[cells] - full_stored[full_cells])
+
+            report[name + '_games_only_incremental'] = only_incremental
+            report[name + '_games_only_full'] = only_full
+            report[name + '_exact_max_diff'] = float(np.nanmax(exact_diff, initial=0))
+            report[name + '_max_diff'] = float(np.nanmax(diff, initial=0))
+            report[name + '_cells_differing'] = int(np.count_nonzero(diff > exact_tolerance))
+            # Exact similarities that agree to exact_tolerance round to the same
+            # score, or to neighboring scores if they straddle a rounding boundary
+            consistent = consistent and only_incremental == 0 and only_full == 0 and \
+                report[name + '_exact_max_diff'] <= exact_tolerance and \
+                report[name + '_max_diff'] <= score_step + exact_tolerance
+    finally:
+        shutil.rmtree(tmp)
+
+    report['consistent'] = consistent
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Incremental updates of the item similarity matrices')
+    commands = parser.add_subparsers(dest='command')
+    update = commands.add_parser('update', help='fold new ratings/playtimes into the matrices')
+    update.add_argument('out_dir', help='directory with ism_bgg, ism_steam and ism_state')
+    update.add_argument('--bgg', help='csv of new board game ratings (User, Game, Rating)')
+    update.add_argument('--steam', help='csv of new Steam playtimes (User, Game, Playtime)')
+    check = commands.add_parser('check', help='compare an incremental update with a full build')
+    check.add_argument('dataset_dir', help='directory with the go_analog_dataset csv files')
+    check.add_argument('--holdout', type=float, default=0.05, help='share of ratings added incrementally')
+    args = parser.parse_args(argv)
+
+    if args.command == 'update':
+        report = apply_updates(args.out_dir,
+                               bgg_updates=pd.read_csv(args.bgg) if args.bgg else None,
+                               steam_updates=pd.read_csv(args.steam) if args.steam else None)
+    elif args.command == 'check':
+        report = check_consistency(args.dataset_dir, holdout=args.holdout)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+    for (key, value) in report.items():
+        if isinstance(value, list):
+            value = str(len(value)) + (' (' + ', '.join(map(str, value[:10])) + (', …' if len(value) > 10 else '')
+                                       + ')' if value else '')
+        print(key + ': ' + str(value))
+    if args.command == 'check' and not report['consistent']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import bisect
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Lightweight per-stage timing for requests
+#
+#   with trace('go_analog_app', platform='bgg'):     # one per request
+#       with stage('steam_api'):                      # or @timed('steam_api')
+#           ...
+#
+# Every stage is added to a process-wide histogram (fixed buckets, so memory
+# doesn't grow with traffic) and to the trace of the request running on the
+# current thread, if there is one. When a trace ends it logs one JSON line
+# (logger 'go_analog') with the request's stage timings and notes, e.g.
+#   {"request": "go_analog_app", "status": "ok", "total_ms": 41.2,
+#    "stages_ms": {"steam_api": 30.1, "score": 8.4, ...}, "platform": "bgg", "recommendation_cache": "miss"}
+# Set GO_ANALOG_INSTRUMENTATION=0 to turn it off
+
+enabled = os.environ.get('GO_ANALOG_INSTRUMENTATION', '1') != '0'
+
+# Histogram bucket upper bounds in ms
+bucket_bounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, math.inf)
+
+logger = logging.getLogger('go_analog')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Histogram:
+    '''
+    Counts of timings in fixed buckets (quantiles are bucket upper bounds, capped at the max)
+    '''
+
+    def __init__(self, bounds=bucket_bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for (bound, count) in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean_ms': round(self.total / self.count, 3) if self.count else 0.0,
+                'p50_ms': round(self.quantile(0.5), 3),
+                'p95_ms': round(self.quantile(0.95), 3),
+                'max_ms': round(self.max, 3)}
+
+
+class Metrics:
+    '''
+    Thread-safe stage histograms and counters for the process
+    '''
+
+    def __init__(self):
+        self.histograms = OrderedDict()
+        self.counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, name, ms):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(ms)
+
+    def increment(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {'stages': OrderedDict((name, histogram.summary())
+                                          for (name, histogram) in self.histograms.items()),
+                    'counters': OrderedDict(self.counters)}
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+metrics = Metrics()
+_local = threading.local()
+
+
+class Trace:
+    '''
+    Stage timings (ms, summed if a stage runs more than once) and notes for one request
+    '''
+
+    def __init__(self, name, **notes):
+        self.name = name
+        self.notes = notes
+        self.stages = OrderedDict()
+        self.status = 'ok'
+        self.start = time.perf_counter()
+        self.total_ms = None
+        # Worker threads of the request add their stages too (see attached)
+        self._lock = threading.Lock()
+
+    def add(self, stage_name, ms):
+        with self._lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0.0) + ms
+
+    def record(self):
+        return dict([('request', self.name),
+                     ('status', self.status),
+                     ('total_ms', round(self.total_ms, 3) if self.total_ms is not None else None),
+                     ('stages_ms', OrderedDict((name, round(ms, 3)) for (name, ms) in self.stages.items()))],
+                    **self.notes)
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace(name, **notes):
+    '''
+    Traces one request on this thread, logs it when it ends (also if it raises
+    or the page stops early, with the exception name as status)
+    '''
+    request_trace = Trace(name, **notes)
+    if not enabled:
+        yield request_trace
+        return
+
+    parent = current_trace()
+    _local.trace = request_trace
+    try:
+        yield request_trace
+    except BaseException as e:
+        request_trace.status = type(e).__name__
+        raise
+    finally:
+        _local.trace = parent
+        request_trace.total_ms = (time.perf_counter() - request_trace.start) * 1e3
+        metrics.observe(name, request_trace.total_ms)
+        metrics.increment(request_trace.name + ' ' + request_trace.status)
+        logger.info(json.dumps(request_trace.record(), default=str))
+
+
+@contextmanager
+def attached(request_trace):
+    '''
+    Adds the stages timed on this thread to request_trace (e.g. on a worker
+    thread of the request), without logging it
+    '''
+    parent = current_trace()
+    _local.trace = request_trace
+    try:
+        yield request_trace
+    finally:
+        _local.trace = parent
+
+
+@contextmanager
+def stage(name):
+    '''
+    Times a stage into the process histograms and the current request's trace
+    '''
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1e3
+        metrics.observe(name, ms)
+        request_trace = current_trace()
+        if request_trace is not None:
+            request_trace.add(name, ms)
+
+
+def timed(name):
+    '''
+    Decorator version of stage
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def note(**notes):
+    '''
+    Adds notes (e.g. cache hit or miss) to the current request's log line
+    '''
+    request_trace = current_trace()
+    if request_trace is not None:
+        request_trace.notes.update(notes)
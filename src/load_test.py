@@ -0,0 +1,514 @@
+import argparse
+import json
+import os
+import platform as platform_info
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import Request, urlopen
+import numpy as np
+import pandas as pd
+from src.similarity_store import read_json, columns_filename
+from src.steam_client import owned_games_path
+from src.shared_store import memory_usage
+
+# Load test: simulated concurrent sessions against JSON service workers (src/service.py),
+# with a local stub of the Steam API, to see how many sessions a worker handles
+#
+#   python -m src.load_test run out.json --concurrency 1 4 16 64 --workers 1 2
+#   python -m src.load_test run sparse.json --env ISM_FORMAT=sparse --env RECOMMENDATION_CACHE_ENTRIES=0
+#   python -m src.load_test compare out.json sparse.json
+#   python -m src.load_test stub --port 8001 --latency-ms 200    (the stub alone, for run --stub-url)
+#
+# Every session replays the same seeded plan of requests:
+#   recommend_steam : POST /recommend with a Steam id (get_games through the stub, then recommend_games)
+#   recommend_games : POST /recommend with a list of games
+#   similar         : GET /similar (find_similar_games)
+# Steam ids are drawn from a pool of --users profiles, so repeat visits hit
+# the Steam client and recommendation caches like real traffic would.
+# For every worker count and concurrency level, fresh workers are started
+# (with --env on top of this environment, e.g. the matrix format or cache
+# sizes), warmed up, then concurrency clients send the plan round-robin
+# across the workers, each one sending its next request as soon as the last
+# one returned. Reported per flow: throughput, p50/p95/p99 latency (ms) and
+# status counts; per level: the peak resident memory of the workers (MB).
+#
+# The stub serves GetOwnedGames with a library per Steam id (size drawn from
+# --library-sizes, games from the catalog, some private profiles) and a
+# latency per call (--latency-ms plus exponential jitter), all derived from
+# the seed, the Steam id and how many times it was asked for it
+
+flows = ('recommend_steam', 'recommend_games', 'similar')
+default_mix = OrderedDict([('recommend_steam', 0.4), ('recommend_games', 0.4), ('similar', 0.2)])
+default_concurrency = (1, 4, 16)
+default_library_sizes = (10, 100, 1000)
+default_games_per_request = (3, 10, 30)
+# First 64-bit Steam id, stub profiles are numbered from there
+steam_id_base = 76561197960265728
+api_key = 'load-test'
+
+
+# Steam API stub
+
+class SteamStub:
+    '''
+    Owned games for made-up Steam ids, the same for the same seed
+    '''
+
+    def __init__(self, appids, library_sizes=default_library_sizes, latency_ms=100, jitter_ms=50,
+                 private_rate=0.05, error_rate=0.0, seed=0):
+        self.appids = np.asarray(appids)
+        self.library_sizes = library_sizes
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.private_rate = private_rate
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, steam_id, *more):
+        return np.random.RandomState([self.seed, steam_id % 2 ** 32, steam_id // 2 ** 32] + list(more))
+
+    def library(self, steam_id):
+        '''
+        List of owned game dicts, or None for a private profile
+        '''
+        rng = self._rng(steam_id)
+        if rng.random_sample() < self.private_rate:
+            return None
+        size = min(int(rng.choice(self.library_sizes)), len(self.appids))
+        appids = rng.choice(self.appids, size, replace=False)
+        playtimes = rng.lognormal(6, 1.5, size).astype(int)
+        # About a third of owned games are never played
+        playtimes[rng.random_sample(size) < 0.3] = 0
+        return [{'appid': int(appid), 'playtime_forever': int(playtime)}
+                for (appid, playtime) in zip(appids, playtimes)]
+
+    def respond(self, steam_id):
+        '''
+        Returns (delay in seconds, status code, body) for the next call for steam_id
+        '''
+        with self._lock:
+            call = self.calls.get(steam_id, 0)
+            self.calls[steam_id] = call + 1
+        rng = self._rng(steam_id, call)
+        delay = (self.latency_ms + rng.exponential(self.jitter_ms) if self.jitter_ms else self.latency_ms) / 1e3
+        if rng.random_sample() < self.error_rate:
+            return delay, 503, {}
+        games = self.library(steam_id)
+        if games is None:
+            return delay, 200, {'response': {}}
+        return delay, 200, {'response': {'game_count': len(games), 'games': games}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+        if url.path.rstrip('/') != owned_games_path.rstrip('/'):
+            status_code, data = 404, {}
+        else:
+            try:
+                delay, status_code, data = self.server.stub.respond(int(query.get('steamid', '')))
+                time.sleep(delay)
+            except ValueError:
+                status_code, data = 400, {}
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stub_server(stub, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.stub = stub
+    return server
+
+
+def start_stub(stub):
+    '''
+    Serves stub from a background thread, returns (server, base url)
+    '''
+    server = make_stub_server(stub)
+    threading.Thread(target=server.serve_forever, name='steam-stub', daemon=True).start()
+    return server, 'http://127.0.0.1:' + str(server.server_address[1])
+
+
+# Request plan
+
+def load_games(data_dir):
+    '''
+    Returns (names, Steam app ids) of the video games every flow can use:
+    in the Steam catalog and in both neighbor indexes (which have the same
+    columns as the matrices, whatever their format)
+    '''
+    info = pd.read_csv(os.path.join(data_dir, 'vg_info_for_app.csv'), usecols=['Id', 'Name'])
+    known = None
+    for name in ('ism_bgg_neighbors', 'ism_steam_neighbors'):
+        columns = set(read_json(os.path.join(data_dir, name, columns_filename)))
+        known = columns if known is None else known & columns
+    info = info[info.Name.isin(known)]
+    return info.Name.tolist(), info.Id.tolist()
+
+
+def make_plan(n_requests, names, users=1000, mix=default_mix, seed=0):
+    '''
+    Returns n_requests (flow, method, path, body) tuples drawn from mix
+    '''
+    rng = np.random.RandomState(seed)
+    flow_names = list(mix)
+    weights = np.array([mix[flow] for flow in flow_names], dtype=float)
+    plan = []
+    for flow in rng.choice(flow_names, n_requests, p=weights / weights.sum()):
+        platform = str(rng.choice(['bgg', 'steam']))
+        if flow == 'recommend_steam':
+            body = {'platform': platform, 'steam_id': str(steam_id_base + rng.randint(users))}
+            plan.append((flow, 'POST', '/recommend', body))
+        elif flow == 'recommend_games':
+            n = min(int(rng.choice(default_games_per_request)), len(names))
+            body = {'platform': platform, 'games': [names[i] for i in rng.choice(len(names), n, replace=False)]}
+            plan.append((flow, 'POST', '/recommend', body))
+        else:
+            query = urlencode({'platform': platform, 'game': names[rng.randint(len(names))], 'n': 10})
+            plan.append((flow, 'GET', '/similar?' + query, None))
+    return plan
+
+
+# Workers
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_workers(n, data_dir, stub_url, env=None, timeout=300):
+    '''
+    Starts n service processes, returns (processes, base urls) once they're all healthy
+    '''
+    worker_env = dict(os.environ, GO_ANALOG_DATA_DIR=data_dir, API_KEY=api_key, STEAM_API_URL=stub_url,
+                      **(env or {}))
+    processes = []
+    urls = []
+    for _ in range(n):
+        port = free_port()
+        processes.append(subprocess.Popen([sys.executable, '-m', 'src.service', '--port', str(port)],
+                                          env=worker_env, stdout=subprocess.DEVNULL,
+                                          stderr=subprocess.DEVNULL))
+        urls.append('http://127.0.0.1:' + str(port))
+
+    deadline = time.monotonic() + timeout
+    for (process, url) in zip(processes, urls):
+        while True:
+            try:
+                urlopen(url + '/health', timeout=5).read()
+                break
+            except (URLError, ConnectionError, socket.timeout):
+                if process.poll() is not None or time.monotonic() > deadline:
+                    stop_workers(processes)
+                    raise RuntimeError('worker on ' + url + " didn't start")
+                time.sleep(0.2)
+    return processes, urls
+
+
+def stop_workers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+# Sessions
+
+def send(url, method, path, body, timeout=60):
+    '''
+    Returns (status code, or None if there was no response, latency in ms)
+    '''
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = Request(url + path, data=data, method=method, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            response.read()
+            status_code = response.status
+    except HTTPError as e:
+        e.read()
+        status_code = e.code
+    except (URLError, ConnectionError, socket.timeout):
+        status_code = None
+    return status_code, (time.perf_counter() - start) * 1e3
+
+
+class MemorySampler:
+    '''
+    Peak resident memory (MB) of the worker processes, sampled every interval seconds (Linux)
+    '''
+
+    def __init__(self, pids, interval=0.25):
+        self.pids = pids
+        self.interval = interval
+        self.peaks = [{} for _ in pids]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+
+    def sample(self):
+        for (pid, peak) in zip(self.pids, self.peaks):
+            for (field, mb) in memory_usage(pid).items():
+                peak[field] = max(peak.get(field, 0.0), mb)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def run_sessions(urls, plan, concurrency):
+    '''
+    Sends the plan from concurrency threads, round-robin across urls
+    Returns ([(flow, status code, latency in ms)] in plan order, wall time in seconds)
+    '''
+    results = [None] * len(plan)
+    next_request = iter(range(len(plan)))
+    lock = threading.Lock()
+
+    def session():
+        while True:
+            with lock:
+                i = next(next_request, None)
+            if i is None:
+                return
+            (flow, method, path, body) = plan[i]
+            results[i] = (flow,) + send(urls[i % len(urls)], method, path, body)
+
+    threads = [threading.Thread(target=session, name='session-' + str(i)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, seconds, **labels):
+    '''
+    One row per flow (and one for all of them): throughput, latency
+    percentiles and status counts (ok, 4xx rejected, 5xx or no response)
+    '''
+    df = pd.DataFrame(results, columns=['flow', 'status', 'ms'])
+    rows = []
+    for (flow, group) in [('all', df)] + [(flow, df[df.flow == flow]) for flow in flows]:
+        if len(group) == 0:
+            continue
+        status = group.status.fillna(0)
+        rows.append(dict(labels,
+                         flow=flow,
+                         requests=len(group),
+                         ok=int((status == 200).sum()),
+                         rejected=int(((status >= 400) & (status < 500)).sum()),
+                         errors=int(((status >= 500) | (status == 0)).sum()),
+                         throughput_rps=round(len(group) / seconds, 2),
+                         p50_ms=round(float(np.percentile(group.ms, 50)), 3),
+                         p95_ms=round(float(np.percentile(group.ms, 95)), 3),
+                         p99_ms=round(float(np.percentile(group.ms, 99)), 3),
+                         max_ms=round(float(group.ms.max()), 3)))
+    return rows
+
+
+def run_level(data_dir, stub_url, workers, concurrency, plan, warmup_plan, env=None):
+    '''
+    Fresh workers, warm-up, then the plan; returns (rows, peak memory per worker)
+    '''
+    processes, urls = start_workers(workers, data_dir, stub_url, env)
+    try:
+        run_sessions(urls, warmup_plan, workers)
+        with MemorySampler([process.pid for process in processes]) as sampler:
+            results, seconds = run_sessions(urls, plan, concurrency)
+    finally:
+        stop_workers(processes)
+
+    rows = summarize(results, seconds, workers=workers, concurrency=concurrency)
+    rss = [peak.get('rss_mb') for peak in sampler.peaks]
+    if None not in rss:
+        rows[0].update(peak_rss_mb=max(rss), mean_rss_mb=round(float(np.mean(rss)), 1))
+    return rows, [dict(peak, workers=workers, concurrency=concurrency, worker=i)
+                  for (i, peak) in enumerate(sampler.peaks)]
+
+
+def run(data_dir, concurrency_levels=default_concurrency, worker_counts=(1,), n_requests=400, users=1000,
+        mix=default_mix, warmup=20, seed=0, env=None, stub_url=None, **stub_settings):
+    '''
+    Runs the plan at every worker count and concurrency level
+    Returns {'meta': {...}, 'results': [one row per level and flow], 'memory': [one per level and worker]}
+    '''
+    names, appids = load_games(data_dir)
+    stub_server = None
+    if stub_url is None:
+        stub_server, stub_url = start_stub(SteamStub(appids, seed=seed, **stub_settings))
+    plan = make_plan(n_requests, names, users, mix, seed)
+    warmup_plan = make_plan(warmup, names, users, mix, seed + 1)
+
+    results = []
+    memory = []
+    try:
+        for workers in worker_counts:
+            for concurrency in concurrency_levels:
+                rows, peaks = run_level(data_dir, stub_url, workers, concurrency, plan, warmup_plan, env)
+                results += rows
+                memory += peaks
+    finally:
+        if stub_server is not None:
+            stub_server.shutdown()
+            stub_server.server_close()
+
+    meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform_info.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform_info.platform(),
+            'cpus': os.cpu_count(),
+            'data_dir': os.path.abspath(data_dir),
+            'games': len(names),
+            'requests': n_requests,
+            'users': users,
+            'mix': mix,
+            'warmup': warmup,
+            'seed': seed,
+            'env': env or {},
+            # An external stub's settings aren't known here
+            'stub': stub_settings if stub_server is not None else {'url': stub_url}}
+    return {'meta': meta, 'results': results, 'memory': memory}
+
+
+def compare(before, after, threshold=1.2):
+    '''
+    Joins two runs on worker count, concurrency and flow
+    Returns a DataFrame with p95 latencies and throughputs, their ratios, and
+    whether the level regressed (p95 up or throughput down by more than threshold)
+    '''
+    keys = ['workers', 'concurrency', 'flow']
+    columns = keys + ['p95_ms', 'throughput_rps']
+    df = pd.DataFrame(before['results'])[columns].merge(
+        pd.DataFrame(after['results'])[columns], on=keys, suffixes=('_before', '_after'))
+    df['p95_ratio'] = (df.p95_ms_after / df.p95_ms_before).round(2)
+    df['throughput_ratio'] = (df.throughput_rps_after / df.throughput_rps_before).round(2)
+    df['regressed'] = (df.p95_ratio > threshold) | (df.throughput_ratio < 1 / threshold)
+    return df
+
+
+def _key_values(items, value_type=str):
+    out = OrderedDict()
+    for item in items:
+        key, _, value = item.partition('=')
+        out[key] = value_type(value)
+    return out
+
+
+def _add_stub_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=100, help='Steam API latency per call')
+    parser.add_argument('--jitter-ms', type=float, default=50, help='mean of the exponential extra latency')
+    parser.add_argument('--library-sizes', type=int, nargs='+', default=list(default_library_sizes),
+                        help='owned games per profile are drawn from these')
+    parser.add_argument('--private-rate', type=float, default=0.05, help='share of private profiles')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with a 503')
+
+
+def _stub_settings(args):
+    return {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'library_sizes': args.library_sizes,
+            'private_rate': args.private_rate, 'error_rate': args.error_rate}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the JSON service with simulated concurrent sessions')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the load test and save the results as JSON')
+    run_parser.add_argument('output', help='.json file for the results')
+    run_parser.add_argument('--data-dir', default=os.environ.get('GO_ANALOG_DATA_DIR', 'web_app_dataset'))
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=list(default_concurrency),
+                            help='simulated users sending requests at the same time')
+    run_parser.add_argument('--workers', type=int, nargs='+', default=[1], help='service processes')
+    run_parser.add_argument('--requests', type=int, default=400, help='requests per level')
+    run_parser.add_argument('--users', type=int, default=1000, help='distinct Steam profiles')
+    run_parser.add_argument('--mix', nargs='+', default=None, metavar='FLOW=WEIGHT',
+                            help='share of every flow (default ' +
+                                 ' '.join(flow + '=' + str(weight) for (flow, weight) in default_mix.items()) + ')')
+    run_parser.add_argument('--warmup', type=int, default=20, help='requests before every level, not measured')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--env', nargs='+', default=[], action='extend', metavar='KEY=VALUE',
+                            help='worker environment, e.g. ISM_FORMAT=sparse RECOMMENDATION_CACHE_MB=64')
+    run_parser.add_argument('--stub-url', default=None, help='use a stub started with the stub command')
+    _add_stub_arguments(run_parser)
+    stub_parser = commands.add_parser('stub', help='serve the Steam API stub')
+    stub_parser.add_argument('--data-dir', default=os.environ.get('GO_ANALOG_DATA_DIR', 'web_app_dataset'))
+    stub_parser.add_argument('--host', default='127.0.0.1')
+    stub_parser.add_argument('--port', type=int, default=8001)
+    stub_parser.add_argument('--seed', type=int, default=0)
+    _add_stub_arguments(stub_parser)
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=1.2,
+                                help='p95 (or inverse throughput) ratio above which a level counts as a regression')
+    args = parser.parse_args(argv)
+
+    pd.set_option('display.width', 200)
+    if args.command == 'run':
+        mix = _key_values(args.mix, float) if args.mix else default_mix
+        unknown = [flow for flow in mix if flow not in flows]
+        if unknown:
+            parser.error('unknown flows ' + ', '.join(unknown) + ' (flows are ' + ', '.join(flows) + ')')
+        out = run(args.data_dir, args.concurrency, args.workers, args.requests, args.users, mix, args.warmup,
+                  args.seed, _key_values(args.env), args.stub_url, **_stub_settings(args))
+        with open(args.output, 'w') as f:
+            json.dump(out, f, indent=1)
+        print(pd.DataFrame(out['results']).fillna('').to_string(index=False))
+    elif args.command == 'stub':
+        _, appids = load_games(args.data_dir)
+        server = make_stub_server(SteamStub(appids, seed=args.seed, **_stub_settings(args)), args.host, args.port)
+        print('Steam API stub on http://' + args.host + ':' + str(args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+    elif args.command == 'compare':
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        df = compare(before, after, args.threshold)
+        print(df.to_string(index=False))
+        sys.exit(1 if df.regressed.any() else 0)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from src.similarity_store import load_similarity_values, read_json, write_json
+from src.scoring import top_n_columns
+from src.quantization import dequantize
+
+# Precomputed neighbor index for the conversion pages
+# For every video game (column of an item similarity matrix), stores the row
+# positions and scores of the k most and k least similar games, so lookups
+# don't need the dense matrix
+#   top_rows.npy / top_scores.npy       : (columns x k+1), most similar first
+#   bottom_rows.npy / bottom_scores.npy : (columns x k), least similar first
+#   rows.json / columns.json            : labels, same as the similarity matrix
+# Rows that run out of (non-NaN) neighbors are padded with -1
+
+default_k = 100
+
+
+def build_neighbor_index(ism_path, path, k=default_k, block_size=256):
+    '''
+    Builds the index for the similarity matrix at ism_path and writes it to path
+    Columns are processed in blocks so only block_size columns are in memory at once
+    '''
+    values, rows, columns = load_similarity_values(ism_path)
+    n_columns = values.shape[1]
+
+    # One extra top neighbor since find_similar_games drops the first (the game itself)
+    top_rows = np.empty((n_columns, min(k + 1, len(rows))), dtype=np.int32)
+    top_scores = np.empty(top_rows.shape)
+    bottom_rows = np.empty((n_columns, min(k, len(rows))), dtype=np.int32)
+    bottom_scores = np.empty(bottom_rows.shape)
+
+    for start in range(0, n_columns, block_size):
+        block = dequantize(np.array(values[:, start:start + block_size])).T
+        end = start + len(block)
+
+        top = top_n_columns(block, top_rows.shape[1])
+        bottom = top_n_columns(-block, bottom_rows.shape[1])
+
+        top_rows[start:end] = top
+        top_scores[start:end] = np.where(top >= 0, np.take_along_axis(block, top, axis=1), np.nan)
+        bottom_rows[start:end] = bottom
+        bottom_scores[start:end] = np.where(bottom >= 0, np.take_along_axis(block, bottom, axis=1), np.nan)
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'top_rows.npy'), top_rows)
+    np.save(os.path.join(path, 'top_scores.npy'), top_scores)
+    np.save(os.path.join(path, 'bottom_rows.npy'), bottom_rows)
+    np.save(os.path.join(path, 'bottom_scores.npy'), bottom_scores)
+    write_json(rows, os.path.join(path, 'rows.json'))
+    write_json(columns, os.path.join(path, 'columns.json'))
+
+
+class NeighborIndex:
+    '''
+    Most and least similar games for every video game in a similarity matrix
+    '''
+
+    def __init__(self, path):
+        self.top_rows = np.load(os.path.join(path, 'top_rows.npy'), mmap_mode='r')
+        self.top_scores = np.load(os.path.join(path, 'top_scores.npy'), mmap_mode='r')
+        self.bottom_rows = np.load(os.path.join(path, 'bottom_rows.npy'), mmap_mode='r')
+        self.bottom_scores = np.load(os.path.join(path, 'bottom_scores.npy'), mmap_mode='r')
+        self.rows = np.asarray(read_json(os.path.join(path, 'rows.json')), dtype=object)
+        self.columns = pd.Index(read_json(os.path.join(path, 'columns.json')), name='Game')
+        self._column_positions = {game: i for (i, game) in enumerate(self.columns)}
+
+    @property
+    def k(self):
+        return self.bottom_rows.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.top_rows.nbytes + self.top_scores.nbytes + self.bottom_rows.nbytes + self.bottom_scores.nbytes
+
+    def neighbors(self, game_name, reverse=False):
+        '''
+        Returns (game names, similarity scores) in descending order of similarity
+        The k most similar games, or the k least similar if reverse
+        '''
+        column = self._column_positions[game_name]
+        if reverse:
+            rows, scores = self.bottom_rows[column][::-1], self.bottom_scores[column][::-1]
+        else:
+            rows, scores = self.top_rows[column], self.top_scores[column]
+        found = rows >= 0
+        return self.rows[rows[found]], np.asarray(scores[found])
+
+
+def load_neighbor_index(path):
+    return NeighborIndex(path)
+
+
+if __name__ == '__main__':
+    # python -m src.neighbor_index web_app_dataset/ism_bgg web_app_dataset/ism_bgg_neighbors
+    if len(sys.argv) not in (3, 4):
+        print('Usage: python -m src.neighbor_index <similarity matrix directory> <output directory> [k]')
+        sys.exit(1)
+    k = int(sys.argv[3]) if len(sys.argv) == 4 else default_k
+    build_neighbor_index(sys.argv[1], sys.argv[2], k=k)
@@ -0,0 +1,85 @@
+import sys
+import numpy as np
+
+# Quantized storage for the item similarity matrices
+# The notebook rounds similarity scores to 2 decimals, so they fit in
+#   int8    : round(score * 100), with -128 reserved for missing scores (NaN)
+#   float16 : nearest half-precision float
+# Scoring widens only the user's columns back to float64 (dequantize), so the
+# dot products are accumulated in float64 and scores match the float64 matrices
+
+int8_scale = 100
+int8_missing = -128
+
+
+def quantize(values, dtype):
+    '''
+    Converts float similarity scores to dtype (int8, float16, or a float type)
+    '''
+    dtype = np.dtype(dtype)
+    if dtype == np.int8:
+        quantized = np.rint(np.nan_to_num(values, nan=0.0) * int8_scale).astype(np.int8)
+        quantized[np.isnan(values)] = int8_missing
+        return quantized
+    return np.asarray(values).astype(dtype)
+
+
+def dequantize(values):
+    '''
+    Float64 copy of (a slice of) a quantized matrix, rounded to the same
+    2 decimal scores the float64 matrices hold
+    '''
+    if values.dtype == np.int8:
+        out = values / float(int8_scale)
+        out[values == int8_missing] = np.nan
+        return out
+    if values.dtype == np.float16:
+        return values.astype(np.float64).round(2)
+    return values
+
+
+def verify_rankings(float_path, quantized_path, n_users=50, games_per_user=(3, 300), seed=0,
+                    **kwargs):
+    '''
+    Scores random users with both matrices and checks that recommendations match
+    Returns a dict with the number of users whose rankings differ and the largest score difference
+    '''
+    from src.similarity_store import load_similarity_values
+    from src.scoring import score_games, random_profiles
+
+    float_values, _, _ = load_similarity_values(float_path)
+    quantized_values, _, _ = load_similarity_values(quantized_path)
+
+    mismatches = 0
+    max_score_diff = 0.0
+    for (columns, playtimes) in random_profiles(float_values.shape[1], n_users, games_per_user, seed):
+        expected = score_games(np.asarray(float_values).take(columns, axis=1), playtimes, **kwargs)
+        actual = score_games(dequantize(np.asarray(quantized_values).take(columns, axis=1)), playtimes,
+                             **kwargs)
+
+        same_games = np.array_equal(expected[0], actual[0])
+        if same_games:
+            expected_order = np.argsort(-expected[1], kind='stable')
+            actual_order = np.argsort(-actual[1], kind='stable')
+            max_score_diff = max(max_score_diff, float(np.abs(expected[1] - actual[1]).max(initial=0)))
+        if not same_games or not np.array_equal(expected_order, actual_order) \
+                or not np.array_equal(expected[2], actual[2]):
+            mismatches += 1
+
+    return {'dtype': str(quantized_values.dtype),
+            'float_mb': round(float_values.nbytes / 1e6, 1),
+            'quantized_mb': round(quantized_values.nbytes / 1e6, 1),
+            'users': n_users,
+            'ranking_mismatches': mismatches,
+            'max_score_diff': max_score_diff}
+
+
+if __name__ == '__main__':
+    # python -m src.quantization web_app_dataset/ism_bgg web_app_dataset/ism_bgg_int8
+    if len(sys.argv) != 3:
+        print('Usage: python -m src.quantization <float matrix directory> <quantized matrix directory>')
+        sys.exit(1)
+    report = verify_rankings(sys.argv[1], sys.argv[2], min_neighbors=2, neighbor_cutoff=0.1)
+    for (key, value) in report.items():
+        print(key + ': ' + str(value))
+    sys.exit(1 if report['ranking_mismatches'] else 0)
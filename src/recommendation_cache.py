@@ -0,0 +1,115 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Result cache for recommend_games
+# Profiles are keyed on a fingerprint of the canonical profile (games in
+# catalog order, z-scores rounded to z_decimals) and the scoring settings, so
+# the same games with nearly identical playtimes share an entry. The cache is
+# an LRU bounded by number of entries and by the memory of the cached frames
+
+z_decimals = 2
+
+
+def canonical_profile(games, positions, decimals=z_decimals):
+    '''
+    Sorts (game name, z-score) tuples by catalog position and rounds the z-scores
+    Returns (games, positions) in the canonical order
+    '''
+    positions = np.asarray(positions)
+    order = np.lexsort(([game_name for (game_name, playtime) in games], positions))
+    games = [(games[i][0], round(float(games[i][1]), decimals)) for i in order]
+    return games, positions[order]
+
+
+def profile_fingerprint(platform, games, positions, min_neighbors, neighbor_cutoff, based_on_n,
+                        popular_games, top=None, reverse=False):
+    '''
+    Digest of a canonical profile (see canonical_profile), the scoring settings
+    and the selection (top games, or every game if top is None)
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((platform, int(min_neighbors), float(neighbor_cutoff), int(based_on_n),
+                        bool(popular_games), None if top is None else int(top),
+                        bool(reverse))).encode('utf-8'))
+    digest.update(np.asarray(positions, dtype=np.int64).tobytes())
+    digest.update(np.array([playtime for (game_name, playtime) in games], dtype=np.float64).tobytes())
+    # Games that aren't in the catalog all have position -1
+    for (game_name, playtime) in games:
+        digest.update(b'\0' + str(game_name).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class RecommendationCache:
+    '''
+    Thread-safe LRU cache of recommendation frames, bounded by max_entries and max_bytes
+    '''
+
+    def __init__(self, max_entries=128, max_bytes=256 * 2 ** 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, df):
+        nbytes = frame_nbytes(df)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            # Frames bigger than the whole cache aren't kept
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (df, nbytes)
+            self.nbytes += nbytes
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def remove_if(self, predicate):
+        '''
+        Removes the entries whose key matches predicate (e.g. another data version)
+        '''
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.nbytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'mb': round(self.nbytes / 2 ** 20, 2),
+                'max_mb': round(self.max_bytes / 2 ** 20, 2)}
@@ -0,0 +1,369 @@
+import numpy as np
+import pandas as pd
+from src.quantization import dequantize
+
+# NumPy scoring engine for the recommender
+# Works on a plain 2D array of similarity scores: rows are candidate games
+# (board games or video games), columns are the video games a user plays
+
+popular_game_reason = "It's a popular game (rank predicted using dataset average)"
+
+
+def normalize_ratings(game_ratings, cutoff=10, z_scores = True):
+    '''
+    Takes a list of (game, ratings) tuples, prunes games with playtimes
+    less than cutoff, log-transforms, and returns list of (game,Z-scores) tuples
+    
+    '''    
+    # Must play for at least n minutes
+    game_ratings = [(id,rating) for (id,rating) in game_ratings if rating >= cutoff]
+
+    # Log transform (playtimes are very left skewed)
+    games = [id for (id,rating) in game_ratings]
+    ratings = np.log([rating for (id,rating) in game_ratings])
+
+    # Z_score
+    if z_scores:
+        mean = np.mean(ratings)
+        std = np.std(ratings)
+        ratings = (ratings-mean)/std
+
+    return(list(zip(games, ratings)))
+
+
+def neighbor_counts(values, neighbor_cutoff):
+    '''
+    Number of columns (user's games) with similarity >= neighbor_cutoff for every row
+    '''
+    return np.count_nonzero(values >= neighbor_cutoff, axis=1)
+
+
+def top_n_columns(values, n):
+    '''
+    Column positions of the n largest values in every row, largest first
+
+    Matches Series.nlargest: ties are broken in favor of earlier columns
+    and NaNs are never selected (rows with fewer than n non-NaN values
+    are padded with -1)
+    '''
+    n_rows, n_cols = values.shape
+    if n <= 0:
+        return np.empty((n_rows, 0), dtype=int)
+
+    filled = np.where(np.isnan(values), -np.inf, values)
+
+    if n < n_cols:
+        rows = np.arange(n_rows)[:, None]
+        candidates = np.argpartition(-filled, n - 1, axis=1)[:, :n]
+        nth_largest = filled[rows, candidates].min(axis=1)[:, None]
+
+        # Everything above the nth largest value is in, then the earliest ties fill the rest
+        above = filled > nth_largest
+        ties = filled == nth_largest
+        ties_needed = n - np.count_nonzero(above, axis=1)[:, None]
+        keep = above | (ties & (np.cumsum(ties, axis=1) <= ties_needed))
+        top = np.nonzero(keep)[1].reshape(n_rows, n)
+    else:
+        top = np.tile(np.arange(n_cols), (n_rows, 1))
+
+    # Order by value (descending), positions are already ascending so ties stay in column order
+    order = np.argsort(-filled[np.arange(n_rows)[:, None], top], axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+
+    top[np.isneginf(np.take_along_axis(filled, top, axis=1))] = -1
+    return top
+
+
+class TopColumns:
+    '''
+    top_n_columns of the rows of values, computed only for the rows asked for
+    (top[rows]), so "Recommended because…" is only worked out for the games
+    that are shown
+    '''
+
+    def __init__(self, values, n):
+        self.values = values
+        self.n = n
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, rows):
+        return top_n_columns(self.values[rows], self.n)
+
+
+def normalize_predictions(predictions):
+    '''
+    Z transform so predicted scores are comparable to average game ratings
+    '''
+    predictions = (predictions - predictions.mean()) / predictions.std()
+    return predictions.round(2)
+
+
+def predict_scores(values, playtimes):
+    '''
+    Dot product of similarity scores and playtimes, z-transformed
+    (can't use weighted average because some similarity scores are negative)
+    '''
+    return normalize_predictions(values.dot(playtimes))
+
+
+def score_games(values, playtimes, min_neighbors=3, neighbor_cutoff=0.15, based_on_n=3):
+    '''
+    Scores every row of values in one batched pass
+
+    Returns (row positions of games with at least min_neighbors neighbors,
+             predicted z-scores for those rows,
+             column positions of the based_on_n most similar games for those rows,
+             as a TopColumns)
+    '''
+    counts = neighbor_counts(values, neighbor_cutoff)
+    with_neighbors = np.flatnonzero(counts >= min_neighbors)
+
+    if len(with_neighbors) == 0:
+        return with_neighbors, np.empty(0), np.empty((0, based_on_n), dtype=int)
+
+    neighbors = values[with_neighbors]
+    predictions = predict_scores(neighbors, np.asarray(playtimes, dtype=float))
+    return with_neighbors, predictions, TopColumns(neighbors, based_on_n)
+
+
+def explain(top, column_names, prefix='You play…'):
+    '''
+    "Recommended because…" text for every row of top column positions
+    '''
+    column_names = np.asarray(column_names, dtype=object)
+    return [prefix + '<br>' + '<br>'.join(column_names[row[row >= 0]]) for row in top]
+
+
+def recommendation_scores(n_rows, with_neighbors, predictions, averages=None):
+    '''
+    Score for every row: the prediction if a game has neighbors, otherwise the
+    game's average from averages (an array with a value per row), -100 if neither
+    '''
+    if averages is not None:
+        scores = np.array(averages, dtype=float)
+        scores[np.isnan(scores)] = -100
+    else:
+        scores = np.full(n_rows, -100.0)
+    scores[with_neighbors] = predictions
+    return scores
+
+
+def build_recommendations(row_names, column_names, with_neighbors, predictions, top,
+                          averages=None):
+    '''
+    Returns the recommendation DataFrame (Game, Score, Recommended because…, My Ranking)
+    for every game, by descending score (ties in row order)
+
+    Uses the prediction if a game has neighbors, otherwise the game's average
+    from averages (an array aligned with row_names). Games with neither are dropped
+    '''
+    scores = recommendation_scores(len(row_names), with_neighbors, predictions, averages)
+
+    reasons = np.full(len(row_names), popular_game_reason, dtype=object)
+    reasons[with_neighbors] = explain(top[:], column_names)
+
+    output_df = pd.DataFrame({'Game': np.asarray(row_names, dtype=object),
+                              'Score': scores,
+                              'Recommended because…': reasons}).sort_values('Score', ascending=False,
+                                                                           kind='mergesort')
+    output_df = output_df[output_df.Score > -100]
+    output_df['My Ranking'] = ['#' + str(x) for x in (output_df.reset_index().index + 1)]
+    return output_df
+
+
+def _smallest(keys, n, last_ties=False):
+    # Positions of the n smallest keys, sorted by key, ties by position
+    # (descending positions if last_ties, so the latest ties are selected)
+    if n <= 0:
+        return np.empty(0, dtype=int)
+    if last_ties:
+        return len(keys) - 1 - _smallest(keys[::-1], n)
+    if n < len(keys):
+        candidates = np.argpartition(keys, n - 1)[:n]
+        nth_smallest = keys[candidates].max()
+
+        # Everything below the nth smallest key is in, then the earliest ties fill the rest
+        below = np.flatnonzero(keys < nth_smallest)
+        ties = np.flatnonzero(keys == nth_smallest)[:n - len(below)]
+        selected = np.concatenate([below, ties])
+    else:
+        selected = np.arange(len(keys))
+    return selected[np.lexsort((selected, keys[selected]))]
+
+
+def _select(scores, n, reverse=False, rows=None):
+    # Positions of the n highest positive scores (lowest negative scores if reverse)
+    # in build_recommendations order, and their rankings among every scored game
+    candidates = (scores < 0) & (scores > -100) if reverse else scores > 0
+    if rows is not None:
+        candidates &= rows
+    candidates = np.flatnonzero(candidates)
+
+    if reverse:
+        # The last n of the descending order, lowest score first, then flipped back
+        selected = candidates[_smallest(scores[candidates], n, last_ties=True)][::-1]
+    else:
+        selected = candidates[_smallest(-scores[candidates], n)]
+
+    # Rank in the whole table: games with higher scores, then ties in earlier rows
+    ranked = scores[scores > -100]
+    ranked_rows = np.flatnonzero(scores > -100)
+    selected_scores = scores[selected][:, None]
+    ranks = 1 + (ranked > selected_scores).sum(axis=1) + \
+        ((ranked == selected_scores) & (ranked_rows < selected[:, None])).sum(axis=1)
+    return selected, ranks
+
+
+def select_recommendations(row_names, column_names, with_neighbors, predictions, top, n,
+                           averages=None, reverse=False, rows=None):
+    '''
+    The n games with the highest positive scores (lowest negative scores if
+    reverse) from build_recommendations, without scoring, sorting and
+    labelling every game
+
+    Same rows, order and My Ranking as the first (last if reverse) n rows of
+    build_recommendations filtered on the sign of the score
+    rows : optional boolean mask of the games that can be selected
+           (rankings still count every game)
+    '''
+    scores = recommendation_scores(len(row_names), with_neighbors, predictions, averages)
+    selected, ranks = _select(scores, n, reverse, rows)
+
+    # Reasons only for the selected games
+    slots = np.full(len(row_names), -1)
+    slots[with_neighbors] = np.arange(len(with_neighbors))
+    slots = slots[selected]
+    reasons = np.full(len(selected), popular_game_reason, dtype=object)
+    if (slots >= 0).any():
+        reasons[slots >= 0] = explain(top[slots[slots >= 0]], column_names)
+
+    return pd.DataFrame({'Game': np.asarray(row_names, dtype=object)[selected],
+                         'Score': scores[selected],
+                         'Recommended because…': reasons,
+                         'My Ranking': ['#' + str(rank) for rank in ranks]}, index=selected)
+
+
+# Ways to combine the scores of a group into one score per game
+#   mean         : average of the members' scores
+#   least_misery : the lowest member score, so nobody gets a game they'd hate
+#   max          : the highest member score, so everyone gets a game they love
+group_rules = ('mean', 'least_misery', 'max')
+
+
+def combine_scores(member_scores, rule='mean'):
+    '''
+    One score per game from a (members x games) array of recommendation_scores
+    Members without a score for a game (-100) are left out, games nobody has
+    a score for stay at -100
+    '''
+    if rule not in group_rules:
+        raise ValueError('rule must be one of ' + ', '.join(group_rules))
+    member_scores = np.where(member_scores > -100, member_scores, np.nan)
+    scored = ~np.isnan(member_scores).all(axis=0)
+
+    combined = np.full(member_scores.shape[1], -100.0)
+    combine = {'mean': np.nanmean, 'least_misery': np.nanmin, 'max': np.nanmax}[rule]
+    combined[scored] = combine(member_scores[:, scored], axis=0).round(2)
+    return combined
+
+
+def select_group_recommendations(row_names, members, n, rule='mean', averages=None, reverse=False,
+                                 rows=None):
+    '''
+    Same as select_recommendations for a group, with the members' scores
+    combined by rule (see group_rules)
+
+    members : list of (member name, column names, score_games result), one per member
+    Returns the same columns as select_recommendations plus one score column
+    per member; "Recommended because…" comes from the member with the highest
+    score for the game
+    '''
+    member_scores = np.array([recommendation_scores(len(row_names), with_neighbors, predictions, averages)
+                              for (_, _, (with_neighbors, predictions, _)) in members])
+    scores = combine_scores(member_scores, rule)
+    selected, ranks = _select(scores, n, reverse, rows)
+
+    reasons = np.full(len(selected), popular_game_reason, dtype=object)
+    explained = np.zeros(len(selected), dtype=bool)
+    for member in np.argsort(-member_scores[:, selected], axis=0, kind='stable'):
+        # Members in order of their score for each game, the first one with neighbors explains it
+        for (i, position) in enumerate(selected):
+            if explained[i]:
+                continue
+            (name, column_names, (with_neighbors, _, top)) = members[member[i]]
+            slot = np.searchsorted(with_neighbors, position)
+            if slot < len(with_neighbors) and with_neighbors[slot] == position:
+                reasons[i] = explain(top[[slot]], column_names, prefix=str(name) + ' plays…')[0]
+                explained[i] = True
+
+    out = pd.DataFrame({'Game': np.asarray(row_names, dtype=object)[selected],
+                        'Score': scores[selected],
+                        'Recommended because…': reasons,
+                        'My Ranking': ['#' + str(rank) for rank in ranks]}, index=selected)
+    for ((name, _, _), member_score) in zip(members, member_scores):
+        out[str(name)] = np.where(member_score[selected] > -100, member_score[selected], np.nan)
+    return out
+
+
+def random_profiles(n_columns, n_users, games_per_user=(3, 300), seed=0):
+    '''
+    Random users for comparing scoring paths, yields (column positions, z-scored log playtimes)
+    '''
+    rng = np.random.RandomState(seed)
+    for _ in range(n_users):
+        n_games = rng.randint(games_per_user[0], min(games_per_user[1], n_columns) + 1)
+        columns = rng.choice(n_columns, n_games, replace=False)
+        playtimes = np.log(rng.randint(10, 10000, n_games))
+        playtimes = (playtimes - playtimes.mean()) / (playtimes.std() or 1)
+        yield columns, playtimes
+
+
+def score_users(values, profiles, rows=None, min_neighbors=3, neighbor_cutoff=0.15, based_on_n=3):
+    '''
+    score_games for many users at once, with one matrix product for the
+    predictions and one for the neighbor counts
+
+    profiles : list of (column positions, playtimes), one per user
+    rows     : optional list of boolean row masks, one per user
+    Returns a list of score_games results, one per user
+    '''
+    # Columns used by anyone, and every user's playtimes/indicators on those columns
+    used = np.unique(np.concatenate([np.asarray(columns, dtype=int) for (columns, _) in profiles]))
+    slots = [np.searchsorted(used, columns) for (columns, _) in profiles]
+    playtimes = np.zeros((len(used), len(profiles)))
+    indicators = np.zeros((len(used), len(profiles)))
+    for (user, (slot, (_, user_playtimes))) in enumerate(zip(slots, profiles)):
+        np.add.at(playtimes[:, user], slot, user_playtimes)
+        np.add.at(indicators[:, user], slot, 1)
+
+    sub = dequantize(np.asarray(values).take(used, axis=1))
+    counts = (sub >= neighbor_cutoff).astype(float).dot(indicators)
+
+    # A missing score only makes the prediction missing for users who play that game
+    # (in a single matrix product it would multiply every user's 0 playtime)
+    missing = np.isnan(sub)
+    if missing.any():
+        dot_products = np.where(missing, 0, sub).dot(playtimes)
+        dot_products[missing.astype(float).dot(indicators) > 0] = np.nan
+    else:
+        dot_products = sub.dot(playtimes)
+
+    results = []
+    for user in range(len(profiles)):
+        candidates = counts[:, user] >= min_neighbors
+        relative = np.arange(len(sub))
+        if rows is not None:
+            candidates &= rows[user]
+            relative = np.cumsum(rows[user]) - 1
+
+        with_neighbors = np.flatnonzero(candidates)
+        if len(with_neighbors) == 0:
+            results.append((with_neighbors, np.empty(0), np.empty((0, based_on_n), dtype=int)))
+            continue
+
+        predictions = normalize_predictions(dot_products[with_neighbors, user])
+        top = TopColumns(sub[with_neighbors][:, slots[user]], based_on_n)
+        results.append((relative[with_neighbors], predictions, top))
+    return results
@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from src import go_analog_core as core
+from src.instrumentation import trace, metrics, logger
+
+# JSON HTTP endpoint for the recommender core, no streamlit needed
+#
+#   python -m src.service --port 8000
+#
+#   POST /recommend  {"platform": "bgg", "games": ["Portal 2", ...]}
+#                    or {"platform": "steam", "steam_id": "7656..."} (needs API_KEY)
+#                    optional: top, min_neighbors, neighbor_cutoff, based_on_n, popular_games
+#                    games can also be [name, playtime in minutes] pairs
+#   POST /group      {"platform": "bgg", "steam_ids": ["7656...", ...], "rule": "mean"}
+#                    or {"members": {"Ann": ["Portal 2", ...], ...}}, rule is mean, least_misery or max
+#                    players whose games can't be fetched are listed in errors
+#   GET  /similar?platform=steam&game=Portal%202&n=10&reverse=0
+#   GET  /health
+#   GET  /stats      recommendation cache hit rate, stage timings (see instrumentation), memory use,
+#                    data version (with GO_ANALOG_DATA_ROOT or ISM_SHARED_ROOT, see data_versions)
+
+# Weight for manually selected games, same as the web app
+manual_playtime = 2
+
+recommend_settings = ('min_neighbors', 'neighbor_cutoff', 'based_on_n', 'popular_games')
+
+
+class RequestError(Exception):
+    '''
+    Bad request, returned to the client with status_code
+    '''
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def records(df):
+    # Through to_json so numpy scalars and NaNs become valid json
+    return json.loads(df.to_json(orient='records'))
+
+
+def request_games(body):
+    '''
+    Returns a list of (game name, playtime) tuples for a request body
+    '''
+    if 'games' in body:
+        games = body['games']
+        if all(isinstance(game, str) for game in games):
+            return [(game, manual_playtime) for game in games]
+        return core.normalize_ratings([(name, playtime) for (name, playtime) in games])
+
+    if 'steam_id' not in body:
+        raise RequestError(400, 'games or steam_id is required')
+    steam_api_key = os.environ.get('API_KEY')
+    if steam_api_key is None:
+        raise RequestError(503, 'no Steam API key (set API_KEY)')
+
+    games = core.get_games(body['steam_id'], steam_api_key)
+    if games == "500":
+        raise RequestError(502, 'Steam API error')
+    if games == "No games" or len(games) == 0:
+        raise RequestError(404, 'no games (private profile?)')
+    return core.normalize_ratings(games)
+
+
+def recommend(body):
+    platform = body.get('platform', 'bgg')
+    if platform not in ('bgg', 'steam'):
+        raise RequestError(400, 'platform must be bgg or steam')
+    settings = {key: body[key] for key in recommend_settings if key in body}
+
+    try:
+        df = core.recommend_games(request_games(body), platform=platform, top=int(body.get('top', 20)),
+                                  **settings)
+    except KeyError as e:
+        raise RequestError(400, 'unknown games: ' + str(e.args[0]))
+
+    return {'platform': platform, 'recommendations': records(df)}
+
+
+def group(body):
+    platform = body.get('platform', 'bgg')
+    if platform not in ('bgg', 'steam'):
+        raise RequestError(400, 'platform must be bgg or steam')
+    settings = {key: body[key] for key in recommend_settings if key in body}
+
+    members = OrderedDict()
+    errors = OrderedDict()
+    for (member, games) in body.get('members', {}).items():
+        members[member] = request_games({'games': games})
+    if 'steam_ids' in body:
+        steam_api_key = os.environ.get('API_KEY')
+        if steam_api_key is None:
+            raise RequestError(503, 'no Steam API key (set API_KEY)')
+        fetched, errors = core.get_group_games(body['steam_ids'], steam_api_key)
+        for (steam_id, games) in fetched.items():
+            members[steam_id] = core.normalize_ratings(games)
+    for (member, games) in list(members.items()):
+        if len(games) == 0:
+            del members[member]
+            errors[member] = 'no games played for at least 10 minutes'
+    if len(members) == 0:
+        raise RequestError(404 if errors else 400, 'no players with games' if errors else 'members or steam_ids is required')
+
+    try:
+        df = core.recommend_group_games(members, platform=platform, rule=body.get('rule', 'mean'),
+                                        top=int(body.get('top', 20)), **settings)
+    except KeyError as e:
+        raise RequestError(400, 'unknown games: ' + str(e.args[0]))
+
+    return {'platform': platform, 'members': list(members), 'errors': errors,
+            'recommendations': records(df)}
+
+
+def similar(query):
+    platform = query.get('platform', 'steam')
+    if platform == 'steam':
+        neighbor_index = core.load_steam_neighbors()
+    elif platform == 'bgg':
+        neighbor_index = core.load_bgg_neighbors()
+    else:
+        raise RequestError(400, 'platform must be bgg or steam')
+
+    reverse = query.get('reverse', '0') not in ('0', 'false', '')
+    df = core.find_similar_games(query.get('game', ''), neighbor_index, reverse=reverse)
+    if isinstance(df, str):
+        raise RequestError(404, df)
+    n = int(query.get('n', 10))
+    df = df.tail(n).iloc[::-1] if reverse else df.head(n)
+    return {'platform': platform, 'game': query['game'], 'similar': records(df)}
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def _send(self, status_code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, route):
+        try:
+            with trace('service ' + urlparse(self.path).path), core.using_data_version():
+                response = route()
+            self._send(200, response)
+        except RequestError as e:
+            self._send(e.status_code, {'error': str(e)})
+        except (ValueError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            # Anything else is a bug or a data problem: logged with the traceback,
+            # the client still gets a JSON response
+            logger.exception(json.dumps({'path': self.path, 'status': 500, 'error': repr(e)}))
+            self._send(500, {'error': 'internal server error'})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+        if url.path == '/health':
+            self._send(200, {'status': 'ok'})
+        elif url.path == '/stats':
+            self._send(200, dict(core.recommendation_cache.stats(), process=core.memory_footprint(),
+                                 data_version=core.data_version(),
+                                 **metrics.snapshot()))
+        elif url.path == '/similar':
+            self._handle(lambda: similar(query))
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        routes = {'/recommend': recommend, '/group': group}
+        handler = routes.get(urlparse(self.path).path)
+        if handler is None:
+            self._send(404, {'error': 'not found'})
+            return
+
+        def route():
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise RequestError(400, 'request body must be a json object')
+            return handler(body)
+
+        self._handle(route)
+
+
+def make_server(host='127.0.0.1', port=8000, preload=True):
+    if preload:
+        # Load the matrices before accepting requests so the first request isn't slow
+        core.load_bgg_alignment()
+        core.load_steam_alignment()
+    # Swap in new data versions without a restart (with GO_ANALOG_DATA_ROOT or ISM_SHARED_ROOT)
+    core.watch_data_versions()
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve recommendations as JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--no-preload', action='store_true', help='load the matrices on the first request')
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, preload=not args.no_preload)
+    print('Serving on http://' + args.host + ':' + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
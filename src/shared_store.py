@@ -0,0 +1,158 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+from src import data_versions
+
+# Shared-memory copies of the similarity stores for hosts running several server processes
+#
+#   python -m src.shared_store publish web_app_dataset     (loader, at deploy / after a data refresh)
+#   ISM_SHARED_ROOT=/dev/shm/go_analog streamlit run app.py (workers)
+#   python -m src.shared_store status
+#   python -m src.shared_store compare web_app_dataset --workers 4
+#
+# publish copies the matrices (in every format built) and neighbor indexes into a new version
+# on tmpfs (/dev/shm). Workers memory-map the files read-only from there, so
+# every process on the host maps the same physical pages and nothing is copied
+# onto a worker's heap
+#
+# The root is a versioned directory in the data_versions layout (manifest,
+# one directory per version, pid files of the processes using a version), and
+# the core handles it like GO_ANALOG_DATA_ROOT (see go_analog_core.data_version)
+#   - a worker pins the current version when it first loads a store, and a
+#     request keeps using the version it started with, so a swap never mixes versions
+#   - publishing a new version switches the manifest atomically; running workers
+#     notice it, load the new version, swap it in and unpin the old one
+#   - old versions are removed once no live process has them pinned
+#     (files stay readable for processes that still have them mapped)
+# With GO_ANALOG_DATA_ROOT too, the data version decides and stores are mapped
+# from the shared copy of that version (data_versions publish --shared-root)
+
+default_root = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'go_analog')
+default_names = ('ism_bgg', 'ism_steam', 'ism_bgg_neighbors', 'ism_steam_neighbors',
+                 'ism_bgg_sparse', 'ism_steam_sparse', 'ism_bgg_factorized', 'ism_steam_factorized')
+
+
+def publish(data_dir, root=default_root, names=default_names, version=None, make_current=True):
+    '''
+    Copies the stores in data_dir (missing ones are skipped) into a new version
+    under root, makes it the current version (unless not make_current) and
+    removes unused old versions
+    Returns the new version
+    '''
+    version = data_versions.publish(data_dir, root, make_current=make_current, names=names, version=version)
+    if make_current:
+        cleanup(root)
+    return version
+
+
+def cleanup(root=default_root, current=None):
+    '''
+    Removes versions that aren't current (or current, if given) and aren't
+    pinned by a live process (no rollback copies, shared memory is scarce)
+    Returns the removed versions
+    '''
+    return data_versions.cleanup(root, keep=0, current=current)
+
+
+def unpublish(root=default_root):
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def memory_usage(pid='self'):
+    '''
+    Resident memory of a process in MB (Linux): total, private (anonymous),
+    file-backed, and shared memory (tmpfs) pages
+    '''
+    fields = {'VmRSS': 'rss_mb', 'RssAnon': 'private_mb', 'RssFile': 'file_mb', 'RssShmem': 'shared_mb'}
+    try:
+        with open('/proc/' + str(pid) + '/status') as f:
+            lines = [line.split() for line in f]
+    except FileNotFoundError:
+        # Not Linux: only the peak is available (KB on Linux, bytes on macOS)
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'max_rss_mb': round(max_rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)}
+    return {fields[line[0][:-1]]: round(int(line[1]) / 2 ** 10, 1)
+            for line in lines if line and line[0][:-1] in fields}
+
+
+def _load_worker(data_dir, root, names):
+    # Loads every matrix (privately or from root), touches every value, reports memory
+    from src.similarity_store import load_similarity_values
+    matrices = []
+    version = None
+    if root is not None:
+        version = data_versions.current_version(root)
+        data_versions.pin(root, version)
+    for name in names:
+        if root is None:
+            values = np.array(load_similarity_values(os.path.join(data_dir, name))[0])
+        else:
+            values = load_similarity_values(os.path.join(data_versions.version_path(root, version), name))[0]
+        values.sum()
+        matrices.append(values)
+    usage = dict(memory_usage(), pid=os.getpid())
+    if root is not None:
+        data_versions.unpin(root, version)
+    return usage
+
+
+def compare(data_dir, workers=4, names=('ism_bgg', 'ism_steam')):
+    '''
+    Memory of workers that each load a private copy of the matrices vs workers
+    attached to a published shared copy
+    Returns {'private': [usage per worker], 'shared': [usage per worker]}
+    '''
+    root = tempfile.mkdtemp(dir=os.path.dirname(default_root))
+    try:
+        publish(data_dir, root, names)
+        out = {}
+        for (mode, worker_root) in (('private', None), ('shared', root)):
+            # One task per process, so every usage is a different process
+            with Pool(workers, maxtasksperchild=1) as pool:
+                out[mode] = pool.starmap(_load_worker, [(data_dir, worker_root, names)] * workers, chunksize=1)
+    finally:
+        unpublish(root)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shared-memory copies of the similarity stores')
+    parser.add_argument('--root', default=os.environ.get('ISM_SHARED_ROOT', default_root))
+    commands = parser.add_subparsers(dest='command')
+    publish_parser = commands.add_parser('publish', help='publish a new version from a data directory')
+    publish_parser.add_argument('data_dir')
+    commands.add_parser('status', help='list versions and the processes using them')
+    commands.add_parser('cleanup', help='remove versions no process uses')
+    commands.add_parser('unpublish', help='remove everything under root')
+    compare_parser = commands.add_parser('compare', help='per-process memory, private vs shared')
+    compare_parser.add_argument('data_dir')
+    compare_parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.command == 'publish':
+        print('Published ' + publish(args.data_dir, args.root) + ' to ' + args.root)
+    elif args.command == 'status':
+        for version in data_versions.status(args.root):
+            print(version)
+    elif args.command == 'cleanup':
+        print('Removed ' + str(cleanup(args.root)))
+    elif args.command == 'unpublish':
+        unpublish(args.root)
+    elif args.command == 'compare':
+        for (mode, usages) in compare(args.data_dir, workers=args.workers).items():
+            for (worker, usage) in enumerate(usages):
+                print(mode + ' worker ' + str(worker) + ': ' + str(usage))
+            if all('private_mb' in usage for usage in usages):
+                print(mode + ' total private MB: ' + str(round(sum(usage['private_mb'] for usage in usages), 1)))
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from src.quantization import quantize, int8_scale, int8_missing
+
+# On-disk format for the item similarity matrices (one directory per matrix)
+#   values.bin   : raw row-major array, memory-mapped on load
+#   rows.json    : row labels (board games for ism_bgg, video games for ism_steam)
+#   columns.json : column labels (video games)
+#   meta.json    : shape and dtype of values.bin (and the scale, for int8 matrices)
+#
+# Loading only maps the file, so startup doesn't depend on matrix size and
+# every process on the host shares the same page cache copy of the values
+
+values_filename = 'values.bin'
+rows_filename = 'rows.json'
+columns_filename = 'columns.json'
+meta_filename = 'meta.json'
+
+
+def write_json(obj, filepath):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+def read_json(filepath):
+    with open(filepath, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _to_builtin(labels):
+    # json can't serialize numpy ints (e.g. game ids that were never renamed)
+    return [label.item() if isinstance(label, np.generic) else label for label in labels]
+
+
+def create_similarity_matrix(path, rows, columns, dtype='float64', names=('Game', 'Game')):
+    '''
+    Creates an empty matrix on disk and returns it as a writable memmap,
+    so it can be filled in blocks without holding the full matrix in memory
+    '''
+    os.makedirs(path, exist_ok=True)
+    rows = _to_builtin(rows)
+    columns = _to_builtin(columns)
+    shape = (len(rows), len(columns))
+
+    write_json(rows, os.path.join(path, rows_filename))
+    write_json(columns, os.path.join(path, columns_filename))
+    meta = {'shape': shape, 'dtype': np.dtype(dtype).str, 'names': list(names)}
+    if np.dtype(dtype) == np.int8:
+        meta.update({'scale': int8_scale, 'missing': int8_missing})
+    write_json(meta, os.path.join(path, meta_filename))
+
+    return np.memmap(os.path.join(path, values_filename), dtype=dtype, mode='w+', shape=shape)
+
+
+def save_similarity_matrix(df, path, dtype='float64'):
+    '''
+    Writes a similarity DataFrame (rows x video game columns) to path
+    dtype can be int8 or float16 for quantized storage (see quantization)
+    '''
+    values = create_similarity_matrix(path, df.index, df.columns, dtype=dtype,
+                                      names=(df.index.name, df.columns.name))
+    values[:] = quantize(df.to_numpy(dtype='float64'), dtype)
+    values.flush()
+    del values
+
+
+def read_similarity_meta(path):
+    return read_json(os.path.join(path, meta_filename))
+
+
+def load_similarity_values(path, mode='r'):
+    '''
+    Returns (memmapped values, row labels, column labels)
+    '''
+    meta = read_similarity_meta(path)
+    values = np.memmap(os.path.join(path, values_filename), dtype=np.dtype(meta['dtype']),
+                       mode=mode, shape=tuple(meta['shape']))
+    rows = read_json(os.path.join(path, rows_filename))
+    columns = read_json(os.path.join(path, columns_filename))
+    return values, rows, columns
+
+
+def load_similarity_matrix(path, mode='r'):
+    '''
+    Returns the similarity matrix as a DataFrame backed by the memmap
+    (read-only by default, so the values are never copied onto the heap)
+    '''
+    values, rows, columns = load_similarity_values(path, mode=mode)
+    row_name, column_name = read_similarity_meta(path).get('names', ('Game', 'Game'))
+    return pd.DataFrame(values, index=pd.Index(rows, name=row_name),
+                        columns=pd.Index(columns, name=column_name), copy=False)
+
+
+def convert_pickle(pickle_path, path, dtype='float64'):
+    '''
+    Converts a bz2-pickled similarity DataFrame (the old format) to path
+    '''
+    df = pd.read_pickle(pickle_path, compression='bz2')
+    save_similarity_matrix(df, path, dtype=dtype)
+
+
+if __name__ == '__main__':
+    # python -m src.similarity_store web_app_dataset/ism_bgg.pkl web_app_dataset/ism_bgg
+    if len(sys.argv) not in (3, 4):
+        print('Usage: python -m src.similarity_store <ism.pkl> <output directory> [float64|float16|int8]')
+        sys.exit(1)
+    convert_pickle(sys.argv[1], sys.argv[2], dtype=sys.argv[3] if len(sys.argv) == 4 else 'float64')
@@ -0,0 +1,200 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from src.similarity_store import load_similarity_values, read_json, write_json
+from src.quantization import dequantize
+from src.scoring import score_games, normalize_predictions, random_profiles
+
+# Sparse (thresholded) storage for the item similarity matrices
+# Only keeps entries with |similarity| >= floor, in compressed sparse column
+# format (columns are video games, so a user's games are contiguous slices)
+#   indptr.npy  : (columns + 1), column c is indices/data[indptr[c]:indptr[c+1]]
+#   indices.npy : row position of every stored entry
+#   data.npy    : similarity score of every stored entry
+#   rows.json / columns.json : labels, same as the similarity matrix
+#   meta.json   : shape, dtype and floor
+#
+# Scores match the dense path exactly as long as neighbor_cutoff >= floor,
+# except for the contribution of the dropped (near zero) entries to the dot product
+
+default_floor = 0.05
+
+
+def build_sparse_similarity(ism_path, path, floor=default_floor, block_size=256):
+    '''
+    Thresholds the similarity matrix at ism_path and writes it to path
+    '''
+    values, rows, columns = load_similarity_values(ism_path)
+    n_columns = values.shape[1]
+
+    indptr = np.zeros(n_columns + 1, dtype=np.int64)
+    indices = []
+    data = []
+
+    for start in range(0, n_columns, block_size):
+        block = dequantize(np.array(values[:, start:start + block_size])).T
+        kept = np.abs(block) >= floor
+        block_columns, block_rows = np.nonzero(kept)
+        indices.append(block_rows.astype(np.int32))
+        data.append(block[block_columns, block_rows])
+        indptr[start + 1:start + len(block) + 1] = np.count_nonzero(kept, axis=1)
+
+    data = np.concatenate(data)
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'indptr.npy'), np.cumsum(indptr))
+    np.save(os.path.join(path, 'indices.npy'), np.concatenate(indices))
+    np.save(os.path.join(path, 'data.npy'), data)
+    write_json(rows, os.path.join(path, 'rows.json'))
+    write_json(columns, os.path.join(path, 'columns.json'))
+    write_json({'shape': values.shape, 'dtype': data.dtype.str, 'floor': floor},
+               os.path.join(path, 'meta.json'))
+
+
+class SparseSimilarity:
+    '''
+    Thresholded similarity matrix, loaded from a directory written by build_sparse_similarity
+    '''
+
+    def __init__(self, path):
+        self.indptr = np.load(os.path.join(path, 'indptr.npy'), mmap_mode='r')
+        self.indices = np.load(os.path.join(path, 'indices.npy'), mmap_mode='r')
+        self.data = np.load(os.path.join(path, 'data.npy'), mmap_mode='r')
+        meta = read_json(os.path.join(path, 'meta.json'))
+        self.shape = tuple(meta['shape'])
+        self.floor = meta['floor']
+        # Same labels as the similarity DataFrame, so it can be used in its place
+        self.index = pd.Index(read_json(os.path.join(path, 'rows.json')), name='Game')
+        self.columns = pd.Index(read_json(os.path.join(path, 'columns.json')), name='Game')
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    def select(self, columns):
+        '''
+        Stored entries of the given column positions as (rows, slots, values)
+        slots are positions in columns, so duplicate columns work like in the dense path
+        '''
+        columns = np.asarray(columns, dtype=np.int64)
+        starts = self.indptr[columns]
+        lengths = self.indptr[columns + 1] - starts
+
+        slots = np.repeat(np.arange(len(columns)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = starts[slots] + offsets
+        return np.asarray(self.indices[positions]), slots, np.asarray(self.data[positions])
+
+
+def load_sparse_similarity(path):
+    return SparseSimilarity(path)
+
+
+def score_games_sparse(matrix, columns, playtimes, rows=None, min_neighbors=3,
+                       neighbor_cutoff=0.15, based_on_n=3):
+    '''
+    Same as scoring.score_games, but computed from the stored entries of a SparseSimilarity
+
+    columns : column positions of the user's games
+    rows    : optional boolean mask of candidate rows (e.g. to drop games the user owns),
+              returned row positions are relative to the masked rows
+    '''
+    entry_rows, slots, values = matrix.select(columns)
+    n_rows = matrix.shape[0]
+
+    if rows is not None:
+        kept = rows[entry_rows]
+        entry_rows, slots, values = entry_rows[kept], slots[kept], values[kept]
+        entry_rows = (np.cumsum(rows) - 1)[entry_rows]
+        n_rows = np.count_nonzero(rows)
+
+    counts = np.bincount(entry_rows[values >= neighbor_cutoff], minlength=n_rows)
+    with_neighbors = np.flatnonzero(counts >= min_neighbors)
+
+    if len(with_neighbors) == 0:
+        return with_neighbors, np.empty(0), np.empty((0, based_on_n), dtype=int)
+
+    playtimes = np.asarray(playtimes, dtype=float)
+    dot_products = np.bincount(entry_rows, weights=values * playtimes[slots], minlength=n_rows)
+    predictions = normalize_predictions(dot_products[with_neighbors])
+
+    # Top based_on_n stored entries per row: sort by row, then value (desc), then column order
+    neighbor_position = np.full(n_rows, -1)
+    neighbor_position[with_neighbors] = np.arange(len(with_neighbors))
+    entry_position = neighbor_position[entry_rows]
+    scored = entry_position >= 0
+    entry_position, slots, values = entry_position[scored], slots[scored], values[scored]
+
+    order = np.lexsort((slots, -values, entry_position))
+    entry_position, slots = entry_position[order], slots[order]
+    rank = np.arange(len(order)) - np.searchsorted(entry_position, entry_position)
+    shown = rank < based_on_n
+
+    top = np.full((len(with_neighbors), based_on_n), -1)
+    top[entry_position[shown], rank[shown]] = slots[shown]
+    return with_neighbors, predictions, top
+
+
+def compare_with_dense(dense_values, matrix, columns, playtimes, rows=None, **kwargs):
+    '''
+    How far sparse scores deviate from the dense path for one user
+
+    dense_values is the full dense matrix (rows x all columns)
+    Returns a dict with neighbor mismatches, max absolute score difference,
+    and the overlap of the top 20 recommendations
+    '''
+    values = dequantize(np.asarray(dense_values).take(columns, axis=1))
+    if rows is not None:
+        values = values[rows]
+
+    dense_rows, dense_scores, _ = score_games(values, playtimes, **kwargs)
+    sparse_rows, sparse_scores, _ = score_games_sparse(matrix, columns, playtimes, rows=rows, **kwargs)
+
+    shared, dense_at, sparse_at = np.intersect1d(dense_rows, sparse_rows, return_indices=True)
+    score_diff = np.abs(dense_scores[dense_at] - sparse_scores[sparse_at])
+
+    top_dense = dense_rows[np.argsort(-dense_scores, kind='stable')[:20]]
+    top_sparse = sparse_rows[np.argsort(-sparse_scores, kind='stable')[:20]]
+
+    return {'games_scored_dense': len(dense_rows),
+            'games_scored_sparse': len(sparse_rows),
+            'neighbor_mismatches': len(dense_rows) + len(sparse_rows) - 2 * len(shared),
+            'max_score_diff': float(score_diff.max()) if len(score_diff) else 0.0,
+            'mean_score_diff': float(score_diff.mean()) if len(score_diff) else 0.0,
+            'top_20_overlap': len(np.intersect1d(top_dense, top_sparse)) / max(len(top_dense), 1)}
+
+
+def deviation_report(ism_path, sparse_path, n_users=50, games_per_user=(3, 300), seed=0, **kwargs):
+    '''
+    Compares sparse and dense scores for random users (random games and z-scored playtimes)
+    '''
+    dense_values, _, _ = load_similarity_values(ism_path)
+    matrix = load_sparse_similarity(sparse_path)
+
+    reports = [compare_with_dense(dense_values, matrix, columns, playtimes, **kwargs)
+               for (columns, playtimes) in random_profiles(dense_values.shape[1], n_users,
+                                                           games_per_user, seed)]
+
+    dense_bytes = dense_values.nbytes
+    return {'floor': matrix.floor,
+            'dense_mb': round(dense_bytes / 1e6, 1),
+            'sparse_mb': round(matrix.nbytes / 1e6, 1),
+            'stored_fraction': round(len(matrix.data) / dense_values.size, 4),
+            'users': len(reports),
+            'neighbor_mismatches': sum(r['neighbor_mismatches'] for r in reports),
+            'max_score_diff': max(r['max_score_diff'] for r in reports),
+            'mean_score_diff': float(np.mean([r['mean_score_diff'] for r in reports])),
+            'mean_top_20_overlap': float(np.mean([r['top_20_overlap'] for r in reports]))}
+
+
+if __name__ == '__main__':
+    # python -m src.sparse_similarity web_app_dataset/ism_bgg web_app_dataset/ism_bgg_sparse [floor]
+    if len(sys.argv) not in (3, 4):
+        print('Usage: python -m src.sparse_similarity <similarity matrix directory> <output directory> [floor]')
+        sys.exit(1)
+    floor = float(sys.argv[3]) if len(sys.argv) == 4 else default_floor
+    build_sparse_similarity(sys.argv[1], sys.argv[2], floor=floor)
+    for (key, value) in deviation_report(sys.argv[1], sys.argv[2], neighbor_cutoff=max(floor, 0.1),
+                                         min_neighbors=2).items():
+        print(key + ': ' + str(value))
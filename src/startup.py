@@ -0,0 +1,149 @@
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# App startup: lazy page imports, background warm-up and a startup timing report
+#
+# app.py imports a page module the first time it's selected (load_page), so
+# opening Home doesn't import pandas, numpy or the recommender, and each page
+# loads only the data it needs. Set GO_ANALOG_WARMUP=1 to also have warm_up
+# load the data of every other page in a background thread after the first
+# page has rendered (quicker first visits to the other pages, for the memory
+# of every matrix) and log the startup report (logger 'go_analog') when it's done.
+#
+#   python -m src.startup      (where cold-start time goes, in a fresh process)
+
+warmup_enabled = os.environ.get('GO_ANALOG_WARMUP', '0') != '0'
+
+# Core loaders every page needs, in the order the warm-up loads them
+page_data = OrderedDict([
+    ('go_analog_bg', ('load_vg_catalog', 'load_bg_catalog', 'load_bgg_data', 'load_bgg_alignment',
+                      'load_bg_renderer')),
+    ('go_analog_vg', ('load_vg_catalog', 'load_steam_data', 'load_steam_alignment', 'load_vg_renderer')),
+    ('game_night', ('load_vg_catalog', 'load_bgg_alignment', 'load_bg_renderer')),
+    ('sim_bg', ('load_bgg_neighbors', 'load_bg_renderer', 'load_vg_renderer')),
+    ('sim_vg', ('load_steam_neighbors', 'load_vg_renderer')),
+])
+
+started = time.perf_counter()
+timings = OrderedDict()
+_lock = threading.Lock()
+_warmup_thread = None
+
+
+@contextmanager
+def timing(name):
+    '''
+    Records how long the block took (ms) under name, the first time only
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            if name not in timings:
+                timings[name] = round((time.perf_counter() - start) * 1e3, 3)
+
+
+def load_page(module_name):
+    '''
+    Imports a page module (src.<module_name>) the first time it's selected
+    '''
+    name = 'src.' + module_name
+    if name not in sys.modules:
+        with timing('import ' + module_name):
+            importlib.import_module(name)
+    return sys.modules[name]
+
+
+def load_data(loaders):
+    from src import go_analog_core as core
+    for loader in loaders:
+        with timing(loader):
+            getattr(core, loader)()
+
+
+def page_in(values, page_size=4096):
+    '''
+    Reads one value per page of a memory-mapped array, so the first request
+    using it doesn't wait on disk
+    '''
+    flat = values.reshape(-1)
+    return float(flat[::max(page_size // flat.itemsize, 1)].sum())
+
+
+def _warm_up():
+    from src import go_analog_core as core
+    for (page, loaders) in page_data.items():
+        load_data(loaders)
+    # Dense matrices are mapped lazily, read them into the page cache
+    for loader in (core.load_bgg_data, core.load_steam_data):
+        data = loader()
+        if hasattr(data, 'to_numpy'):
+            with timing('page in ' + loader.__name__[len('load_'):]):
+                page_in(data.to_numpy())
+    with _lock:
+        timings['warm-up done'] = round((time.perf_counter() - started) * 1e3, 3)
+    from src.instrumentation import logger
+    logger.info(json.dumps({'startup': report()}))
+
+
+def warm_up():
+    '''
+    Starts the warm-up thread (with GO_ANALOG_WARMUP=1), once per process
+    (and the data version watcher, with GO_ANALOG_DATA_ROOT or ISM_SHARED_ROOT)
+    '''
+    global _warmup_thread
+    if os.environ.get('GO_ANALOG_DATA_ROOT') or os.environ.get('ISM_SHARED_ROOT'):
+        from src import go_analog_core as core
+        core.watch_data_versions()
+    with _lock:
+        if _warmup_thread is not None or not warmup_enabled:
+            return
+        _warmup_thread = threading.Thread(target=_warm_up, name='go-analog-warm-up', daemon=True)
+    _warmup_thread.start()
+
+
+def report():
+    '''
+    Startup timings so far (ms), in the order they happened
+    '''
+    with _lock:
+        return OrderedDict(timings)
+
+
+def main():
+    # Cold start in this process: library imports, the core, then every page's data
+    with timing('import numpy'):
+        import numpy
+    with timing('import pandas'):
+        import pandas
+    try:
+        with timing('import streamlit'):
+            import streamlit
+    except ImportError:
+        timings.pop('import streamlit', None)
+    with timing('import go_analog_core'):
+        from src import go_analog_core
+    for (page, loaders) in page_data.items():
+        with timing('data for ' + page):
+            load_data(loaders)
+    from src import go_analog_core as core
+    for loader in (core.load_bgg_data, core.load_steam_data):
+        data = loader()
+        if hasattr(data, 'to_numpy'):
+            with timing('page in ' + loader.__name__[len('load_'):]):
+                page_in(data.to_numpy())
+
+    width = max(len(name) for name in timings)
+    for (name, ms) in timings.items():
+        print(name.ljust(width) + ' ' + ('%.1f' % ms).rjust(10) + ' ms')
+
+
+if __name__ == '__main__':
+    main()
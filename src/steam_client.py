@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+import requests as rq
+from requests.adapters import HTTPAdapter
+
+# Client for the Steam Web API (IPlayerService/GetOwnedGames)
+# One pooled session per process, timeouts, retries with exponential backoff
+# on 429s and gateway errors, and a TTL-bounded LRU cache of owned games
+# Profiles without games (private, or not public yet) are only cached for
+# negative_ttl seconds, so a user who makes their profile public can retry
+
+steam_api_url = 'https://api.steampowered.com'
+owned_games_path = '/IPlayerService/GetOwnedGames/v1/'
+
+# Steam answers 500 for steam ids that don't exist, so 500s aren't retried
+retry_statuses = (429, 502, 503, 504)
+
+_missing = object()
+
+
+class SteamAPIError(Exception):
+    '''
+    Raised when Steam doesn't return owned games (status_code is None for network errors)
+    '''
+
+    def __init__(self, status_code, message=''):
+        super().__init__('Steam API error ' + str(status_code) + ((': ' + message) if message else ''))
+        self.status_code = status_code
+
+
+class TTLCache:
+    '''
+    Thread-safe LRU cache with a maximum number of entries and a time to live
+    '''
+
+    def __init__(self, max_size=1024, ttl=600, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        '''
+        ttl overrides the cache's time to live for this entry
+        '''
+        with self._lock:
+            self._entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SteamClient:
+    '''
+    Fetches owned games for Steam users
+    base_url can point at a local stub server for testing
+    '''
+
+    def __init__(self, api_key, base_url=steam_api_url, timeout=(3.05, 10), retries=3,
+                 backoff=0.5, max_backoff=8, pool_size=10, cache_size=1024, cache_ttl=600,
+                 negative_ttl=30):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self.negative_ttl = negative_ttl
+        self.requests_made = 0
+        self.retries_made = 0
+
+        self.session = rq.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _wait(self, attempt, response=None):
+        # Honor Retry-After (in seconds) on 429s, otherwise exponential backoff
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = self.backoff * 2 ** attempt
+        time.sleep(min(delay, self.max_backoff))
+
+    def _get(self, path, params):
+        params = dict(params, key=self.api_key)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            self.requests_made += 1
+            try:
+                response = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+            except (rq.ConnectionError, rq.Timeout) as e:
+                if last_attempt:
+                    raise SteamAPIError(None, str(e))
+                self.retries_made += 1
+                self._wait(attempt)
+                continue
+
+            if response.status_code in retry_statuses and not last_attempt:
+                self.retries_made += 1
+                self._wait(attempt, response)
+                continue
+            if response.status_code != 200:
+                raise SteamAPIError(response.status_code)
+            try:
+                return response.json()
+            except ValueError:
+                raise SteamAPIError(response.status_code, 'response is not json')
+
+    def owned_games(self, steam_id):
+        '''
+        Returns the list of owned game dicts (appid, playtime_forever, …) for steam_id,
+        or None if there are no games (e.g. the profile is private)
+        '''
+        steam_id = str(steam_id).strip()
+        cached = self.cache.get(steam_id, default=_missing)
+        if cached is not _missing:
+            return cached
+
+        data = self._get(owned_games_path, {'steamid': steam_id,
+                                             'include_played_free_games': 1,
+                                             'include_appinfo': 1})
+        # A 200 that isn't the API's json object (e.g. a proxy error page) is an API error
+        response = data.get('response') if isinstance(data, dict) else None
+        if not isinstance(data, dict) or not isinstance(response or {}, dict):
+            raise SteamAPIError(200, 'unexpected response')
+        games = (response or {}).get('games')
+        if games is not None:
+            self.cache.set(steam_id, games)
+        elif self.negative_ttl > 0:
+            self.cache.set(steam_id, games, ttl=self.negative_ttl)
+        return games
+
+    def stats(self):
+        lookups = self.cache.hits + self.cache.misses
+        return {'cache_hits': self.cache.hits,
+                'cache_misses': self.cache.misses,
+                'cache_hit_rate': self.cache.hits / lookups if lookups else 0.0,
+                'cache_size': len(self.cache),
+                'requests': self.requests_made,
+                'retries': self.retries_made}
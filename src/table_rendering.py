@@ -0,0 +1,111 @@
+import html
+import numpy as np
+import pandas as pd
+
+# HTML tables for the web app without merging and rendering the info table per request
+# A TableRenderer formats the info cells of every game in a catalog once
+# (Title link and thumbnail, ratings, Tags...), so a request only formats its
+# own columns (scores, ranking, 'Recommended because…') for the rows it shows
+# and joins strings. Tables have the layout of render_table (to_html), cells
+# are built here: text is escaped, except in html_columns. Float columns are
+# formatted per request, since pandas formats them as a whole (the number of
+# decimals depends on the other rows)
+
+cell_start = '<td align="center" valign="center">'
+
+# Columns that are already HTML: the dataset escapes Title, Tags and Steam Rating
+# (see web_app_dataset/app_dataset.ipynb), 'Recommended because…' has line breaks
+html_columns = ('Title', 'Tags', 'Steam Rating', 'Recommended because…')
+
+table_head = '<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: center;">'
+table_body = '\n    </tr>\n  </thead>\n  <tbody>'
+table_end = '\n  </tbody>\n</table>'
+
+
+def format_texts(values, is_html=False):
+    '''
+    Cell texts for an array of values, formatted as pandas formats a column
+    (floats with a common number of decimals, missing values as NaN)
+    '''
+    if len(values) == 0:
+        return []
+    if np.asarray(values).dtype.kind == 'f':
+        texts = pd.Series(values).to_string(index=False, header=False, na_rep='NaN').split('\n')
+        return [text.strip() for text in texts]
+    texts = ['NaN' if pd.isna(value) else str(value).strip() for value in values]
+    if is_html:
+        return texts
+    return [html.escape(text) for text in texts]
+
+
+def format_cells(values, is_html=False):
+    '''
+    '<td ...>...</td>' cells for an array of values (see format_texts)
+    '''
+    return np.array([cell_start + text + '</td>' for text in format_texts(values, is_html)], dtype=object)
+
+
+def render_cells(df):
+    '''
+    Cells of every column of df
+    Returns {column: array of '<td ...>...</td>' strings}
+    '''
+    return {column: format_cells(df[column].to_numpy(), column in html_columns) for column in df.columns}
+
+
+class TableRenderer:
+    '''
+    Pre-rendered HTML cells for the info table of a catalog (see catalog)
+    '''
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.info = catalog.info
+        # Float columns aren't pre-rendered, every other column is formatted one value at a time
+        static = [column for column in self.info.columns if self.info[column].dtype.kind != 'f']
+        self.cells = render_cells(self.info[static])
+
+    def html(self, positions, columns, dynamic=None):
+        '''
+        HTML table for the games at catalog positions, in that order
+        Columns in dynamic (column -> array of values for positions) are
+        formatted here, the others come from the info table
+        '''
+        dynamic = dynamic or {}
+        column_cells = []
+        for column in columns:
+            if column in dynamic:
+                column_cells.append(format_cells(dynamic[column], column in html_columns))
+            elif column in self.cells:
+                column_cells.append(self.cells[column].take(positions))
+            else:
+                column_cells.append(format_cells(self.info[column].to_numpy().take(positions)))
+
+        header = ''.join('\n      <th>' + html.escape(str(column)) + '</th>' for column in columns)
+        rows = ['\n    <tr>\n      ' + '\n      '.join(row) + '\n    </tr>' for row in zip(*column_cells)]
+        return table_head + header + table_body + ''.join(rows) + table_end
+
+    def render(self, df, columns_to_show, order_by='Title', how_many_rows=10, desc=False, reverse=False,
+               on='Game'):
+        '''
+        Same as render_table(rearrange_table(annotate_table(df, on), ...)):
+        games in df[on] that are in the catalog, the first (last if reverse)
+        how_many_rows of them, sorted by order_by
+        '''
+        positions = self.catalog.positions(df[on])
+        found = np.flatnonzero(positions >= 0)
+        if reverse == False:
+            found = found[:how_many_rows]
+        else:
+            found = found[max(len(found) - how_many_rows, 0):]
+        positions = positions[found]
+
+        def values(column):
+            if column in df.columns:
+                return df[column].to_numpy().take(found)
+            return self.info[column].to_numpy().take(positions)
+
+        # Same sort as DataFrame.sort_values on the selected rows
+        order = pd.Series(values(order_by)).sort_values(ascending=not desc).index.to_numpy()
+        dynamic = {column: values(column).take(order) for column in columns_to_show if column in df.columns}
+        return self.html(positions.take(order), columns_to_show, dynamic)
@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+# Tests run from the repo root layout (from src.xxx import ...), like the app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def core(monkeypatch):
+    '''
+    go_analog_core with empty caches and no data versions, restored afterwards
+    '''
+    from src import go_analog_core as core
+    for name in ('data_root', 'shared_root', 'version_root', '_active_version'):
+        monkeypatch.setattr(core, name, None)
+    core._cache.clear()
+    core.recommendation_cache.clear()
+    yield core
+    core._cache.clear()
+    core.recommendation_cache.clear()
+    for state in (core._in_flight, core._retired, core._failed_versions):
+        state.clear()
+
+
+@pytest.fixture
+def make_data_dir(tmp_path):
+    '''
+    Writes a small synthetic web app data directory (see benchmark.make_dataset),
+    with users, also the raw dataset CSVs the matrices are built from
+    '''
+    from src.benchmark import make_dataset
+
+    def make(name, seed=0, catalog_size=40, video_games=30, users=0):
+        path = str(tmp_path / name)
+        make_dataset(path, catalog_size, video_games, rank=4, block_size=16, seed=seed, users=users)
+        return path
+    return make
@@ -0,0 +1,35 @@
+import pandas as pd
+from src import batch_recommend, data_versions
+from src.scoring import normalize_ratings
+
+
+def test_batch_matches_recommend_games(tmp_path, make_data_dir, core, monkeypatch):
+    root = str(tmp_path / 'data')
+    core.data_root, core.version_root = root, root
+    data_versions.publish(make_data_dir('one'), root)
+    names = list(core.load_vg_data_for_web_app()['Name'])
+
+    libraries = {'1': [(name, 60 * (i + 1)) for (i, name) in enumerate(names[:6])], '2': 'No games'}
+    monkeypatch.setattr(core, 'get_games', lambda steam_id, steam_api_key: libraries[steam_id])
+    profiles = [{'user': 'a', 'games': names[3:9] + ['Not A Game']},
+                {'user': 'b', 'games': [[name, 30 * (i + 2)] for (i, name) in enumerate(names[10:16])]},
+                {'user': 'c', 'steam_id': '1'},
+                {'user': 'd', 'steam_id': '2'},
+                {'user': 'e', 'games': ['Not A Game']}]
+    settings = dict(top=5, min_neighbors=1, neighbor_cutoff=0.05, based_on_n=2)
+
+    for (workers, chunk_size) in ((1, 256), (2, 1)):
+        out, errors, unknown = batch_recommend.run_batch(profiles, steam_api_key='key', workers=workers,
+                                                         chunk_size=chunk_size, **settings)
+        assert errors == {'d': 'no games (private profile?)', 'e': 'no games in the dataset with enough playtime'}
+        assert unknown == {'a': ['Not A Game'], 'e': ['Not A Game']}
+
+        expected = {'a': [(name, 2) for name in names[3:9]],
+                    'b': normalize_ratings([(name, 30 * (i + 2)) for (i, name) in enumerate(names[10:16])]),
+                    'c': normalize_ratings(libraries['1'])}
+        assert list(out.User.unique()) == ['a', 'b', 'c'] and len(out) == 15
+        for (user, games) in expected.items():
+            with core.using_data_version():
+                recs = core.recommend_games(games, min_neighbors=1, neighbor_cutoff=0.05, based_on_n=2, top=5)
+            pd.testing.assert_frame_equal(out[out.User == user].drop(columns='User').reset_index(drop=True),
+                                          recs.reset_index(drop=True))
@@ -0,0 +1,50 @@
+import json
+import pytest
+from src import benchmark
+
+stages = ['load', 'normalize', 'filter', 'neighbors', 'dot_product', 'explanation', 'full_table', 'top_n',
+          'annotation', 'render', 'recommend', 'cached', 'find_similar']
+
+
+def test_run_times_every_stage(tmp_path, capsys):
+    out = benchmark.run(catalog_sizes=[60], library_sizes=[3, 20, 50], video_games=30, repeats=2,
+                        work_dir=str(tmp_path))
+    # Library sizes above the matrix columns are skipped, with a warning
+    assert out['meta']['video_games'] == 30 and out['meta']['skipped_library_sizes'] == [50]
+    assert '50' in capsys.readouterr().err
+    assert [(r['library_size'], r['stage']) for r in out['results']] == \
+        [(0, 'load')] + [(size, stage) for size in (3, 20) for stage in stages[1:]]
+    for result in out['results']:
+        assert result['catalog_size'] == 60 and result['repeats'] == 2
+        assert 0 <= result['p50_ms'] <= result['p95_ms'] and result['peak_mb'] >= 0
+    assert json.loads(json.dumps(out)) == out
+    # The synthetic datasets are removed afterwards
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_video_games_default_covers_the_largest_library():
+    out = benchmark.run(catalog_sizes=[], library_sizes=[3, 2500])
+    assert out['meta']['video_games'] == 2500 and out['meta']['skipped_library_sizes'] == []
+
+
+def _run(p50s):
+    return {'results': [{'catalog_size': 1000, 'library_size': 3, 'stage': stage, 'p50_ms': p50, 'peak_mb': 1.0}
+                        for (stage, p50) in p50s.items()]}
+
+
+def test_compare_flags_regressions(tmp_path):
+    before = _run({'filter': 1.0, 'render': 2.0})
+    after = _run({'filter': 1.1, 'render': 3.0})
+    df = benchmark.compare(before, after, threshold=1.2)
+    assert list(df.stage) == ['filter', 'render'] and list(df.regressed) == [False, True]
+    assert list(df.ratio) == [1.1, 1.5]
+
+    for (name, run) in (('before', before), ('after', after)):
+        with open(str(tmp_path / (name + '.json')), 'w') as f:
+            json.dump(run, f)
+    with pytest.raises(SystemExit) as exit:
+        benchmark.main(['compare', str(tmp_path / 'before.json'), str(tmp_path / 'after.json')])
+    assert exit.value.code == 1
+    with pytest.raises(SystemExit) as exit:
+        benchmark.main(['compare', str(tmp_path / 'before.json'), str(tmp_path / 'after.json'), '--threshold', '2'])
+    assert exit.value.code == 0
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from src import data_versions
+from src.similarity_store import load_similarity_values
+
+
+def _values(path):
+    return np.asarray(load_similarity_values(os.path.join(path, 'ism_bgg'))[0])
+
+
+def test_publish_and_cleanup(tmp_path, make_data_dir):
+    root = str(tmp_path / 'root')
+    first = data_versions.publish(make_data_dir('one'), root)
+    second = data_versions.publish(make_data_dir('two', seed=1), root)
+    third = data_versions.publish(make_data_dir('three', seed=2), root)
+    assert data_versions.current_version(root) == third
+
+    # Keeps the current version and one rollback version
+    assert data_versions.cleanup(root, keep=1) == [first]
+    data_versions.set_current(root, second)
+    assert data_versions.current_version(root) == second
+    assert sorted(data_versions.read_manifest(root)['versions']) == sorted([second, third])
+
+
+def test_pinned_versions_are_kept(tmp_path, make_data_dir):
+    root = str(tmp_path / 'root')
+    first = data_versions.publish(make_data_dir('one'), root)
+    data_versions.pin(root, first)
+    data_versions.publish(make_data_dir('two', seed=1), root)
+    assert data_versions.cleanup(root, keep=0) == []
+    assert data_versions.attached_pids(root, first) == [os.getpid()]
+    data_versions.unpin(root, first)
+    assert data_versions.cleanup(root, keep=0) == [first]
+
+
+def test_publish_names_and_version(tmp_path, make_data_dir):
+    data_dir = make_data_dir('one')
+    root = str(tmp_path / 'shared')
+    version = data_versions.publish(data_dir, root, names=('ism_bgg', 'ism_steam'), version='v1')
+    assert version == 'v1'
+    assert sorted(os.listdir(data_versions.version_path(root, version))) == ['.attached', 'ism_bgg']
+
+
+def test_swap_keeps_catalog_and_shared_stores_together(tmp_path, make_data_dir, core):
+    from src import shared_store
+    data_root = str(tmp_path / 'data')
+    shared_root = str(tmp_path / 'shared')
+    core.data_root, core.shared_root, core.version_root = data_root, shared_root, data_root
+
+    one = make_data_dir('one')
+    two = make_data_dir('two', seed=1, catalog_size=50)
+    for data_dir in (one, two):
+        version = data_versions.publish(data_dir, data_root, make_current=data_dir == one)
+        shared_store.publish(data_dir, shared_root, version=version, make_current=data_dir == one)
+        if data_dir == one:
+            first = version
+        else:
+            second = version
+
+    with core.using_data_version() as version:
+        assert version == first
+        assert core.store_path(core.ism_bgg_filepath) == os.path.join(shared_root, first, 'ism_bgg')
+        assert np.array_equal(core.load_bgg_data().to_numpy(), _values(one))
+        assert len(core.load_bg_catalog().names) == 40
+
+    data_versions.set_current(data_root, second)
+    assert core.check_data_version() == second
+    with core.using_data_version():
+        # Matrices (from shared memory) and catalogs (from the data root) of the same version
+        assert core.store_path(core.ism_bgg_filepath) == os.path.join(shared_root, second, 'ism_bgg')
+        assert np.array_equal(core.load_bgg_data().to_numpy(), _values(two))
+        assert len(core.load_bg_catalog().names) == 50
+        assert len(core.load_bgg_data().index) == 50
+
+    # The old version is unpinned: gone from shared memory, kept for rollbacks in the data root
+    assert not os.path.isdir(os.path.join(shared_root, first))
+    assert os.path.isdir(os.path.join(data_root, first))
+    assert data_versions.attached_pids(data_root, second) == [os.getpid()]
+
+
+def test_versions_missing_from_shared_memory_use_the_data_root(tmp_path, make_data_dir, core):
+    data_root = str(tmp_path / 'data')
+    shared_root = str(tmp_path / 'shared')
+    os.makedirs(shared_root)
+    core.data_root, core.shared_root, core.version_root = data_root, shared_root, data_root
+    version = data_versions.publish(make_data_dir('one'), data_root)
+    with core.using_data_version():
+        assert core.store_path(core.ism_bgg_filepath) == os.path.join(data_root, version, 'ism_bgg')
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from src import dataset_cache
+
+
+@pytest.fixture
+def ratings_csv(tmp_path):
+    rng = np.random.RandomState(0)
+    n = 250
+    df = pd.DataFrame({'User': rng.choice(['ann', 'bob', 'cy', 'dee', None], n),
+                       'Game': rng.choice([10, 20, 30, 40], n),
+                       'Rating': rng.uniform(1, 10, n).round(3),
+                       'Year': rng.randint(1990, 2020, n)})
+    path = str(tmp_path / 'BoardGameRatings.csv')
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_round_trip(ratings_csv, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    expected = pd.read_csv(ratings_csv)
+    # Small chunks, so columns are appended and codes are shared across chunks
+    out = dataset_cache.read_csv(ratings_csv, cache_dir, chunk_size=64)
+    assert dataset_cache.is_fresh(ratings_csv, cache_dir)
+
+    assert list(out.columns) == list(expected.columns)
+    assert out.Rating.dtype == np.float32
+    np.testing.assert_allclose(out.Rating, expected.Rating, rtol=1e-6)
+    np.testing.assert_array_equal(out.Year, expected.Year)
+    assert list(out.Game) == list(expected.Game)
+    assert list(out.User.fillna('-')) == list(expected.User.fillna('-'))
+
+    categorical = dataset_cache.read_table(cache_dir, 'BoardGameRatings', categorical=True)
+    assert list(categorical.User.astype(object).fillna('-')) == list(expected.User.fillna('-'))
+    dataset_cache.verify(cache_dir, 'BoardGameRatings')
+
+
+def test_stale_and_corrupt(ratings_csv, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    dataset_cache.ingest_csv(ratings_csv, cache_dir)
+
+    # A changed CSV is ingested again
+    df = pd.read_csv(ratings_csv).head(10)
+    df.to_csv(ratings_csv, index=False)
+    assert not dataset_cache.is_fresh(ratings_csv, cache_dir)
+    assert len(dataset_cache.read_csv(ratings_csv, cache_dir)) == 10
+
+    with open(os.path.join(cache_dir, 'BoardGameRatings', 'Year.bin'), 'r+b') as f:
+        f.write(b'\xff\xff\xff\xff')
+    with pytest.raises(ValueError):
+        dataset_cache.verify(cache_dir, 'BoardGameRatings')
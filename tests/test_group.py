@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pytest
+from src import data_versions
+from src.scoring import normalize_ratings
+
+
+@pytest.fixture
+def members(tmp_path, make_data_dir, core):
+    root = str(tmp_path / 'data')
+    core.data_root, core.version_root = root, root
+    data_versions.publish(make_data_dir('one'), root)
+    names = list(core.load_vg_data_for_web_app()['Name'])
+    rng = np.random.RandomState(0)
+    return OrderedDict((member, normalize_ratings([(name, int(rng.randint(10, 5000))) for name in games]))
+                       for (member, games) in (('Ann', names[:6]), ('Bob', names[4:12]), ('Cy', names[20:25])))
+
+
+def test_one_member_group_matches_recommend_games(members, core):
+    settings = dict(min_neighbors=1, neighbor_cutoff=0.05, based_on_n=2, top=8)
+    with core.using_data_version():
+        group = core.recommend_group_games(OrderedDict([('Ann', members['Ann'])]), **settings)
+        single = core.recommend_games(members['Ann'], **settings)
+    assert len(single) > 0
+    pd.testing.assert_frame_equal(group[['Game', 'Score', 'My Ranking']], single[['Game', 'Score', 'My Ranking']])
+    assert list(group['Recommended because…']) == [reason.replace('You play…', 'Ann plays…')
+                                                   for reason in single['Recommended because…']]
+
+
+def test_group_rules(members, core):
+    settings = dict(min_neighbors=1, neighbor_cutoff=0.05, based_on_n=2, top=50)
+    with core.using_data_version():
+        out = {rule: core.recommend_group_games(members, rule=rule, **settings)
+               for rule in ('mean', 'least_misery', 'max')}
+    for (rule, combine) in (('mean', np.nanmean), ('least_misery', np.nanmin), ('max', np.nanmax)):
+        df = out[rule]
+        assert len(df) > 0 and (df.Score > 0).all()
+        np.testing.assert_allclose(df.Score, combine(df[['Ann', 'Bob', 'Cy']].to_numpy(), axis=1).round(2))
+
+    # A member with a game that isn't in the matrix is an error
+    with pytest.raises(KeyError):
+        core.recommend_group_games(OrderedDict([('Ann', [('Not A Game', 1.0)])]))
+
+
+def test_group_fetch_keeps_the_request_data_version(tmp_path, make_data_dir, core, monkeypatch):
+    from src.instrumentation import trace
+    root = str(tmp_path / 'data')
+    core.data_root, core.version_root = root, root
+    first = data_versions.publish(make_data_dir('one', video_games=30), root)
+    # The new version has video games the old catalog doesn't have
+    two = make_data_dir('two', seed=1, video_games=40)
+
+    class Client:
+        swapped = []
+        lock = threading.Lock()
+
+        def owned_games(self, steam_id):
+            # A new version is published and swapped in while the profiles are fetched
+            with self.lock:
+                if not self.swapped:
+                    self.swapped.append(data_versions.publish(two, root))
+                    swap = threading.Thread(target=core.check_data_version)
+                    swap.start()
+                    swap.join()
+            return [{'appid': appid, 'playtime_forever': 60 * appid} for appid in range(1, 41)]
+    monkeypatch.setattr(core, 'load_steam_client', lambda steam_api_key: Client())
+
+    with trace('group') as request_trace, core.using_data_version() as version:
+        games, errors = core.get_group_games(['1', '2'], 'key', max_workers=2)
+        members = OrderedDict((steam_id, normalize_ratings(library)) for (steam_id, library) in games.items())
+        out = core.recommend_group_games(members, min_neighbors=1, neighbor_cutoff=0.05)
+
+    assert version == first and core.data_version() == Client.swapped[0]
+    assert errors == OrderedDict() and len(out) > 0
+    assert [len(library) for library in games.values()] == [30, 30]
+    assert 'steam_api' in request_trace.stages
@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from src.build_similarity import build_all
+from src.incremental_similarity import apply_updates, state_dirname, score_step, exact_tolerance
+from src.similarity_store import load_similarity_values
+
+
+@pytest.fixture
+def dataset_dir(make_data_dir):
+    # Raw ratings; user0 has too few board game ratings, so the build prunes them
+    path = make_data_dir('dataset', catalog_size=30, video_games=20, users=60)
+    bgg = pd.read_csv(os.path.join(path, 'BoardGameRatings.csv'))
+    bgg.drop(bgg.index[bgg.User == 'user0'][5:]).to_csv(os.path.join(path, 'BoardGameRatings.csv'), index=False)
+    return path
+
+
+def _values(path):
+    return np.array(load_similarity_values(path)[0])
+
+
+def _save(dataset_dir, bgg, steam):
+    bgg.to_csv(os.path.join(dataset_dir, 'BoardGameRatings.csv'), index=False)
+    steam.to_csv(os.path.join(dataset_dir, 'VideoGamePlaytimes.csv'), index=False)
+
+
+def _assert_matches_full_build(out_dir, dataset_dir, full_dir):
+    build_all(dataset_dir, full_dir)
+    for name in ('ism_bgg', 'ism_steam'):
+        updated, rows, columns = load_similarity_values(os.path.join(out_dir, name))
+        full, full_rows, full_columns = load_similarity_values(os.path.join(full_dir, name))
+        assert (rows, columns) == (full_rows, full_columns)
+        assert np.abs(np.asarray(updated) - np.asarray(full)).max() <= score_step + exact_tolerance
+
+
+def test_update_matches_a_full_build_and_swaps_files(tmp_path, dataset_dir):
+    out_dir = str(tmp_path / 'out')
+    build_all(dataset_dir, out_dir, keep_state=True)
+    live, _, _ = load_similarity_values(os.path.join(out_dir, 'ism_bgg'))
+    before = np.array(live)
+
+    # Changed scores of users the matrices were built with
+    bgg = pd.read_csv(os.path.join(dataset_dir, 'BoardGameRatings.csv'))
+    steam = pd.read_csv(os.path.join(dataset_dir, 'VideoGamePlaytimes.csv'))
+    bgg_updates = bgg[bgg.User.isin(['user1', 'user2'])].assign(Rating=lambda df: 11 - df.Rating)
+    steam_updates = steam[steam.User == 'user3'].assign(Playtime=lambda df: df.Playtime * 3)
+    report = apply_updates(out_dir, bgg_updates, steam_updates)
+    assert report['users'] == 3
+    assert report['pruned_users'] == []
+
+    # A reader that had the matrix mapped still sees the old values
+    assert np.array_equal(np.asarray(live), before)
+    assert not [name for name in os.listdir(os.path.join(out_dir, 'ism_bgg')) if name.endswith('.tmp')]
+    assert not np.array_equal(_values(os.path.join(out_dir, 'ism_bgg')), before)
+    assert os.path.isdir(os.path.join(out_dir, state_dirname))
+
+    bgg.loc[bgg_updates.index, 'Rating'] = bgg_updates.Rating
+    steam.loc[steam_updates.index, 'Playtime'] = steam_updates.Playtime
+    _save(dataset_dir, bgg, steam)
+    _assert_matches_full_build(out_dir, dataset_dir, str(tmp_path / 'full'))
+
+
+def test_rows_from_users_the_build_pruned_are_skipped(tmp_path, dataset_dir):
+    out_dir = str(tmp_path / 'out')
+    build_all(dataset_dir, out_dir, keep_state=True)
+    before = {name: _values(os.path.join(out_dir, name)) for name in ('ism_bgg', 'ism_steam')}
+
+    bgg = pd.read_csv(os.path.join(dataset_dir, 'BoardGameRatings.csv'))
+    steam = pd.read_csv(os.path.join(dataset_dir, 'VideoGamePlaytimes.csv'))
+    pruned = pd.DataFrame({'User': ['user0', 'user0', 'newcomer'], 'Game': [1, 2, 3], 'Rating': [9.0, 1.0, 5.0]})
+    report = apply_updates(out_dir, pruned, steam[steam.User == 'newcomer'])
+    assert report['pruned_users'] == ['newcomer', 'user0']
+    assert report['users'] == 0 and report['ratings'] == 0 and report['skipped'] == 3
+    for (name, values) in before.items():
+        assert np.array_equal(_values(os.path.join(out_dir, name)), values)
+
+    # Mixed with rows from kept users, only those are applied
+    updates = pd.concat([pruned, bgg[bgg.User == 'user4'].assign(Rating=lambda df: 11 - df.Rating)])
+    report = apply_updates(out_dir, updates)
+    assert report['pruned_users'] == ['newcomer', 'user0'] and report['users'] == 1
+
+    bgg.loc[bgg.User == 'user4', 'Rating'] = 11 - bgg.loc[bgg.User == 'user4', 'Rating']
+    _save(dataset_dir, bgg, steam)
+    _assert_matches_full_build(out_dir, dataset_dir, str(tmp_path / 'full'))
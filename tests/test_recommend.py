@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+from src import data_versions
+
+
+def test_profile_is_scored_as_given(tmp_path, make_data_dir, core):
+    root = str(tmp_path / 'data')
+    core.data_root, core.version_root = root, root
+    data_versions.publish(make_data_dir('one'), root)
+
+    names = list(core.load_vg_data_for_web_app()['Name'])
+    rng = np.random.RandomState(0)
+    # Unsorted z-scores that rounding to 2 decimals would reorder: the canonical
+    # form only keys the cache
+    games = [(name, float(z)) for (name, z) in zip(rng.permutation(names)[:8], rng.randn(8) * 0.01)]
+    positions = core.load_vg_catalog().positions([name for (name, z) in games])
+
+    with core.using_data_version():
+        out = core.recommend_games(games, min_neighbors=1, neighbor_cutoff=0.05, top=10)
+        expected = core._recommend_games(games, positions, 'bgg', 1, 0.05, 3, True, top=10)
+    pd.testing.assert_frame_equal(out, expected)
+
+    # A reordered profile with the same canonical form is a cache hit
+    with core.using_data_version():
+        again = core.recommend_games(games[::-1], min_neighbors=1, neighbor_cutoff=0.05, top=10)
+    pd.testing.assert_frame_equal(again, out)
+    assert len(core.recommendation_cache) == 1
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.scoring import (TopColumns, top_n_columns, score_games, build_recommendations, select_recommendations,
+                         recommendation_scores, combine_scores, select_group_recommendations, popular_game_reason)
+
+
+def _values(n_rows=60, n_cols=8, seed=0):
+    # Rounded like the stored matrices, so there are ties, and a few missing scores
+    rng = np.random.RandomState(seed)
+    values = rng.uniform(-0.3, 0.6, (n_rows, n_cols)).round(1)
+    values[rng.rand(n_rows, n_cols) < 0.1] = np.nan
+    return values
+
+
+def test_top_n_columns_matches_nlargest():
+    values = _values()
+    top = top_n_columns(values, 3)
+    for (row, columns) in zip(values, top):
+        expected = pd.Series(row).nlargest(3).index.to_numpy()
+        assert list(columns) == list(expected) + [-1] * (3 - len(expected))
+
+
+def test_top_columns_subset_matches_every_row():
+    values = _values()
+    top = TopColumns(values, 3)
+    rows = np.array([5, 0, 17, 59])
+    assert len(top) == len(values)
+    np.testing.assert_array_equal(top[rows], top_n_columns(values, 3)[rows])
+    np.testing.assert_array_equal(top[:], top_n_columns(values, 3))
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_selected_explanations_match_full_table(reverse):
+    values = _values()
+    names = ['Game ' + str(i) for i in range(len(values))]
+    columns = ['Video Game ' + str(i) for i in range(values.shape[1])]
+    playtimes = np.random.RandomState(1).randn(values.shape[1])
+    averages = np.random.RandomState(2).randn(len(values)).round(2)
+    result = score_games(values, playtimes, min_neighbors=2, neighbor_cutoff=0.2, based_on_n=3)
+
+    full = build_recommendations(names, columns, *result, averages=averages)
+    full = full[full.Score < 0] if reverse else full[full.Score > 0]
+    expected = full.tail(7) if reverse else full.head(7)
+    selected = select_recommendations(names, columns, *result, 7, averages=averages, reverse=reverse)
+    pd.testing.assert_frame_equal(selected, expected)
+
+
+def test_combine_scores():
+    member_scores = np.array([[1.0, -100, -100, 0.5],
+                              [-1.0, 2.0, -100, 0.25]])
+    np.testing.assert_array_equal(combine_scores(member_scores, 'mean'), [0.0, 2.0, -100, 0.38])
+    np.testing.assert_array_equal(combine_scores(member_scores, 'least_misery'), [-1.0, 2.0, -100, 0.25])
+    np.testing.assert_array_equal(combine_scores(member_scores, 'max'), [1.0, 2.0, -100, 0.5])
+    with pytest.raises(ValueError):
+        combine_scores(member_scores, 'median')
+
+
+def test_select_group_recommendations():
+    names = ['A', 'B', 'C', 'D']
+    # Ann's games have neighbors for A and B, Bob's for B and C, D only has an average
+    ann = (np.array([0, 1]), np.array([1.0, -0.5]), np.array([[0, 1], [1, 0]]))
+    bob = (np.array([1, 2]), np.array([1.5, 0.5]), np.array([[1, 0], [0, 1]]))
+    members = [('Ann', ['Portal', 'Doom'], ann), ('Bob', ['Myst', 'Halo'], bob)]
+    averages = np.array([0.1, 0.2, 0.3, 0.4])
+
+    out = select_group_recommendations(names, members, 10, rule='mean', averages=averages)
+    assert list(out.Game) == ['A', 'B', 'C', 'D']
+    assert list(out.Score) == [0.55, 0.5, 0.4, 0.4]
+    ann_scores = recommendation_scores(4, ann[0], ann[1], averages)
+    np.testing.assert_array_equal(out.Ann.to_numpy(), ann_scores[out.index])
+    assert list(out['My Ranking']) == ['#1', '#2', '#3', '#4']
+
+    # The member who likes the game most and has neighbors for it explains it
+    reasons = dict(zip(out.Game, out['Recommended because…']))
+    assert reasons['A'] == 'Ann plays…<br>Portal<br>Doom'
+    assert reasons['B'] == 'Bob plays…<br>Halo<br>Myst'
+    assert reasons['C'] == 'Bob plays…<br>Myst<br>Halo'
+    assert reasons['D'] == popular_game_reason
+
+    # Without averages, members without a score for a game are left out
+    out = select_group_recommendations(names, members, 10, rule='max', rows=np.array([1, 1, 0, 1], bool))
+    assert list(out.Game) == ['B', 'A']
+    assert list(out.Score) == [1.5, 1.0] and np.isnan(out.Bob[0])
@@ -0,0 +1,26 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import pytest
+from src import service
+
+
+def test_unexpected_errors_are_json_500(core, monkeypatch):
+    def broken(game_name, neighbor_index, reverse=False):
+        raise RuntimeError('broken index')
+    monkeypatch.setattr(core, 'load_steam_neighbors', lambda: None)
+    monkeypatch.setattr(core, 'find_similar_games', broken)
+
+    server = service.make_server(port=0, preload=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises(HTTPError) as error:
+            urlopen('http://127.0.0.1:' + str(server.server_port) + '/similar?game=Portal')
+        assert error.value.code == 500
+        assert error.value.headers['Content-Type'] == 'application/json'
+        assert json.loads(error.value.read()) == {'error': 'internal server error'}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+from src import data_versions, shared_store
+from src.similarity_store import load_similarity_values
+
+
+def _values(path):
+    return np.asarray(load_similarity_values(os.path.join(path, 'ism_bgg'))[0])
+
+
+def test_publish_copies_only_the_stores(tmp_path, make_data_dir):
+    root = str(tmp_path / 'shared')
+    version = shared_store.publish(make_data_dir('one'), root)
+    assert sorted(os.listdir(data_versions.version_path(root, version))) == \
+        ['.attached', 'ism_bgg', 'ism_bgg_neighbors']
+
+
+def test_workers_reattach_to_a_new_version(tmp_path, make_data_dir, core):
+    root = str(tmp_path / 'shared')
+    core.shared_root = core.version_root = root
+    one = make_data_dir('one')
+    two = make_data_dir('two', seed=1)
+    first = shared_store.publish(one, root)
+
+    assert np.array_equal(core.load_bgg_data().to_numpy(), _values(one))
+    assert data_versions.attached_pids(root, first) == [os.getpid()]
+
+    # A request that started before the publish keeps the old mapping
+    with core.using_data_version() as version:
+        second = shared_store.publish(two, root)
+        # Still pinned, so publishing doesn't remove it
+        assert os.path.isdir(data_versions.version_path(root, first))
+        assert core.check_data_version() == second
+        assert version == first
+        assert np.array_equal(core.load_bgg_data().to_numpy(), _values(one))
+
+    # New requests get the new version, and the old one is unpinned and removed
+    assert core.data_version() == second
+    assert np.array_equal(core.load_bgg_data().to_numpy(), _values(two))
+    assert core.store_path(core.ism_bgg_filepath) == os.path.join(root, second, 'ism_bgg')
+    assert not os.path.isdir(data_versions.version_path(root, first))
+    assert data_versions.attached_pids(root, second) == [os.getpid()]
+    assert [version['version'] for version in data_versions.status(root)] == [second]
+
+
+def test_clear_cache_releases_the_version(tmp_path, make_data_dir, core):
+    root = str(tmp_path / 'shared')
+    core.shared_root = core.version_root = root
+    first = shared_store.publish(make_data_dir('one'), root)
+    core.load_bgg_data()
+    core.clear_cache()
+    assert data_versions.attached_pids(root, first) == []
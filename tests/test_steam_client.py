@@ -0,0 +1,61 @@
+import pytest
+from src.steam_client import TTLCache, SteamClient, SteamAPIError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_entries():
+    clock = Clock()
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', None, ttl=1)
+    assert cache.get('a') == 1 and cache.get('b', default='missing') is None
+    clock.now = 5
+    assert cache.get('a') == 1 and cache.get('b', default='missing') == 'missing'
+    cache.set('c', 3)
+    cache.set('d', 4)
+    assert len(cache) == 2 and cache.get('a') is None
+
+
+def test_profiles_without_games_are_cached_briefly():
+    clock = Clock()
+    client = SteamClient('key', cache_ttl=600, negative_ttl=30)
+    client.cache.clock = clock
+    responses = {'1': {'response': {}}, '2': {'response': {'games': [{'appid': 10, 'playtime_forever': 5}]}}}
+    calls = []
+
+    def get(path, params):
+        calls.append(params['steamid'])
+        return responses[params['steamid']]
+    client._get = get
+
+    assert client.owned_games('1') is None and client.owned_games('2')[0]['appid'] == 10
+    assert client.owned_games('1') is None and client.owned_games('2') is not None
+    assert calls == ['1', '2']
+
+    # The private profile is public now
+    responses['1'] = responses['2']
+    clock.now = 31
+    assert client.owned_games('1') is not None and client.owned_games('2') is not None
+    assert calls == ['1', '2', '1']
+
+    client = SteamClient('key', negative_ttl=0)
+    client._get = get
+    responses['1'] = {'response': {}}
+    client.owned_games('1')
+    assert len(client.cache) == 0
+
+
+def test_unexpected_json_is_an_api_error():
+    client = SteamClient('key')
+    for body in ([], 'Bad gateway', None, {'response': ['games']}):
+        client._get = lambda path, params: body
+        with pytest.raises(SteamAPIError):
+            client.owned_games('1')
+    assert len(client.cache) == 0
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+from src import data_versions
+from src.benchmark import show_columns
+from src.table_rendering import format_texts
+
+
+def test_render_games_matches_render_table(tmp_path, make_data_dir, core):
+    root = str(tmp_path / 'data')
+    core.data_root, core.version_root = root, root
+    data_versions.publish(make_data_dir('one'), root)
+
+    names = list(core.load_vg_data_for_web_app()['Name'])
+    games = [(name, float(z)) for (name, z) in zip(names[:6], np.random.RandomState(0).randn(6))]
+    with core.using_data_version():
+        recs = core.recommend_games(games, min_neighbors=1, neighbor_cutoff=0.05)
+        for (order_by, desc, reverse) in (('Score', True, False), ('Name', False, True), ('BGG Rating', True, False)):
+            columns = show_columns + ['Score']
+            old = core.render_table(core.rearrange_table(core.annotate_table(recs), columns, order_by, 7,
+                                                         desc, reverse))
+            assert core.render_games(recs, columns, 'bgg', order_by, 7, desc, reverse) == old
+
+
+def test_format_texts():
+    # Floats share their number of decimals, like a pandas column
+    assert format_texts(np.array([1.5, 2.25, np.nan])) == ['1.50', '2.25', 'NaN']
+    assert format_texts(np.array(['a < b', '#1'], dtype=object)) == ['a &lt; b', '#1']
+    assert format_texts(np.array(['<br>'], dtype=object), is_html=True) == ['<br>']
+    assert format_texts(pd.Series([], dtype=float).to_numpy()) == []